@@ -0,0 +1,233 @@
+"""有界数据库连接池
+
+Flask 后端（饮食规划、运动推荐）共用，每个请求不再重新建立 TCP 连接与认证：
+- 连接数上限 max_size，借满后等待 acquire_timeout 秒，超时抛出 PoolTimeout；
+- 健康检查：空闲超过 ping_after 秒的连接在借出前 ping 一次，失败则丢弃并新建；
+- 回收：存活超过 recycle 秒的连接在借出或归还时关闭（早于 MySQL wait_timeout，避免拿到被服务端断开的连接）；
+- 预处理语句：PooledConnection.execute(sql, params) 在每条连接上按 SQL 缓存服务端预处理游标，
+  固定查询只在该连接上 PREPARE 一次；
+- stats()：可直接交给 service_metrics.register_pool 输出。
+
+    pool = mysql_pool("meal_plan", DB_CONFIG)
+    with pool.connection() as conn:
+        rows = conn.execute(QUERY, (min_cal, max_cal))
+
+其他目录的服务通过 sys.path 引入本目录：
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from service_metrics import stage
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+DB_POOL_RECYCLE_SECONDS = float(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+DB_POOL_PING_AFTER_SECONDS = float(os.getenv("DB_POOL_PING_AFTER_SECONDS", "30"))
+
+
+class PoolTimeout(RuntimeError):
+    """连接池已借满且等待超时"""
+
+
+class PooledConnection:
+    def __init__(self, raw, pool: "ConnectionPool"):
+        self.raw = raw
+        self.pool = pool
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self._prepared = {}
+
+    def cursor(self, **kwargs):
+        return self.raw.cursor(**kwargs)
+
+    def execute(self, sql: str, params=(), dictionary: bool = True):
+        """用缓存的服务端预处理游标执行查询并取回全部结果；dictionary=True 时每行转为 dict"""
+        cursor = self._prepared.get(sql)
+        if cursor is None:
+            cursor = self.raw.cursor(prepared=True)
+            self._prepared[sql] = cursor
+        with stage("db_lookup"):
+            cursor.execute(sql, tuple(params))
+            rows = cursor.fetchall()
+        if not dictionary:
+            return rows
+        names = [d[0] for d in cursor.description or ()]
+        return [dict(zip(names, row)) for row in rows]
+
+    def close(self):
+        for cursor in self._prepared.values():
+            try:
+                cursor.close()
+            except Exception:
+                pass
+        self._prepared.clear()
+        try:
+            self.raw.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    def __init__(self, connect, name: str = "default", max_size: int = DB_POOL_SIZE,
+                 acquire_timeout: float = DB_POOL_TIMEOUT, recycle: float = DB_POOL_RECYCLE_SECONDS,
+                 ping_after: float = DB_POOL_PING_AFTER_SECONDS, ping=None, reset=None):
+        """connect() 返回新的原始连接；ping(raw) 健康检查失败时抛异常；reset(raw) 在归还时清理会话状态（如回滚）"""
+        self.name = name
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self._connect = connect
+        self._ping = ping
+        self._reset = reset
+        self._idle = []  # 后进先出：优先复用最近用过的连接，多余的连接自然变老被回收
+        self._open = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._cond = threading.Condition()
+        self._counters = {"created": 0, "recycled": 0, "discarded": 0, "ping_failures": 0, "timeouts": 0}
+
+    # ---------- 借出与归还 ----------
+    def acquire(self, timeout: float = None) -> PooledConnection:
+        timeout = self.acquire_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._open < self.max_size:
+                    self._open += 1  # 先占位，在锁外建立连接
+                    self._in_use += 1
+                    conn = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters["timeouts"] += 1
+                    raise PoolTimeout(f"连接池 {self.name} 已借满（{self.max_size}），等待 {timeout}s 超时")
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+        try:
+            if conn is not None:
+                conn = self._validate(conn)
+            return conn or self._create()
+        except BaseException:
+            with self._cond:
+                self._open -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn: PooledConnection, discard: bool = False):
+        now = time.monotonic()
+        if discard:
+            self._count("discarded")
+        elif self._reset is not None:
+            try:
+                self._reset(conn.raw)
+            except Exception:
+                discard = True
+                self._count("discarded")
+        if not discard and now - conn.created_at > self.recycle:
+            discard = True
+            self._count("recycled")
+        if discard:
+            conn.close()
+        conn.last_used = now
+        with self._cond:
+            self._in_use -= 1
+            if discard:
+                self._open -= 1
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout: float = None):
+        """借出一条连接；块内抛出数据库异常时丢弃该连接（状态未知），其余异常正常归还"""
+        conn = self.acquire(timeout)
+        discard = False
+        try:
+            yield conn
+        except Exception as e:
+            discard = _is_connection_error(e)
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    def _create(self) -> PooledConnection:
+        with stage("db_connect"):
+            raw = self._connect()
+        self._count("created")
+        return PooledConnection(raw, self)
+
+    def _validate(self, conn: PooledConnection):
+        """过期的连接关闭后返回 None（由调用方新建）；空闲较久的连接先 ping"""
+        now = time.monotonic()
+        if now - conn.created_at > self.recycle:
+            self._count("recycled")
+            conn.close()
+            return None
+        if self._ping is not None and now - conn.last_used > self.ping_after:
+            try:
+                self._ping(conn.raw)
+            except Exception:
+                self._count("ping_failures")
+                conn.close()
+                return None
+        return conn
+
+    # ---------- 状态 ----------
+    def _count(self, key: str):
+        with self._cond:
+            self._counters[key] += 1
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "max_size": self.max_size,
+                "open": self._open,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                **self._counters,
+            }
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for conn in idle:
+            conn.close()
+
+
+def _is_connection_error(e: Exception) -> bool:
+    """mysql.connector 的异常都继承自 mysql.connector.Error；按模块名判断，避免本模块依赖驱动"""
+    return type(e).__module__.startswith("mysql.connector") or isinstance(e, (ConnectionError, OSError))
+
+
+# ---------- MySQL ----------
+def mysql_pool(name: str, config: dict, **kwargs) -> ConnectionPool:
+    """mysql.connector 连接池；config 与 mysql.connector.connect 的参数相同。连接在首次借出时才建立"""
+    import mysql.connector
+
+    def connect():
+        return mysql.connector.connect(**config)
+
+    def ping(raw):
+        raw.ping(reconnect=False)
+
+    def reset(raw):
+        # 未提交的事务不能带给下一个使用者；自动提交模式下回滚是空操作
+        if raw.in_transaction:
+            raw.rollback()
+
+    return ConnectionPool(connect, name=name, ping=ping, reset=reset, **kwargs)
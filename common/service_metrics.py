@@ -0,0 +1,290 @@
+"""服务指标（Prometheus 文本格式）
+
+各服务共用的轻量指标模块，不依赖 prometheus_client：
+- instrument_fastapi(app, service) / instrument_flask(app, service)：按路由统计请求数、耗时直方图、处理中请求数，
+  并注册 GET /metrics；
+- stage("depth")：上下文管理器 / 装饰器（同步与协程均可），统计内部阶段耗时与异常数；
+- register_pool(name, stats_fn)：抓取时调用 stats_fn() 读取连接池状态，输出为 db_pool_connections{pool,state}；
+  SQLAlchemy 引擎可直接用 sqlalchemy_pool_stats(engine)。
+
+其他目录的服务通过 sys.path 引入本目录：
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+"""
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: dict = None) -> str:
+    pairs = list(zip(names, values)) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+# ---------- 指标类型 ----------
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, {}, value) for key, value in self._values.items()]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        out = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                cumulative = 0
+                for bound, c in zip(self.buckets, counts):
+                    cumulative += c
+                    out.append((f"{self.name}_bucket", key, {"le": _format_value(bound)}, cumulative))
+                out.append((f"{self.name}_bucket", key, {"le": "+Inf"}, count))
+                out.append((f"{self.name}_sum", key, {}, total))
+                out.append((f"{self.name}_count", key, {}, count))
+        return out
+
+
+# ---------- 注册表 ----------
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, help, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labelnames, **kwargs)
+            return metric
+
+    def counter(self, name: str, help: str, labelnames: tuple = ()) -> Counter:
+        return self._get_or_create(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str, labelnames: tuple = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, help, labelnames)
+
+    def histogram(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help, labelnames, buckets=buckets)
+
+    def register_pool(self, name: str, stats_fn):
+        with self._lock:
+            self._pools[name] = stats_fn
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+            pools = list(self._pools.items())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, key, extra, value in metric.samples():
+                lines.append(f"{name}{_format_labels(metric.labelnames, key, extra)} {_format_value(value)}")
+
+        if pools:
+            lines.append("# HELP db_pool_connections 数据库连接池状态（抓取时读取）")
+            lines.append("# TYPE db_pool_connections gauge")
+            for pool, stats_fn in pools:
+                try:
+                    stats = stats_fn()
+                except Exception:
+                    continue
+                for state, value in stats.items():
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        lines.append(f"db_pool_connections{_format_labels(('pool', 'state'), (pool, state))} "
+                                     f"{_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+REQUESTS = REGISTRY.counter("http_requests_total", "请求数", ("service", "method", "route", "status"))
+REQUEST_LATENCY = REGISTRY.histogram("http_request_duration_seconds", "请求耗时（秒）", ("service", "method", "route"))
+IN_FLIGHT = REGISTRY.gauge("http_requests_in_flight", "处理中的请求数", ("service",))
+STAGE_LATENCY = REGISTRY.histogram("stage_duration_seconds", "内部阶段耗时（秒）", ("stage",))
+STAGE_ERRORS = REGISTRY.counter("stage_errors_total", "内部阶段异常数", ("stage",))
+
+register_pool = REGISTRY.register_pool
+
+
+def sqlalchemy_pool_stats(engine) -> dict:
+    """SQLAlchemy 连接池状态；NullPool 等没有对应方法的池只输出能取到的项"""
+    stats = {}
+    for state, attr in (("size", "size"), ("in_use", "checkedout"), ("idle", "checkedin"), ("overflow", "overflow")):
+        fn = getattr(engine.pool, attr, None)
+        if callable(fn):
+            stats[state] = fn()
+    return stats
+
+
+# ---------- 阶段计时 ----------
+@contextmanager
+def _stage_context(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=name)
+        raise
+    finally:
+        STAGE_LATENCY.observe(time.perf_counter() - t0, stage=name)
+
+
+class stage:
+    """with stage("segmentation"): ...  或  @stage("db_lookup")"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._ctx = None
+
+    def __enter__(self):
+        self._ctx = _stage_context(self.name)
+        return self._ctx.__enter__()
+
+    def __exit__(self, *exc):
+        return self._ctx.__exit__(*exc)
+
+    def __call__(self, fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with _stage_context(self.name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _stage_context(self.name):
+                return fn(*args, **kwargs)
+        return wrapper
+
+
+def _record_request(service: str, method: str, route: str, status: int, seconds: float):
+    REQUESTS.inc(service=service, method=method, route=route, status=status)
+    REQUEST_LATENCY.observe(seconds, service=service, method=method, route=route)
+
+
+# ---------- FastAPI ----------
+def instrument_fastapi(app, service: str):
+    from starlette.responses import Response
+
+    @app.middleware("http")
+    async def metrics_middleware(request, call_next):
+        if request.url.path == "/metrics":
+            return await call_next(request)
+        IN_FLIGHT.inc(service=service)
+        t0 = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            IN_FLIGHT.dec(service=service)
+            # 用路由模板而不是实际路径作标签，避免 /images/{...} 之类的路径产生无限多的序列
+            route = getattr(request.scope.get("route"), "path", "unmatched")
+            _record_request(service, request.method, route, status, time.perf_counter() - t0)
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+# ---------- Flask ----------
+def instrument_flask(app, service: str):
+    from flask import Response, g, request
+
+    @app.before_request
+    def _metrics_start():
+        if request.path != "/metrics":
+            g._metrics_start = time.perf_counter()
+            IN_FLIGHT.inc(service=service)
+
+    @app.after_request
+    def _metrics_status(response):
+        g._metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def _metrics_finish(exc):
+        t0 = g.pop("_metrics_start", None)
+        if t0 is None:
+            return
+        IN_FLIGHT.dec(service=service)
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        status = g.pop("_metrics_status", 500)
+        _record_request(service, request.method, route, status, time.perf_counter() - t0)
+
+    app.add_url_rule("/metrics", "metrics", lambda: Response(REGISTRY.render(), mimetype=CONTENT_TYPE))
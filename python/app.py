@@ -1,9 +1,18 @@
-from flask import Flask, request, jsonify
+import os
+import sys
+import json
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 import main  
+import plan_cache
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from service_metrics import instrument_flask
 
 app = Flask(__name__)
 CORS(app) 
+instrument_flask(app, "meal_plan")
+plan_cache.start_warm_up()  # PLAN_CACHE_WARMUP 未设置时不做任何事
 
 # 数据验证函数，确保前端传入的数据符合要求
 def validate_data(data):
@@ -60,6 +69,27 @@ def get_meal_plan():
     except Exception as e:
         return jsonify({"error": f"处理失败: {str(e)}"}), 500
 
+# 批量接口：请求体为 JSON 数组，或 NDJSON（每行一个用户）；结果按输入顺序逐行流式返回（application/x-ndjson），
+# 每行带 index（及请求中的 id），无效记录返回 errors 而不影响其他记录
+@app.route('/api/get_meal_plan_batch', methods=['POST'])
+def get_meal_plan_batch():
+    if request.mimetype in ("application/x-ndjson", "application/jsonl"):
+        records = main.read_profiles(request.stream.read().decode("utf-8").splitlines(), "jsonl")
+    else:
+        records = request.get_json(silent=True)
+        if not isinstance(records, list):
+            return jsonify({"error": "请提供 JSON 数组或 NDJSON 格式的数据"}), 400
+
+    def generate():
+        try:
+            for result in main.process_batch(records):
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        except Exception as e:
+            # 响应头已经发出，只能在流中报告错误
+            yield json.dumps({"error": f"处理失败: {str(e)}"}, ensure_ascii=False) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
 if __name__ == '__main__':
     # 启动服务，默认端口5000
     app.run(debug=True, host='0.0.0.0')
@@ -1,3 +1,6 @@
+import numpy as np
+
+
 def calculate_bmr(sex: str, age: int, height: int, weight: float) -> float:
     """使用Mifflin-St Jeor公式计算基础代谢率"""
     if sex.lower() == 'male':
@@ -23,4 +26,21 @@ def calculate_daily_intake(bmr: float, activity_factor: float,
     
     min_intake = 1500 if sex.lower() == 'male' else 1200
     daily_intake = tdee - daily_deficit
-    return max(daily_intake, min_intake)
\ No newline at end of file
+    return max(daily_intake, min_intake)
+
+
+# ---------- 批量（整批用户一次数组运算） ----------
+def calculate_bmr_batch(sex, age, height, weight):
+    """calculate_bmr 的向量化版本，参数为等长数组，sex 取值 'male' / 'female'"""
+    male = np.char.lower(np.asarray(sex, dtype=str)) == 'male'
+    base = 10 * np.asarray(weight, dtype=float) + 6.25 * np.asarray(height, dtype=float) - 5 * np.asarray(age, dtype=float)
+    return base + np.where(male, 5, -161)
+
+
+def calculate_daily_intake_batch(bmr, activity_factor, current_weight, target_weight, weeks, sex):
+    """calculate_daily_intake 的向量化版本，逐元素结果与标量版一致"""
+    tdee = np.asarray(bmr, dtype=float) * np.asarray(activity_factor, dtype=float)
+    weight_loss = np.asarray(current_weight, dtype=float) - np.asarray(target_weight, dtype=float)
+    daily_deficit = np.minimum(weight_loss * 7700 / (np.asarray(weeks, dtype=float) * 7), 500)
+    min_intake = np.where(np.char.lower(np.asarray(sex, dtype=str)) == 'male', 1500, 1200)
+    return np.where(weight_loss <= 0, tdee, np.maximum(tdee - daily_deficit, min_intake))
@@ -1,40 +1,68 @@
+import os
+import sys
 import mysql.connector
 from config import DB_CONFIG
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from db_pool import PoolTimeout, mysql_pool
+from service_metrics import register_pool
 
-def get_db_connection():
-    try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        return conn
-    except mysql.connector.Error as e:
-        print(f"数据库连接失败: {e}")
-        return None
-
+# 进程级连接池：连接在首次使用时建立，之后复用（健康检查、定期回收见 common/db_pool.py）
+POOL = mysql_pool("meal_plan", DB_CONFIG)
+register_pool("meal_plan", POOL.stats)
 
-def get_foods_by_criteria(min_cal, max_cal, categories=None):
-    conn = get_db_connection()
-    if not conn:
-        return []
+FOOD_COLUMNS = ("food_name", "category_id", "calories_per_100g",
+                "protein_per_100g", "fat_per_100g", "carbohydrate_per_100g")
 
-    cursor = conn.cursor(dictionary=True)
-    query = """
-    SELECT food_name, category_id, calories_per_100g, 
-           protein_per_100g, fat_per_100g, carbohydrate_per_100g 
-    FROM foods 
+FOODS_BY_CALORIES = f"""
+    SELECT {', '.join(FOOD_COLUMNS)}
+    FROM foods
     WHERE calories_per_100g BETWEEN %s AND %s
     """
+
+ALL_FOODS = f"SELECT {', '.join(FOOD_COLUMNS)} FROM foods"
+
+FOODS_SIGNATURE = """
+    SELECT COUNT(*),
+           COALESCE(SUM(CRC32(CONCAT_WS('|', food_name, category_id, calories_per_100g,
+                                        protein_per_100g, fat_per_100g, carbohydrate_per_100g))), 0)
+    FROM foods
+    """
+
+
+def get_foods_by_criteria(min_cal, max_cal, categories=None):
+    query = FOODS_BY_CALORIES
     params = [min_cal, max_cal]
 
     if categories:
+        # 不同类别数对应不同的语句文本，各自缓存一份预处理语句
         query += " AND category_id IN (%s)" % ",".join(["%s"] * len(categories))
         params.extend(categories)
 
     try:
-        cursor.execute(query, params)
-        return cursor.fetchall()
-    except mysql.connector.Error as e:
+        with POOL.connection() as conn:
+            return conn.execute(query, params)
+    except (mysql.connector.Error, PoolTimeout) as e:
         print(f"数据库查询失败: {e}")
         return []
-    finally:
-        cursor.close()
-        conn.close()
\ No newline at end of file
+
+
+def load_all_foods():
+    """整表读取（保持表的自然顺序），供 food_catalog 建立内存目录；失败返回 None 以区别于空表"""
+    try:
+        with POOL.connection() as conn:
+            return conn.execute(ALL_FOODS, dictionary=False)
+    except (mysql.connector.Error, PoolTimeout) as e:
+        print(f"数据库查询失败: {e}")
+        return None
+
+
+def get_foods_signature():
+    """foods 表的内容签名 (行数, 各行校验和之和)，任何增删改都会改变它；失败返回 None"""
+    try:
+        with POOL.connection() as conn:
+            count, checksum = conn.execute(FOODS_SIGNATURE, dictionary=False)[0]
+            return int(count), int(checksum)
+    except (mysql.connector.Error, PoolTimeout) as e:
+        print(f"数据库查询失败: {e}")
+        return None
@@ -0,0 +1,138 @@
+"""foods 表的内存目录
+
+整表只读一次，按列存为 NumPy 数组；每个 category_id 额外保存按 calories_per_100g 排序的下标，
+热量区间查询是两次二分查找，生成餐单时不再访问数据库。
+查询结果按表的自然顺序返回（与原 SQL 不带 ORDER BY 的返回顺序一致），贪心配餐的结果保持不变。
+
+后台线程每 CATALOG_REFRESH_SECONDS 秒用一次签名查询（行数 + 行校验和）检测表是否变化，变化时整表重建；
+version 在每次重建后递增，可作为缓存键的一部分。
+"""
+import os
+import threading
+import time
+
+import numpy as np
+
+import database
+
+CATALOG_REFRESH_SECONDS = float(os.getenv("CATALOG_REFRESH_SECONDS", "60"))
+
+
+class FoodCatalog:
+    def __init__(self, rows: list, version: int = 0, signature=None):
+        self.version = version
+        self.signature = signature
+        columns = list(zip(*rows)) if rows else [()] * len(database.FOOD_COLUMNS)
+        self.names = np.array(columns[0], dtype=object)
+        self.category_ids = np.array(columns[1], dtype=np.int64)
+        self.calories = np.array(columns[2], dtype=np.float64)
+        self.protein = np.array(columns[3], dtype=np.float64)
+        self.fat = np.array(columns[4], dtype=np.float64)
+        self.carbohydrate = np.array(columns[5], dtype=np.float64)
+
+        # 按 (category_id, 热量) 排序后切分：每个类别一段连续的、按热量升序的行下标
+        order = np.lexsort((self.calories, self.category_ids))
+        cats, starts = np.unique(self.category_ids[order], return_index=True)
+        bounds = list(starts) + [len(order)]
+        self._by_category = {}
+        for i, cat in enumerate(cats.tolist()):
+            idx = order[bounds[i]:bounds[i + 1]]
+            self._by_category[cat] = (idx, self.calories[idx])
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def categories(self) -> list:
+        return sorted(self._by_category)
+
+    def select(self, min_cal: float, max_cal: float, categories=None) -> np.ndarray:
+        """calories_per_100g BETWEEN min_cal AND max_cal（含端点）的行下标，按表的自然顺序"""
+        if not categories:
+            return np.flatnonzero((self.calories >= min_cal) & (self.calories <= max_cal))
+        parts = []
+        for cat in categories:
+            entry = self._by_category.get(cat)
+            if entry is None:
+                continue
+            idx, cals = entry
+            lo = np.searchsorted(cals, min_cal, side="left")
+            hi = np.searchsorted(cals, max_cal, side="right")
+            parts.append(idx[lo:hi])
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(parts))
+
+    def row(self, i: int) -> dict:
+        return {
+            "food_name": self.names[i],
+            "category_id": int(self.category_ids[i]),
+            "calories_per_100g": float(self.calories[i]),
+            "protein_per_100g": float(self.protein[i]),
+            "fat_per_100g": float(self.fat[i]),
+            "carbohydrate_per_100g": float(self.carbohydrate[i]),
+        }
+
+    def get_foods_by_criteria(self, min_cal, max_cal, categories=None) -> list:
+        """与 database.get_foods_by_criteria 返回相同结构"""
+        return [self.row(i) for i in self.select(min_cal, max_cal, categories)]
+
+
+# ---------- 进程级目录与后台刷新 ----------
+_catalog = None
+_lock = threading.Lock()
+_refresher = None
+
+
+def _reload(signature=None):
+    """重新整表读取；失败时保留旧目录"""
+    global _catalog
+    rows = database.load_all_foods()
+    if rows is None:
+        return _catalog
+    version = _catalog.version + 1 if _catalog is not None else 1
+    _catalog = FoodCatalog(rows, version, signature)
+    return _catalog
+
+
+def refresh(force: bool = False) -> FoodCatalog:
+    """签名变化（或 force）时重建目录，返回当前目录"""
+    with _lock:
+        signature = database.get_foods_signature()
+        if force or _catalog is None or (signature is not None and signature != _catalog.signature):
+            _reload(signature)
+        return _catalog
+
+
+def _refresh_loop():
+    while True:
+        time.sleep(CATALOG_REFRESH_SECONDS)
+        try:
+            refresh()
+        except Exception as e:
+            print(f"食物目录刷新失败: {e}")
+
+
+def get_catalog() -> FoodCatalog:
+    """首次调用时同步加载并启动后台刷新线程；数据库不可用时返回空目录（下次调用重试）"""
+    global _refresher
+    catalog = _catalog
+    if catalog is None:
+        catalog = refresh()
+        if catalog is None:
+            return FoodCatalog([])
+    if _refresher is None and CATALOG_REFRESH_SECONDS > 0:
+        with _lock:
+            if _refresher is None:
+                _refresher = threading.Thread(target=_refresh_loop, name="food-catalog-refresh", daemon=True)
+                _refresher.start()
+    return catalog
+
+
+def invalidate():
+    """表已知被修改（如管理接口写入）时调用，立即重建"""
+    return refresh(force=True)
+
+
+def get_foods_by_criteria(min_cal, max_cal, categories=None) -> list:
+    return get_catalog().get_foods_by_criteria(min_cal, max_cal, categories)
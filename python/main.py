@@ -1,6 +1,23 @@
+import argparse
+import copy
+import csv
+import json
+import math
 import sys
-from calculator import calculate_bmr, calculate_daily_intake
-from meal_planner import plan_daily_meals
+from itertools import islice
+
+from calculator import calculate_bmr, calculate_daily_intake, calculate_bmr_batch, calculate_daily_intake_batch
+from meal_planner import split_daily_calories
+from plan_cache import get_plan, plan_daily_meals
+
+# 下面是强度参数
+ACTIVITY_MAP = {
+    'sedentary': 1.2, 'light': 1.375,
+    'moderate': 1.55, 'very': 1.725,
+    'extra': 1.9
+}
+MEALS = ('breakfast', 'lunch', 'dinner')
+BATCH_CHUNK_SIZE = 1000  # 批量模式每次向量化计算并输出的用户数
 
 
 def get_valid_input(prompt: str, type_func, validator=lambda x: True):
@@ -26,18 +43,11 @@ def main():
                                     lambda x: 0 < x < weight)
     weeks = get_valid_input("预期减肥周数: ", int, lambda x: x > 0)
 
-
-# 下面是强度参数
-    activity_map = {
-        'sedentary': 1.2, 'light': 1.375,
-        'moderate': 1.55, 'very': 1.725,
-        'extra': 1.9
-    }
     activity = get_valid_input(
         "活动水平(sedentary/light/moderate/very/extra): ",
-        str.lower, lambda x: x in activity_map
+        str.lower, lambda x: x in ACTIVITY_MAP
     )
-    activity_factor = activity_map[activity]
+    activity_factor = ACTIVITY_MAP[activity]
 
     bmr = calculate_bmr(sex, age, height, weight)
     daily_cal = calculate_daily_intake(bmr, activity_factor, weight, target_weight, weeks, sex)
@@ -48,15 +58,172 @@ def main():
     meal_plan = plan_daily_meals(daily_cal, sex)
 
     print("\n=== 今日推荐餐单 ===")
-    for meal, (items, total) in meal_plan.items():
+    for meal, (items, total, macros) in meal_plan.items():
         print(
             f"\n▶️ {meal.capitalize()}（目标{int(daily_cal * (0.4 if meal == 'lunch' else 0.3))}大卡 | 实际{total}大卡）")
         if not items:
             print("⚠️ 无匹配食物，请检查数据库数据")
             continue
+        print(f"  蛋白质 {macros['protein_g']}g | 脂肪 {macros['fat_g']}g | 碳水 {macros['carbohydrate_g']}g")
         for item in items:
             print(f"- {item['name']}: {item['weight_g']}g（{item['actual_cal']}大卡，{item['cal_100g']}大卡/100g）")
 
 
+def _plan_to_json(targets: tuple, plan: dict) -> dict:
+    return {
+        meal: {'target_cal': target, 'total_cal': total, 'macros': macros, 'items': items}
+        for meal, target, (items, total, macros) in zip(MEALS, targets, (plan[m] for m in MEALS))
+    }
+
+
+def process_user_data(sex: str, age: int, height: int, weight: float, target_weight: float,
+                      weeks: int, activity: str) -> dict:
+    """单个用户：热量目标与一日餐单（可直接 JSON 序列化），供 app.py 调用"""
+    if activity not in ACTIVITY_MAP:
+        raise ValueError(f"未知的活动水平: {activity}")
+    bmr = calculate_bmr(sex, age, height, weight)
+    daily_cal = calculate_daily_intake(bmr, ACTIVITY_MAP[activity], weight, target_weight, weeks, sex)
+    targets = split_daily_calories(daily_cal)
+    return {
+        'bmr': round(bmr, 1),
+        'daily_calories': round(daily_cal, 1),
+        'meal_plan': copy.deepcopy(_plan_to_json(targets, get_plan(targets))),
+    }
+
+
+# ---------- 批量 ----------
+def _to_float(value) -> float:
+    number = float(value)
+    if not math.isfinite(number):  # "nan"、"inf"、"1e999" 都能被 float() 解析
+        raise ValueError(value)
+    return number
+
+
+def _to_int(value) -> int:
+    number = _to_float(value)  # CSV 中的 "170"、JSON 中的 170.0 都接受，170.5 不接受
+    if not number.is_integer():
+        raise ValueError(value)
+    return int(number)
+
+
+def _to_lower(value) -> str:
+    if not isinstance(value, str):
+        raise TypeError(value)
+    return value.strip().lower()
+
+
+PROFILE_FIELDS = (('sex', _to_lower), ('age', _to_int), ('height', _to_int), ('weight', _to_float),
+                  ('target_weight', _to_float), ('weeks', _to_int), ('activity', _to_lower))
+
+
+def parse_profile(raw: dict) -> tuple:
+    """把一条原始记录（CSV 行或 JSON 对象，值可能是字符串）转换为 process_user_data 的参数，
+    返回 (参数 dict, 错误列表)，有错误时参数为 None"""
+    if not isinstance(raw, dict):
+        return None, ["记录必须是 JSON 对象"]
+    errors, profile = [], {}
+    for field, convert in PROFILE_FIELDS:
+        value = raw.get(field)
+        if value is None or value == '':
+            errors.append(f"缺少必要参数: {field}")
+            continue
+        try:
+            profile[field] = convert(value)
+        except (ValueError, TypeError):
+            errors.append(f"{field} 格式错误: {value}")
+    if errors:
+        return None, errors
+    if profile['sex'] not in ('male', 'female'):
+        errors.append("性别必须是 'male' 或 'female'")
+    if profile['activity'] not in ACTIVITY_MAP:
+        errors.append(f"活动水平必须是 {'/'.join(ACTIVITY_MAP)} 之一")
+    for field in ('age', 'height', 'weight', 'target_weight', 'weeks'):
+        if profile[field] <= 0:
+            errors.append(f"{field} 必须大于0")
+    return (None, errors) if errors else (profile, [])
+
+
+def _process_chunk(records: list) -> list:
+    parsed = [parse_profile(r) for r in records]
+    valid = [i for i, (p, _) in enumerate(parsed) if p is not None]
+    results = [{'index': i, 'errors': errs} for i, (_, errs) in enumerate(parsed)]
+    if valid:
+        column = lambda field: [parsed[i][0][field] for i in valid]
+        bmr = calculate_bmr_batch(column('sex'), column('age'), column('height'), column('weight'))
+        daily_cal = calculate_daily_intake_batch(bmr, [ACTIVITY_MAP[a] for a in column('activity')],
+                                                 column('weight'), column('target_weight'),
+                                                 column('weeks'), column('sex'))
+        # 三餐目标相同的用户共用一份餐单：每个不同的目标只求解（或查缓存）一次
+        plans = {}
+        for j, i in enumerate(valid):
+            # 单条记录出错（如极端数值导致热量溢出）只影响这一条，不中断整批
+            try:
+                targets = split_daily_calories(float(daily_cal[j]))
+                if targets not in plans:
+                    plans[targets] = _plan_to_json(targets, get_plan(targets))
+            except Exception as e:
+                results[i] = {'index': i, 'errors': [f"处理失败: {e}"]}
+                continue
+            results[i] = {
+                'index': i,
+                'bmr': round(float(bmr[j]), 1),
+                'daily_calories': round(float(daily_cal[j]), 1),
+                'meal_plan': plans[targets],
+            }
+    for r, raw in zip(results, records):
+        if isinstance(raw, dict) and 'id' in raw:
+            r['id'] = raw['id']
+    return results
+
+
+def process_batch(records, chunk_size: int = BATCH_CHUNK_SIZE):
+    """逐块处理一批用户记录（dict 的可迭代对象），按输入顺序逐条产出结果；
+    index 为记录在整批中的序号，记录带 id 字段时原样带回，无效记录只含 errors。
+    meal_plan 与餐单缓存共享，只供序列化，不要修改"""
+    records = iter(records)
+    offset = 0
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            return
+        for result in _process_chunk(chunk):
+            result['index'] += offset
+            yield result
+        offset += len(chunk)
+
+
+def read_profiles(stream, fmt: str):
+    """fmt 为 'csv'（首行为表头）或 'jsonl'（每行一个 JSON 对象），逐条产出 dict；
+    无法解析的行产出 None，由 parse_profile 报错，不中断整批"""
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
+
+
+def run_batch(path: str, fmt: str = None, output=sys.stdout):
+    """批量模式：path 为 '-' 时读标准输入；结果以 NDJSON 写到 output"""
+    fmt = fmt or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+    stream = sys.stdin if path == '-' else open(path, encoding='utf-8', newline='')
+    try:
+        for result in process_batch(read_profiles(stream, fmt)):
+            output.write(json.dumps(result, ensure_ascii=False) + '\n')
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="减脂餐智能规划系统；不带参数时进入交互模式")
+    parser.add_argument("--batch", metavar="PATH", help="批量模式：CSV 或 JSON lines 文件（'-' 为标准输入），结果以 NDJSON 输出")
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="批量输入格式，默认按扩展名判断")
+    args = parser.parse_args()
+    if args.batch:
+        run_batch(args.batch, args.format)
+    else:
+        main()
\ No newline at end of file
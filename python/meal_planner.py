@@ -1,7 +1,15 @@
-from database import get_foods_by_criteria
+import os
 
+from food_catalog import FoodCatalog, get_catalog
+from meal_solver import get_solver
 
-def plan_single_meal(target_cal: int, categories: list) -> tuple:
+# solver：按热量与三大营养素整体求解（meal_solver.py）；greedy：按类别顺序填热量的原算法
+MEAL_PLANNER = os.getenv("MEAL_PLANNER", "solver")
+
+
+def plan_single_meal(target_cal: int, categories: list, catalog: FoodCatalog = None) -> tuple:
+    if catalog is None:
+        catalog = get_catalog()
     meals = []
     remaining = target_cal
 
@@ -9,12 +17,9 @@ def plan_single_meal(target_cal: int, categories: list) -> tuple:
         if remaining <= 10:
             break
 
-        foods = get_foods_by_criteria(10, remaining * 2, [cat])
-        if not foods:
-            continue
-
-        for food in foods:
-            cal_per_100 = food['calories_per_100g']
+        # 内存目录上的二分查找，按表的自然顺序返回
+        for i in catalog.select(10, remaining * 2, [cat]):
+            cal_per_100 = float(catalog.calories[i])
             if cal_per_100 == 0:
                 continue
 
@@ -24,10 +29,13 @@ def plan_single_meal(target_cal: int, categories: list) -> tuple:
             actual_cal = (weight / 100) * cal_per_100
 
             meals.append({
-                'name': food['food_name'],
+                'name': catalog.names[i],
                 'cal_100g': cal_per_100,
                 'weight_g': round(weight, 1),
-                'actual_cal': round(actual_cal, 1)
+                'actual_cal': round(actual_cal, 1),
+                'protein_g': round(weight / 100 * float(catalog.protein[i]), 1),
+                'fat_g': round(weight / 100 * float(catalog.fat[i]), 1),
+                'carbohydrate_g': round(weight / 100 * float(catalog.carbohydrate[i]), 1),
             })
             remaining -= actual_cal
 
@@ -38,18 +46,37 @@ def plan_single_meal(target_cal: int, categories: list) -> tuple:
     return meals, round(total, 1)
 
 
-def plan_daily_meals(daily_cal: float, sex: str) -> dict:
-    breakfast_cal = int(daily_cal * 0.3)
-    lunch_cal = int(daily_cal * 0.4)
-    dinner_cal = int(daily_cal * 0.3)
+def _greedy_meal(target_cal: int, categories: list, catalog: FoodCatalog) -> tuple:
+    """贪心结果补上营养素合计，与求解器返回相同结构"""
+    meals, total = plan_single_meal(target_cal, categories, catalog)
+    macros = {key: round(sum(m[key] for m in meals), 1) for key in ('protein_g', 'fat_g', 'carbohydrate_g')}
+    return meals, total, macros
+
+
+def split_daily_calories(daily_cal: float) -> tuple:
+    """三餐目标 (早, 午, 晚)，取整后即为餐单的全部输入（plan_cache 以此为键）"""
+    return int(daily_cal * 0.3), int(daily_cal * 0.4), int(daily_cal * 0.3)
+
+
+def plan_meals_for_targets(targets: tuple, catalog: FoodCatalog) -> dict:
+    breakfast_cal, lunch_cal, dinner_cal = targets
 
-    
     breakfast_cats = [3, 2, 4]  # 谷物、水果、蛋白质
     lunch_cats = [4, 1, 3]  # 蛋白质、蔬菜、谷物
     dinner_cats = [4, 1, 5]  # 蛋白质、蔬菜、脂肪
 
+    if MEAL_PLANNER == "greedy":
+        plan_meal = lambda cal, cats: _greedy_meal(cal, cats, catalog)
+    else:
+        plan_meal = get_solver(catalog).solve
+    # 每餐返回 (items, 实际热量, {'protein_g', 'fat_g', 'carbohydrate_g'})
     return {
-        'breakfast': plan_single_meal(breakfast_cal, breakfast_cats),
-        'lunch': plan_single_meal(lunch_cal, lunch_cats),
-        'dinner': plan_single_meal(dinner_cal, dinner_cats)
-    }
\ No newline at end of file
+        'breakfast': plan_meal(breakfast_cal, breakfast_cats),
+        'lunch': plan_meal(lunch_cal, lunch_cats),
+        'dinner': plan_meal(dinner_cal, dinner_cats)
+    }
+
+
+def plan_daily_meals(daily_cal: float, sex: str) -> dict:
+    # 三餐使用同一份目录快照，后台刷新不会让一份餐单跨两个版本
+    return plan_meals_for_targets(split_daily_calories(daily_cal), get_catalog())
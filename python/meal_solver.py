@@ -0,0 +1,166 @@
+"""按热量与三大营养素目标求解单餐组合（向量化）
+
+每个类别选一种食物，份量取自 30–200 g 的离散档位，目标为该餐热量及按 MACRO_SPLIT 折算的蛋白质 / 脂肪 / 碳水克数，
+得分为各项相对误差平方的加权和（热量权重最高）。三步，每步都是一次 NumPy 广播运算：
+1. 预筛：每个类别内，按"分到该类别的那份目标"保留误差最小的 k 种食物；
+2. 组合：k^m 个组合（m 为类别数）按各自最优份量整体打分，保留最好的 REFINE_TOP 个；
+3. 份量细化：对保留的组合枚举全部份量档位（P^m 种），取全局最优。
+
+预筛不必每餐扫描全部食物 × 份量：目标按热量线性缩放，份量 g 下的相对误差只取决于 g·m/热量，
+因此每种食物不受份量上下限约束时的最小误差（营养结构与目标的吻合度）与对应份量系数可在建表时算好，
+类别内按吻合度排序；每餐只需按份量系数筛出最优份量落在 30–200 g 内的食物，取前 k 个。
+k 由 SOLVER_MAX_COMBOS 决定；超过 SOLVER_BUDGET_MS 时缩小 k 与细化范围，保证一天三餐在几毫秒内完成。
+"""
+import os
+import threading
+import time
+
+import numpy as np
+
+from food_catalog import FoodCatalog
+
+PORTIONS_G = np.array([30, 50, 75, 100, 125, 150, 175, 200], dtype=np.float64)
+MIN_KCAL_PER_100G = 10  # 与贪心规划的下限一致，排除零热量条目
+
+# 热量占比 → 克数（每克千卡）
+MACRO_SPLIT = {"protein": 0.25, "fat": 0.25, "carbohydrate": 0.50}
+KCAL_PER_G = {"protein": 4.0, "fat": 9.0, "carbohydrate": 4.0}
+# 得分权重：热量、蛋白质、脂肪、碳水
+SCORE_WEIGHTS = np.array([4.0, 1.0, 1.0, 1.0])
+
+SOLVER_MAX_COMBOS = int(os.getenv("SOLVER_MAX_COMBOS", "8000"))
+SOLVER_BUDGET_MS = float(os.getenv("SOLVER_BUDGET_MS", "5"))
+REFINE_TOP = 16
+
+
+def meal_targets(target_cal: float) -> np.ndarray:
+    """[千卡, 蛋白质 g, 脂肪 g, 碳水 g]"""
+    return np.array([target_cal] + [target_cal * MACRO_SPLIT[k] / KCAL_PER_G[k]
+                                    for k in ("protein", "fat", "carbohydrate")])
+
+
+def _score(nutrients: np.ndarray, target: np.ndarray) -> np.ndarray:
+    """nutrients (..., 4) → (...)：加权相对误差平方和"""
+    rel = (nutrients - target) / np.maximum(target, 1e-6)
+    return (rel * rel) @ SCORE_WEIGHTS
+
+
+def _combo_scores(parts: list, target: np.ndarray) -> np.ndarray:
+    """parts[i] 为 (..., n_i, 4)，返回按 C 顺序展开的 (..., prod n_i) 组合得分，与 _score 相同。
+    先把各部分换算到 √w·营养素/目标 的空间，组合后只剩加法与一次平方和"""
+    scale = np.sqrt(SCORE_WEIGHTS) / np.maximum(target, 1e-6)
+    acc = parts[0] * scale - np.sqrt(SCORE_WEIGHTS)
+    for part in parts[1:]:
+        acc = (acc[..., :, None, :] + (part * scale)[..., None, :, :]).reshape(*acc.shape[:-2], -1, 4)
+    return np.einsum("...i,...i->...", acc, acc)
+
+
+class MealSolver:
+    def __init__(self, catalog: FoodCatalog, portions: np.ndarray = PORTIONS_G,
+                 max_combos: int = SOLVER_MAX_COMBOS, budget_ms: float = SOLVER_BUDGET_MS):
+        self.catalog = catalog
+        self.portions = portions
+        self.max_combos = max_combos
+        self.budget_ms = budget_ms
+        per100 = np.stack([catalog.calories, catalog.protein, catalog.fat, catalog.carbohydrate], axis=1)
+        # 份量 g、该类别目标 share = ratio·热量/m 时，相对误差 = a·s − 1，其中 a = per100 / ratio，s = g·m / (100·热量)；
+        # 加权平方和对 s 的最小点 s* = Σwa / Σwa²，最小值 fit = Σw − (Σwa)² / Σwa²
+        ratio = meal_targets(1.0)
+        self._foods = {}
+        for cat in catalog.categories:
+            idx = catalog.select(MIN_KCAL_PER_100G, np.inf, [cat])
+            if not len(idx):
+                continue
+            a = per100[idx] / ratio
+            wa, waa = a @ SCORE_WEIGHTS, (a * a) @ SCORE_WEIGHTS
+            fit = SCORE_WEIGHTS.sum() - wa * wa / waa
+            order = np.argsort(fit, kind="stable")
+            # coef·热量/m 即最优克数
+            self._foods[cat] = (idx[order], per100[idx[order]], 100.0 * wa[order] / waa[order])
+
+    def _prefilter(self, cat, target_cal: float, m: int, k: int):
+        """返回 (行下标 (k,), 每档份量营养素 (k, P, 4), 最优份量档位 (k,))，按吻合度由好到差"""
+        idx, per100, coef = self._foods[cat]
+        in_range = (coef >= self.portions[0] * m / target_cal) & (coef <= self.portions[-1] * m / target_cal)
+        keep = np.flatnonzero(in_range)[:k]
+        if len(keep) < k and len(keep) < len(idx):
+            # 份量范围内的食物不足 k 种：补上份量被截断后误差最小的
+            rest = np.flatnonzero(~in_range)
+            grams = np.clip(coef[rest] * target_cal / m, self.portions[0], self.portions[-1])
+            share = meal_targets(target_cal) / m
+            err = _score(per100[rest] * (grams[:, None] / 100.0), share)
+            keep = np.concatenate([keep, rest[np.argsort(err, kind="stable")[:k - len(keep)]]])
+        items = per100[keep][:, None, :] * (self.portions[None, :, None] / 100.0)
+        best_p = _score(items, meal_targets(target_cal) / m).argmin(axis=1)
+        return idx[keep], items, best_p
+
+    def solve(self, target_cal: float, categories: list, budget_ms: float = None) -> tuple:
+        """返回 (items, 总千卡, {'protein_g', 'fat_g', 'carbohydrate_g'})，items 与贪心规划的条目结构相同"""
+        t0 = time.perf_counter()
+        budget = (self.budget_ms if budget_ms is None else budget_ms) / 1000.0
+        cats = [c for c in dict.fromkeys(categories) if c in self._foods]
+        if not cats or target_cal <= 0:
+            return [], 0.0, {"protein_g": 0.0, "fat_g": 0.0, "carbohydrate_g": 0.0}
+
+        target = meal_targets(target_cal)
+        m = len(cats)
+        k = max(1, int(self.max_combos ** (1.0 / m)))
+
+        # 1. 预筛
+        picked = [self._prefilter(cat, target_cal, m, k) for cat in cats]
+        if time.perf_counter() - t0 > budget / 2:
+            # 预筛已用掉一半预算（份量范围内的食物太少、走了补齐路径，或机器较慢）：缩小组合规模
+            k = max(1, int(min(self.max_combos, 512) ** (1.0 / m)))
+            picked = [(idx[:k], items[:k], best_p[:k]) for idx, items, best_p in picked]
+        refine_top = REFINE_TOP if time.perf_counter() - t0 <= budget / 2 else 1
+
+        # 2. 组合（各自最优份量）
+        best_items = [items[np.arange(len(p)), p] for _, items, p in picked]    # (k_i, 4)
+        combo_scores = _combo_scores(best_items, target)
+        shape = tuple(len(p[0]) for p in picked)
+        top = min(refine_top, combo_scores.size)
+        top_flat = np.argpartition(combo_scores, top - 1)[:top] if combo_scores.size > top else np.arange(top)
+        top_choice = np.stack(np.unravel_index(top_flat, shape), axis=1)         # (top, m)
+
+        # 3. 份量细化：每个候选组合枚举 P^m 种份量
+        n_p = len(self.portions)
+        grids = [picked[j][1][top_choice[:, j]] for j in range(m)]             # m × (top, P, 4)
+        refined = _combo_scores(grids, target)                                  # (top, P^m)
+        c, flat = np.unravel_index(refined.argmin(), refined.shape)
+        portion_idx = np.unravel_index(flat, (n_p,) * m)
+
+        items, totals = [], np.zeros(4)
+        for j in range(m):
+            row = int(picked[j][0][top_choice[c, j]])
+            grams = float(self.portions[portion_idx[j]])
+            nutr = picked[j][1][top_choice[c, j], portion_idx[j]]
+            totals += nutr
+            items.append({
+                'name': self.catalog.names[row],
+                'cal_100g': float(self.catalog.calories[row]),
+                'weight_g': round(grams, 1),
+                'actual_cal': round(float(nutr[0]), 1),
+                'protein_g': round(float(nutr[1]), 1),
+                'fat_g': round(float(nutr[2]), 1),
+                'carbohydrate_g': round(float(nutr[3]), 1),
+            })
+        macros = {"protein_g": round(float(totals[1]), 1), "fat_g": round(float(totals[2]), 1),
+                  "carbohydrate_g": round(float(totals[3]), 1)}
+        return items, round(float(sum(i['actual_cal'] for i in items)), 1), macros
+
+
+_solver = None
+_lock = threading.Lock()
+
+
+def get_solver(catalog: FoodCatalog) -> MealSolver:
+    """复用同一目录快照的求解器；目录刷新后（对象变化）重建预计算的份量营养素矩阵。
+    Flask 请求线程与预热线程可能同时首次调用，加锁保证每个快照只构建一次"""
+    global _solver
+    solver = _solver
+    if solver is not None and solver.catalog is catalog:
+        return solver
+    with _lock:
+        if _solver is None or _solver.catalog is not catalog:
+            _solver = MealSolver(catalog)
+        return _solver
@@ -0,0 +1,143 @@
+"""餐单缓存
+
+餐单只取决于取整后的三餐目标热量与食物目录内容，相同输入反复求解是浪费：
+以 (早, 午, 晚, 目录 version, 规划算法) 为键做 LRU 缓存，容量 PLAN_CACHE_SIZE。
+- 失效：目录重建后 version 递增，旧键自然失配；发现新版本时同时清空旧条目（并按需重新预热）；
+- 预热：PLAN_CACHE_WARMUP="1200-3000" 时在后台线程按 1 大卡步长预先求解该每日热量区间；
+- 空目录（数据库不可用）求出的空餐单不缓存，下次请求重试。
+
+plan_daily_meals(daily_cal, sex) 与 meal_planner.plan_daily_meals 签名一致，可直接替换；
+返回的是缓存值的副本，调用方可以随意修改。
+"""
+import copy
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import meal_planner
+from food_catalog import get_catalog
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from service_metrics import REGISTRY
+
+PLAN_CACHE_SIZE = int(os.getenv("PLAN_CACHE_SIZE", "4096"))
+PLAN_CACHE_WARMUP = os.getenv("PLAN_CACHE_WARMUP", "")  # 例如 "1200-3000"，留空不预热
+
+CACHE_REQUESTS = REGISTRY.counter("plan_cache_requests_total", "餐单缓存查询数", ("result",))
+
+
+class PlanCache:
+    def __init__(self, max_size: int = PLAN_CACHE_SIZE):
+        self.max_size = max_size
+        self.version = None
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._plans)
+
+    def _sync_version(self, version) -> bool:
+        """调用方持锁；遇到更新的目录版本时丢掉全部旧条目。返回 version 是否为当前版本
+        （预热线程可能还拿着旧目录，旧版本的查询不能把缓存切回去）"""
+        if self.version is None or version > self.version:
+            self._plans.clear()
+            self.version = version
+        return version == self.version
+
+    def get(self, key: tuple, version, record: bool = True):
+        """record=False 用于预热时的探测，不计入命中率"""
+        with self._lock:
+            plan = self._plans.get(key) if self._sync_version(version) else None
+            if plan is not None:
+                self._plans.move_to_end(key)
+        if record:
+            CACHE_REQUESTS.inc(result="hit" if plan is not None else "miss")
+        return plan
+
+    def put(self, key: tuple, version, plan: dict):
+        with self._lock:
+            if version != self.version:
+                return  # 求解期间目录已刷新，结果作废
+            self._plans[key] = plan
+            self._plans.move_to_end(key)
+            while len(self._plans) > self.max_size:
+                self._plans.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+            self.version = None
+
+
+CACHE = PlanCache()
+
+
+def _key(targets: tuple) -> tuple:
+    return (*targets, meal_planner.MEAL_PLANNER)
+
+
+def get_plan(targets: tuple, catalog=None) -> dict:
+    """按三餐目标取餐单，未命中时求解并写入缓存；返回缓存内部对象，只读"""
+    if catalog is None:
+        catalog = get_catalog()
+    if CACHE.version is not None and catalog.version != CACHE.version and len(catalog):
+        start_warm_up()
+    key = _key(targets)
+    plan = CACHE.get(key, catalog.version)
+    if plan is None:
+        plan = meal_planner.plan_meals_for_targets(targets, catalog)
+        if len(catalog):
+            CACHE.put(key, catalog.version, plan)
+    return plan
+
+
+def plan_daily_meals(daily_cal: float, sex: str) -> dict:
+    return copy.deepcopy(get_plan(meal_planner.split_daily_calories(daily_cal)))
+
+
+def invalidate():
+    """foods 表已知被修改时调用：立即重建目录并清空缓存"""
+    import food_catalog
+    food_catalog.invalidate()
+    CACHE.clear()
+
+
+# ---------- 预热 ----------
+_warm_thread = None
+
+
+def warm_up(min_daily_cal: int, max_daily_cal: int) -> int:
+    """预先求解每日热量 [min, max]（步长 1 大卡）覆盖到的全部三餐目标，返回新求解的数量"""
+    catalog = get_catalog()
+    if not len(catalog):
+        return 0
+    seen, solved = set(), 0
+    for daily_cal in range(int(min_daily_cal), int(max_daily_cal) + 1):
+        targets = meal_planner.split_daily_calories(daily_cal)
+        if targets in seen:
+            continue
+        seen.add(targets)
+        if CACHE.get(_key(targets), catalog.version, record=False) is None:
+            if CACHE.version != catalog.version:
+                break  # 目录已刷新，交给新版本触发的预热
+            CACHE.put(_key(targets), catalog.version, meal_planner.plan_meals_for_targets(targets, catalog))
+            solved += 1
+    return solved
+
+
+def _warm_up_configured():
+    try:
+        low, high = (int(v) for v in PLAN_CACHE_WARMUP.split("-"))
+        print(f"餐单缓存预热完成: {warm_up(low, high)} 份")
+    except Exception as e:
+        print(f"餐单缓存预热失败: {e}")
+
+
+def start_warm_up():
+    """按 PLAN_CACHE_WARMUP 在后台预热（服务启动与目录换版本时调用）；已有预热在跑时不重复启动"""
+    global _warm_thread
+    if not PLAN_CACHE_WARMUP or (_warm_thread is not None and _warm_thread.is_alive()):
+        return
+    _warm_thread = threading.Thread(target=_warm_up_configured, name="plan-cache-warm-up", daemon=True)
+    _warm_thread.start()
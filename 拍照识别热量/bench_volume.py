@@ -0,0 +1,248 @@
+"""体积估算流程分阶段基准测试
+
+固定语料（合成图 + 可选样本图片）逐张、逐阶段单独运行：
+    decode → palm_pixel_length → segment_food_grabcut → depth_preprocess → depth_forward
+    → upsample_depth → estimate_thickness → artifacts（诊断数据：RLE、预览图、掩膜 PNG 与叠加图落盘）
+每个阶段的输入由上一阶段预先算好，计时只包含该阶段本身。报告：
+- 墙钟时间：预热后重复 repeat 次，取中位数与 p95；
+- 峰值 RSS 增量：计时期间后台线程采样的常驻内存最大值减去阶段开始前的值；
+- Python 侧分配：额外运行一次并用 tracemalloc 统计峰值（numpy 数组计入，torch 张量不计入）。
+结果可保存为基线；指定 --baseline 时与基线比较，任一阶段中位耗时超过阈值即以非零状态退出。
+
+    python bench_volume.py --save-baseline bench_baseline.json
+    python bench_volume.py --images samples/ --baseline bench_baseline.json --threshold 0.2
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+import torch
+
+from quantization import current_rss_mb
+
+STAGES = ("decode", "palm_pixel_length", "segment_food_grabcut", "depth_preprocess", "depth_forward",
+          "upsample_depth", "estimate_thickness", "artifacts")
+SYNTHETIC_SIZES = ("1280x960", "4032x3024")
+
+
+# ---------- 语料 ----------
+def synthetic_image(w: int, h: int, seed: int = 0) -> bytes:
+    """桌面 + 餐盘 + 食物 + 肤色手掌区域，固定随机种子保证每次相同"""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:h, 0:w].astype(np.float32)
+    img = np.empty((h, w, 3), np.uint8)
+    img[..., 0] = 90 + 40 * xx / w
+    img[..., 1] = 110 + 30 * yy / h
+    img[..., 2] = 140
+    s = min(w, h)
+    cv2.circle(img, (w // 2, h // 2), int(s * 0.35), (235, 235, 235), -1)
+    cv2.ellipse(img, (w // 2, h // 2), (int(s * 0.22), int(s * 0.16)), 15, 0, 360, (40, 110, 190), -1)
+    cv2.ellipse(img, (int(w * 0.18), int(h * 0.75)), (int(s * 0.08), int(s * 0.18)), -30, 0, 360, (140, 170, 220), -1)
+    noise = rng.normal(0, 6, img.shape)
+    img = np.clip(img + noise, 0, 255).astype(np.uint8)
+    ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return buf.tobytes()
+
+
+def load_corpus(images: str = None, synthetic_sizes=SYNTHETIC_SIZES) -> list:
+    corpus = []
+    for i, size in enumerate(synthetic_sizes):
+        w, h = (int(v) for v in size.lower().split("x"))
+        corpus.append((f"synthetic-{w}x{h}", synthetic_image(w, h, seed=i)))
+    if images:
+        paths = [images] if os.path.isfile(images) else sorted(
+            p for p in glob.glob(os.path.join(images, "*")) if p.lower().endswith((".jpg", ".jpeg", ".png")))
+        for path in paths:
+            with open(path, "rb") as f:
+                corpus.append((os.path.basename(path), f.read()))
+    return corpus
+
+
+# ---------- 测量 ----------
+class RssSampler:
+    """在后台线程中采样常驻内存，记录阶段运行期间的峰值"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.start_mb = None
+        self.peak_mb = None
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self.start_mb = self.peak_mb = current_rss_mb()
+        if self.start_mb is not None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self.start_mb is not None:
+            self._thread.join()
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+    @property
+    def peak_delta_mb(self):
+        return None if self.start_mb is None else round(self.peak_mb - self.start_mb, 1)
+
+
+def measure(fn, repeat: int, warmup: int):
+    """返回 (最后一次的结果, 统计)"""
+    for _ in range(warmup):
+        fn()
+    times = []
+    with RssSampler() as rss:
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            out = fn()
+            times.append((time.perf_counter() - t0) * 1000)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    times.sort()
+    stats = {
+        "median_ms": round(statistics.median(times), 3),
+        "p95_ms": round(times[min(len(times) - 1, int(round(0.95 * (len(times) - 1))))], 3),
+        "min_ms": round(times[0], 3),
+        "peak_rss_delta_mb": rss.peak_delta_mb,
+        "py_alloc_peak_mb": round(peak / 1024 ** 2, 2),
+    }
+    return out, stats
+
+
+def bench_image(label: str, data: bytes, backend, diagnostics, repeat: int, warmup: int,
+                depth_size: int = None) -> dict:
+    import volume_engine as ve
+
+    results = {}
+
+    img, results["decode"] = measure(lambda: ve.decode_image(data), repeat, warmup)
+    rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    _, results["palm_pixel_length"] = measure(lambda: ve.palm_pixel_length(rgb), repeat, warmup)
+    food_mask, results["segment_food_grabcut"] = measure(lambda: ve.segment_food_grabcut(img), repeat, warmup)
+
+    pixel_values, results["depth_preprocess"] = measure(lambda: backend.preprocess([rgb], depth_size), repeat, warmup)
+    depth, results["depth_forward"] = measure(lambda: backend.forward(pixel_values)[0], repeat, warmup)
+    h, w = rgb.shape[:2]
+    depth_full, results["upsample_depth"] = measure(lambda: ve.upsample_depth(depth, (h, w)), repeat, warmup)
+    _, results["estimate_thickness"] = measure(
+        lambda: ve.estimate_thickness(food_mask, ve.normalize_depth(depth_full)), repeat, warmup)
+
+    # 手掌掩膜只影响诊断数据大小，这里用左下角固定区域代替
+    hand_mask = np.zeros((h, w), np.uint8)
+    hand_mask[int(h * 0.55):, :int(w * 0.3)] = 255
+    food_only = food_mask & ~hand_mask.astype(bool)
+
+    def artifacts():
+        # 与诊断后台线程相同的工作：构建记录并落盘（掩膜 PNG + 叠加图）
+        record = diagnostics.build_record(img, food_only, hand_mask, None)
+        diagnostics._write(label, record)
+
+    _, results["artifacts"] = measure(artifacts, repeat, warmup)
+    return results
+
+
+# ---------- 基线比较 ----------
+def find_regressions(current: dict, baseline: dict, threshold: float, min_delta_ms: float) -> list:
+    regressions = []
+    for image, stages in current["results"].items():
+        for stage, stats in stages.items():
+            base = baseline.get("results", {}).get(image, {}).get(stage)
+            if base is None:
+                continue
+            delta = stats["median_ms"] - base["median_ms"]
+            if delta > min_delta_ms and delta > base["median_ms"] * threshold:
+                regressions.append({"image": image, "stage": stage, "baseline_ms": base["median_ms"],
+                                    "current_ms": stats["median_ms"],
+                                    "change_pct": round(delta / base["median_ms"] * 100, 1)})
+    return regressions
+
+
+def print_table(report: dict):
+    print(f"{'image':<28}{'stage':<22}{'median ms':>11}{'p95 ms':>10}{'rss Δ MB':>10}{'py alloc MB':>13}")
+    for image, stages in report["results"].items():
+        for stage, s in stages.items():
+            rss = "-" if s["peak_rss_delta_mb"] is None else f"{s['peak_rss_delta_mb']:.1f}"
+            print(f"{image:<28}{stage:<22}{s['median_ms']:>11.2f}{s['p95_ms']:>10.2f}{rss:>10}{s['py_alloc_peak_mb']:>13.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="体积估算流程分阶段基准测试")
+    parser.add_argument("--images", help="样本图片目录或单张图片（在合成图之外追加）")
+    parser.add_argument("--synthetic", default=",".join(SYNTHETIC_SIZES), help="合成图尺寸列表，如 1280x960,4032x3024；留空不使用")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--depth-backend", default=None, help="深度后端（默认 DEPTH_BACKEND）")
+    parser.add_argument("--depth-size", type=int, default=None, help="深度输入边长（默认为模型默认尺寸）")
+    parser.add_argument("--output", default="bench_result.json")
+    parser.add_argument("--save-baseline", help="把本次结果保存为基线")
+    parser.add_argument("--baseline", help="与基线比较")
+    parser.add_argument("--threshold", type=float, default=0.2, help="中位耗时相对基线的回归阈值（0.2 即 +20%%）")
+    parser.add_argument("--min-delta-ms", type=float, default=2.0, help="低于该绝对增量的变化不计为回归")
+    args = parser.parse_args()
+
+    from depth_backends import get_backend
+    from diagnostics import DiagnosticsStore
+
+    torch.set_grad_enabled(False)
+    backend = get_backend(args.depth_backend)
+    corpus = load_corpus(args.images, [s for s in args.synthetic.split(",") if s])
+    out_dir = tempfile.mkdtemp(prefix="bench_volume_")
+    diagnostics = DiagnosticsStore(out_dir, capacity=1, sample_rate=0.0)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "threads": torch.get_num_threads(),
+            "cpu": platform.processor() or platform.machine(),
+            "depth_backend": backend.name,
+            "depth_size": args.depth_size,
+            "repeat": args.repeat,
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "results": {},
+    }
+    for label, data in corpus:
+        print(f"运行 {label} ...", flush=True)
+        report["results"][label] = bench_image(label, data, backend, diagnostics, args.repeat, args.warmup,
+                                               args.depth_size)
+
+    print_table(report)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"基线已保存：{args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("meta", {}).get("depth_backend") != backend.name:
+            print(f"警告：基线深度后端为 {baseline.get('meta', {}).get('depth_backend')}，本次为 {backend.name}")
+        regressions = find_regressions(report, baseline, args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"发现 {len(regressions)} 处回归（阈值 +{args.threshold * 100:.0f}%）：")
+            for r in regressions:
+                print(f"  {r['image']} / {r['stage']}: {r['baseline_ms']:.2f} → {r['current_ms']:.2f} ms（+{r['change_pct']}%）")
+            sys.exit(1)
+        print("未发现超过阈值的回归")
@@ -0,0 +1,189 @@
+"""INT8 量化校准与对比报告
+
+用一批样本图片（建议为带手掌的真实拍摄照片）：
+1. 分类模型：以 fp32 MobileNetV3 做 FX 静态量化校准，导出 INT8 TorchScript（CLASSIFIER_INT8_TORCHSCRIPT），
+   对比 fp32 / INT8 的单张延迟、权重大小、top-1 一致率与概率偏差；
+2. 深度模型：对比 fp32 后端与对应的 -int8 动态量化后端的前向延迟、内存增量、权重大小，
+   以及完整体积流程输出的 volume_cm3 误差（手掌检测与食物分割只做一次，两种后端共用）。
+结果写入 JSON 报告并打印摘要。服务端通过 CLASSIFIER_QUANTIZED=1 / DEPTH_BACKEND=dpt-large-int8 启用量化模型。
+
+    python calibrate_quantization.py --images samples/ --report quant_report.json
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import statistics
+import time
+
+import cv2
+import torch
+
+from quantization import current_rss_mb, model_size_mb, quantize_static_fx, select_engine
+
+logger = logging.getLogger("quant-calibrate")
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png")
+
+
+def list_images(path: str, limit: int) -> list:
+    if os.path.isfile(path):
+        return [path]
+    files = sorted(f for f in glob.glob(os.path.join(path, "**", "*"), recursive=True)
+                   if f.lower().endswith(IMAGE_EXTS))
+    return files[:limit] if limit else files
+
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    out = fn(*args)
+    return out, (time.perf_counter() - t0) * 1000
+
+
+def summarize_ms(values: list) -> dict:
+    if not values:
+        return {}
+    return {"median_ms": round(statistics.median(values), 2), "mean_ms": round(statistics.mean(values), 2),
+            "max_ms": round(max(values), 2)}
+
+
+# ---------- 分类模型 ----------
+@torch.no_grad()
+def calibrate_classifier(images: list, calib_count: int, out_path: str) -> dict:
+    from food_classifier import CLASSIFIER_WEIGHTS, CROP_SIZE, FoodClassifier, build_model, load_labels
+
+    labels = load_labels()
+    model = build_model(len(labels))
+    state = torch.load(CLASSIFIER_WEIGHTS, map_location="cpu")
+    model.load_state_dict(state.get("model", state))
+    model.eval()
+
+    inputs = []
+    for path in images:
+        with open(path, "rb") as f:
+            inputs.append(FoodClassifier.preprocess(f.read()))
+
+    calib = inputs[:calib_count]
+    logger.info(f"分类模型静态量化校准：{len(calib)} 张")
+    example = (torch.zeros(1, 3, CROP_SIZE, CROP_SIZE),)
+    quantized = quantize_static_fx(model, calib, example)
+    scripted = torch.jit.freeze(torch.jit.trace(quantized, example[0]))
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    scripted.save(out_path)
+    logger.info(f"INT8 分类模型已导出：{out_path}")
+
+    fp32_ms, int8_ms, agree, prob_diff = [], [], 0, []
+    for x in inputs:
+        fp32, t_fp32 = timed(model, x)
+        int8, t_int8 = timed(scripted, x)
+        fp32_ms.append(t_fp32)
+        int8_ms.append(t_int8)
+        p32, p8 = torch.softmax(fp32, 1)[0], torch.softmax(int8, 1)[0]
+        agree += int(p32.argmax() == p8.argmax())
+        prob_diff.append(float((p32 - p8).abs().max()))
+
+    return {
+        "images": len(inputs),
+        "calibration_images": len(calib),
+        "note": f"评估集的前 {len(calib)} 张同时用于校准",
+        "fp32": {"size_mb": model_size_mb(model), **summarize_ms(fp32_ms)},
+        "int8": {"size_mb": round(os.path.getsize(out_path) / 1024 ** 2, 2), **summarize_ms(int8_ms)},
+        "top1_agreement": round(agree / len(inputs), 4),
+        "max_prob_diff_mean": round(statistics.mean(prob_diff), 4),
+    }
+
+
+# ---------- 深度模型 ----------
+def load_backend(name: str):
+    from depth_backends import get_backend
+
+    rss_before = current_rss_mb()
+    backend, load_ms = timed(get_backend, name)
+    rss_after = current_rss_mb()
+    rss_delta = round(rss_after - rss_before, 1) if rss_before is not None and rss_after is not None else None
+    return backend, {"load_ms": round(load_ms, 1), "rss_delta_mb": rss_delta, "size_mb": model_size_mb(backend.model)}
+
+
+@torch.no_grad()
+def compare_depth(images: list, fp32_name: str, hand_length_cm: float) -> dict:
+    from volume_engine import VolumeEstimationError, analyze_image, measure_volume
+
+    int8_name = f"{fp32_name}-int8"
+    fp32, fp32_info = load_backend(fp32_name)
+    int8, int8_info = load_backend(int8_name)
+
+    fp32_ms, int8_ms, volumes, skipped = [], [], [], 0
+    for path in images:
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is None:
+            skipped += 1
+            continue
+        try:
+            rgb, palm_px, food_only, hand_mask = analyze_image(img)
+        except VolumeEstimationError as e:
+            logger.info(f"跳过 {path}：{e}")
+            skipped += 1
+            continue
+
+        depth32, t32 = timed(fp32.predict, rgb)
+        depth8, t8 = timed(int8.predict, rgb)
+        fp32_ms.append(t32)
+        int8_ms.append(t8)
+        v32 = measure_volume(rgb, depth32, food_only, hand_mask, palm_px, hand_length_cm, 0.55, "bowl")["volume_cm3"]
+        v8 = measure_volume(rgb, depth8, food_only, hand_mask, palm_px, hand_length_cm, 0.55, "bowl")["volume_cm3"]
+        volumes.append((path, v32, v8))
+
+    report = {
+        "backends": [fp32_name, int8_name],
+        "images": len(volumes),
+        "skipped": skipped,
+        "fp32": {**fp32_info, **summarize_ms(fp32_ms)},
+        "int8": {**int8_info, **summarize_ms(int8_ms)},
+    }
+    if volumes:
+        abs_err = [abs(v8 - v32) for _, v32, v8 in volumes]
+        rel_err = [abs(v8 - v32) / v32 * 100 for _, v32, v8 in volumes if v32 > 0]
+        report["volume_cm3_error"] = {
+            "mean_abs": round(statistics.mean(abs_err), 2),
+            "max_abs": round(max(abs_err), 2),
+            "mean_rel_pct": round(statistics.mean(rel_err), 2) if rel_err else None,
+            "max_rel_pct": round(max(rel_err), 2) if rel_err else None,
+        }
+        report["per_image"] = [{"image": path, "fp32_cm3": v32, "int8_cm3": v8} for path, v32, v8 in volumes]
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="INT8 量化校准与 fp32 对比")
+    parser.add_argument("--images", required=True, help="样本图片目录或单张图片")
+    parser.add_argument("--max-images", type=int, default=64, help="最多使用的图片数（0 为不限）")
+    parser.add_argument("--calib-images", type=int, default=32, help="用于分类模型校准的图片数")
+    parser.add_argument("--depth-backend", default="dpt-large", help="fp32 深度后端（对比其 -int8 版本）")
+    parser.add_argument("--hand-length-cm", type=float, default=18.0)
+    parser.add_argument("--skip-classifier", action="store_true")
+    parser.add_argument("--skip-depth", action="store_true")
+    parser.add_argument("--report", default="quant_report.json")
+    args = parser.parse_args()
+
+    images = list_images(args.images, args.max_images)
+    if not images:
+        raise SystemExit(f"未找到样本图片：{args.images}")
+    report = {"engine": select_engine(), "torch": torch.__version__, "threads": torch.get_num_threads()}
+
+    if not args.skip_classifier:
+        from food_classifier import CLASSIFIER_INT8_TORCHSCRIPT
+
+        report["classifier"] = calibrate_classifier(images, args.calib_images, CLASSIFIER_INT8_TORCHSCRIPT)
+    if not args.skip_depth:
+        report["depth"] = compare_depth(images, args.depth_backend, args.hand_length_cm)
+
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    summary = {k: v for k, v in report.items() if k != "depth"}
+    if "depth" in report:
+        summary["depth"] = {k: v for k, v in report["depth"].items() if k != "per_image"}
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    print(f"报告已写入 {args.report}")
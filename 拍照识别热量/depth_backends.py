@@ -0,0 +1,126 @@
+"""深度估计后端
+
+统一封装各深度模型的预处理与前向：
+- preprocess(rgbs, size=None) -> (B, 3, H, W) 输入张量；size 指定方形输入边长（None 为模型默认）
+- forward(pixel_values) -> (B, h, w) 相对逆深度（值越大越近，与 DPT predicted_depth 一致）
+服务启动时通过 DEPTH_BACKEND 选择默认后端，/predict 也可按请求指定。
+名称带 -int8 的后端为动态 INT8 量化版本（只在 CPU 上运行），与 fp32 的对比见 calibrate_quantization.py。
+"""
+import os
+import threading
+
+import cv2
+import numpy as np
+import torch
+from transformers import DPTImageProcessor, DPTForDepthEstimation
+
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+DPT_CACHE_DIR = "./dpt_cache"
+MIDAS_SMALL_WEIGHTS = os.getenv("MIDAS_SMALL_WEIGHTS", "checkpoints/midas_small.pth")
+DEFAULT_BACKEND = os.getenv("DEPTH_BACKEND", "dpt-large")
+
+
+class DepthBackend:
+    name = "base"
+    resizable = True  # 是否支持非默认输入尺寸（ViT 位置编码可插值，Swin 窗口尺寸固定）
+
+    def preprocess(self, rgbs: list, size: int = None) -> torch.Tensor:
+        raise NotImplementedError
+
+    def forward(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        raise NotImplementedError
+
+    @torch.no_grad()
+    def predict(self, rgb: np.ndarray) -> torch.Tensor:
+        """单张图片，返回 (h, w) 深度张量"""
+        return self.forward(self.preprocess([rgb]))[0]
+
+
+# ---------- DPT 系列（transformers） ----------
+class DPTBackend(DepthBackend):
+    def __init__(self, name: str, model_id: str, resizable: bool = True, quantize: bool = False):
+        self.name = name
+        self.model_id = model_id
+        self.resizable = resizable
+        self.quantized = quantize
+        self.processor = DPTImageProcessor.from_pretrained(model_id, cache_dir=DPT_CACHE_DIR)
+        model = DPTForDepthEstimation.from_pretrained(model_id, cache_dir=DPT_CACHE_DIR).eval()
+        if quantize:
+            from quantization import quantize_dynamic_linear
+
+            self.device = "cpu"
+            self.model = quantize_dynamic_linear(model)
+        else:
+            self.device = DEVICE
+            self.model = model.to(DEVICE)
+
+    def preprocess(self, rgbs: list, size: int = None) -> torch.Tensor:
+        if size and self.resizable:
+            size = max(32, size // 32 * 32)
+            return self.processor(images=rgbs, size={"height": size, "width": size},
+                                  keep_aspect_ratio=False, return_tensors="pt")["pixel_values"]
+        return self.processor(images=rgbs, return_tensors="pt")["pixel_values"]
+
+    @torch.no_grad()
+    def forward(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        return self.model(pixel_values=pixel_values.to(self.device)).predicted_depth
+
+
+# ---------- MidasSmall（EfficientNet-Lite3） ----------
+class MidasSmallBackend(DepthBackend):
+    INPUT_SIZE = 256
+    MEAN = torch.tensor([0.485, 0.456, 0.406]).view(1, 3, 1, 1)
+    STD = torch.tensor([0.229, 0.224, 0.225]).view(1, 3, 1, 1)
+
+    def __init__(self, name: str, weights_path: str):
+        from midas_model import MidasSmall
+
+        if not os.path.exists(weights_path):
+            raise FileNotFoundError(f"MidasSmall 权重不存在：{weights_path}")
+        self.name = name
+        self.weights_path = weights_path
+        state = torch.load(weights_path, map_location="cpu")
+        # distill_midas 的检查点记录了蒸馏时的输入边长，默认按它推理；普通 state_dict 用 INPUT_SIZE
+        self.input_size = int(state.get("input_size", self.INPUT_SIZE)) if "model" in state else self.INPUT_SIZE
+        self.model = MidasSmall()
+        self.model.load_state_dict(state.get("model", state))
+        self.model = self.model.to(DEVICE).eval()
+
+    def preprocess(self, rgbs: list, size: int = None) -> torch.Tensor:
+        size = max(32, size // 32 * 32) if size else self.input_size
+        batch = np.stack([cv2.resize(rgb, (size, size), interpolation=cv2.INTER_AREA) for rgb in rgbs])
+        x = torch.from_numpy(batch).permute(0, 3, 1, 2).float() / 255.0
+        return (x - self.MEAN) / self.STD
+
+    @torch.no_grad()
+    def forward(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        return self.model(pixel_values.to(DEVICE)).squeeze(1)
+
+
+# ---------- 注册表 ----------
+BACKENDS = {
+    "dpt-large": lambda: DPTBackend("dpt-large", "Intel/dpt-large"),
+    "dpt-hybrid": lambda: DPTBackend("dpt-hybrid", "Intel/dpt-hybrid-midas"),
+    "dpt-large-int8": lambda: DPTBackend("dpt-large-int8", "Intel/dpt-large", quantize=True),
+    "dpt-hybrid-int8": lambda: DPTBackend("dpt-hybrid-int8", "Intel/dpt-hybrid-midas", quantize=True),
+    "dpt-swinv2-tiny": lambda: DPTBackend("dpt-swinv2-tiny", "Intel/dpt-swinv2-tiny-256", resizable=False),
+    "midas-small": lambda: MidasSmallBackend("midas-small", MIDAS_SMALL_WEIGHTS),
+}
+
+_loaded = {}
+_load_lock = threading.Lock()
+
+
+def get_backend(name: str = None) -> DepthBackend:
+    """按名称获取（首次使用时加载并缓存）深度后端"""
+    name = name or DEFAULT_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"未知深度后端 '{name}'，可选：{list(BACKENDS)}")
+    backend = _loaded.get(name)
+    if backend is None:
+        with _load_lock:
+            backend = _loaded.get(name)
+            if backend is None:
+                backend = BACKENDS[name]()
+                _loaded[name] = backend
+    return backend
@@ -0,0 +1,155 @@
+"""体积估算诊断数据
+
+请求路径上只登记原图与掩膜的引用（不做任何编码），由后台线程压缩成紧凑记录：
+掩膜 RLE + 长边不超过 preview_max_side 的 JPEG 预览，存入有界 LRU（按 request_id 查询，叠加图按需渲染），
+并按采样率把掩膜 PNG 与叠加图写入磁盘。
+持有全分辨率数据的待处理条目最多 max_pending 个（12 MP 照片每条约 60 MB），后台来不及处理时新条目直接丢弃并计数；
+诊断接口访问到尚未处理的条目时在调用线程上就地压缩。
+"""
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from mask_codec import decode_mask, encode_mask, mask_to_png
+
+logger = logging.getLogger("volume-diagnostics")
+
+
+class DiagnosticsStore:
+    def __init__(self, out_dir: str, capacity: int = 256, sample_rate: float = 0.1,
+                 preview_max_side: int = 1024, max_pending: int = 8):
+        self.out_dir = out_dir
+        self.capacity = capacity
+        self.sample_rate = sample_rate
+        self.preview_max_side = preview_max_side
+        self.max_pending = max_pending
+        self._records = OrderedDict()
+        self._pending = {}    # request_id -> (img, food_mask, hand_mask, food_rle)，等待压缩
+        self._building = {}   # request_id -> Event，正在压缩
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()  # 只放 request_id，数量受 max_pending 约束
+        self.dropped = 0
+        self.written = 0
+        os.makedirs(out_dir, exist_ok=True)
+        threading.Thread(target=self._worker, name="diagnostics-writer", daemon=True).start()
+
+    # ---------- 请求路径 ----------
+    def submit(self, request_id: str, img: np.ndarray, food_mask: np.ndarray, hand_mask: np.ndarray,
+               food_rle: dict = None):
+        """只登记引用，调用后 img / 掩膜不得再被修改；food_rle 已算好时压缩阶段直接复用"""
+        with self._lock:
+            if len(self._pending) + len(self._building) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending[request_id] = (img, food_mask, hand_mask, food_rle)
+        self._queue.put(request_id)
+
+    # ---------- 压缩（后台线程，或诊断接口按需） ----------
+    def build_record(self, img: np.ndarray, food_mask: np.ndarray, hand_mask: np.ndarray,
+                     food_rle: dict = None) -> dict:
+        h, w = img.shape[:2]
+        scale = min(1.0, self.preview_max_side / max(h, w))
+        preview = img if scale >= 1.0 else cv2.resize(
+            img, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+        ok, buf = cv2.imencode(".jpg", preview, [cv2.IMWRITE_JPEG_QUALITY, 85])
+        return {
+            "created": time.time(),
+            "preview_jpg": buf.tobytes() if ok else None,
+            "food": food_rle or encode_mask(food_mask),
+            "hand": encode_mask(hand_mask),
+        }
+
+    def _process(self, request_id: str):
+        """若该条目仍在等待则在当前线程压缩并入库，返回记录；已被其他线程取走或不存在时返回 None"""
+        with self._lock:
+            raw = self._pending.pop(request_id, None)
+            if raw is None:
+                return None
+            done = self._building[request_id] = threading.Event()
+        try:
+            record = self.build_record(*raw)
+            del raw  # 尽早释放全分辨率数据
+            with self._lock:
+                self._records[request_id] = record
+                self._records.move_to_end(request_id)
+                while len(self._records) > self.capacity:
+                    self._records.popitem(last=False)
+            if random.random() < self.sample_rate:
+                self._write(request_id, record)
+            return record
+        except Exception as e:
+            logger.error(f"诊断数据处理失败 {request_id}: {e}")
+            return None
+        finally:
+            with self._lock:
+                self._building.pop(request_id, None)
+            done.set()
+
+    def _worker(self):
+        while True:
+            self._process(self._queue.get())
+
+    def _write(self, request_id: str, record: dict):
+        with open(os.path.join(self.out_dir, f"{request_id}_food_mask.png"), "wb") as f:
+            f.write(mask_to_png(decode_mask(record["food"])))
+        overlay = self.render_overlay(record)
+        if overlay is not None:
+            with open(os.path.join(self.out_dir, f"{request_id}_overlay.jpg"), "wb") as f:
+                f.write(overlay)
+        with self._lock:
+            self.written += 1
+
+    # ---------- 查询与按需渲染 ----------
+    def get(self, request_id: str, wait: float = 2.0):
+        """尚未压缩的条目就地压缩；正由后台线程压缩的最多等待 wait 秒"""
+        with self._lock:
+            record = self._records.get(request_id)
+            done = self._building.get(request_id)
+        if record is not None:
+            return record
+        if done is None:
+            record = self._process(request_id)
+            if record is not None:
+                return record
+            with self._lock:
+                done = self._building.get(request_id)
+        if done is not None:
+            done.wait(wait)
+        with self._lock:
+            return self._records.get(request_id)
+
+    @staticmethod
+    def render_mask(record: dict) -> bytes:
+        return mask_to_png(decode_mask(record["food"]))
+
+    @staticmethod
+    def render_overlay(record: dict):
+        if record["preview_jpg"] is None:
+            return None
+        img = cv2.imdecode(np.frombuffer(record["preview_jpg"], np.uint8), cv2.IMREAD_COLOR)
+        size = (img.shape[1], img.shape[0])
+        food = cv2.resize(decode_mask(record["food"]), size, interpolation=cv2.INTER_NEAREST) > 0
+        hand = cv2.resize(decode_mask(record["hand"]), size, interpolation=cv2.INTER_NEAREST) > 0
+        overlay = img.copy()
+        overlay[food] = [0, 255, 0]
+        overlay[hand] = [255, 0, 0]
+        vis = cv2.addWeighted(img, 0.6, overlay, 0.4, 0)
+        ok, buf = cv2.imencode(".jpg", vis)
+        return buf.tobytes() if ok else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "records": len(self._records),
+                "pending": len(self._pending) + len(self._building),
+                "dropped": self.dropped,
+                "written": self.written,
+                "sample_rate": self.sample_rate,
+            }
@@ -1,23 +1,30 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Depends
+from fastapi import FastAPI, File, UploadFile, Form, Body, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 import uvicorn
-import requests
 import logging
 import io
 import cv2
 import numpy as np
 import os
+import sys
 from datetime import datetime
+from typing import List
 from PIL import Image
 import mediapipe as mp
-from sqlalchemy import create_engine, Column, Integer, String, Float
+from sqlalchemy import create_engine, inspect, text, Column, Integer, String, Float
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 
 # 模糊查询依赖
-from fuzzywuzzy import fuzz
 import jieba
+from dish_index import DishNameIndex
+from image_store import store_from_env
+import volume_client
+from volume_client import VolumeInputError, estimate_volume
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from service_metrics import instrument_fastapi, register_pool, sqlalchemy_pool_stats, stage
 
 # ------------------ 日志配置 ------------------
 logging.basicConfig(
@@ -26,9 +33,8 @@ logging.basicConfig(
 )
 logger = logging.getLogger("calorie-api")
 
-# ------------------ 目录准备 ------------------
-os.makedirs("original_images", exist_ok=True)
-os.makedirs("hand_removed_images", exist_ok=True)
+# ------------------ 图片存储（内容寻址 + 定期淘汰） ------------------
+image_store = store_from_env()
 
 # ------------------ 数据库配置 ------------------
 MYSQL_CONFIG = {
@@ -41,6 +47,7 @@ MYSQL_CONFIG = {
 SQLALCHEMY_DATABASE_URL = f"mysql+pymysql://{MYSQL_CONFIG['user']}:{MYSQL_CONFIG['password']}@{MYSQL_CONFIG['host']}:{MYSQL_CONFIG['port']}/{MYSQL_CONFIG['database']}"
 engine = create_engine(SQLALCHEMY_DATABASE_URL, pool_size=10, max_overflow=20, pool_recycle=3600)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+register_pool("dish_calorie_name", lambda: sqlalchemy_pool_stats(engine))
 Base = declarative_base()
 
 
@@ -49,6 +56,8 @@ class FoodNutrition(Base):
     __tablename__ = "dish_calorie_simple"
     id = Column(Integer, primary_key=True, index=True)
     dish_name = Column(String(255), unique=True, index=True, nullable=False)
+    # normalize_dish_name(dish_name) 的持久化结果，用于新增时的重复检测（单次索引查询）
+    dish_name_norm = Column(String(255), index=True, nullable=True)
     kcal_per100g = Column(Float, nullable=False)
 
 
@@ -57,6 +66,7 @@ Base.metadata.create_all(bind=engine)
 
 # ------------------ FastAPI 初始化 ------------------
 app = FastAPI(title="卡路里计算 API")
+instrument_fastapi(app, "dish_calorie_name")
 
 app.add_middleware(
     CORSMiddleware,
@@ -92,29 +102,30 @@ def segment_words(text: str) -> str:
     return ' '.join(jieba.cut(text))
 
 
-def get_nutrition_data(dish_name: str, db: Session):
-    norm_input = normalize_dish_name(dish_name)
-    input_seg = segment_words(norm_input)
+# 进程级菜名索引：预归一化 + 预分词 + n-gram 倒排，/api/add_dish 原地更新
+dish_index = DishNameIndex(normalize_dish_name, segment_words, min_score=70)
+QUERY_BATCH_MAX = 200
+
 
-    all_dishes = db.query(FoodNutrition).all()
-    best_match = None
-    highest_score = 0
+@stage("db_lookup")
+def load_dish_rows(db: Session):
+    return (db.query(FoodNutrition.id, FoodNutrition.dish_name, FoodNutrition.kcal_per100g)
+            .order_by(FoodNutrition.id).all())
 
-    for item in all_dishes:
-        db_name_norm = normalize_dish_name(item.dish_name)
-        db_name_seg = segment_words(db_name_norm)
-        score = fuzz.token_set_ratio(input_seg, db_name_seg)
 
-        if score > highest_score:
-            highest_score = score
-            best_match = item
+def load_dish_rows_own_session():
+    """索引过期后在后台线程重建，不能借用请求的 Session，单独开一个"""
+    db = SessionLocal()
+    try:
+        return load_dish_rows(db)
+    finally:
+        db.close()
 
-        if db_name_norm == norm_input:
-            return item
 
-    if highest_score >= 70:
-        return best_match
-    return None
+def get_nutrition_data(dish_name: str, db: Session):
+    dish_index.ensure_loaded(load_dish_rows_own_session)
+    with stage("fuzzy_match"):
+        return dish_index.lookup(dish_name)
 
 
 # ------------------ Mediapipe 手部检测 ------------------
@@ -128,19 +139,18 @@ hands = mp_hands.Hands(
 
 
 # ------------------ 工具函数 ------------------
-def process_image(image_bytes: bytes) -> tuple[bytes, str]:
+def process_image(image_bytes: bytes) -> tuple[bytes, str, np.ndarray]:
     try:
         ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-        original_path = f"original_images/original_{ts}.jpg"
-        with open(original_path, "wb") as f:
-            f.write(image_bytes)
+        image_store.put("original_images", image_bytes)
 
         image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
         img_np = np.array(image)
         img_bgr = cv2.cvtColor(img_np, cv2.COLOR_RGB2BGR)
         h, w = img_bgr.shape[:2]
 
-        results = hands.process(cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB))
+        with stage("hand_detection"):
+            results = hands.process(cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB))
         if results.multi_hand_landmarks:
             for hand_landmarks in results.multi_hand_landmarks:
                 key_pts = [(int(lm.x * w), int(lm.y * h)) for lm in hand_landmarks.landmark]
@@ -152,8 +162,6 @@ def process_image(image_bytes: bytes) -> tuple[bytes, str]:
                     cv2.fillPoly(img_bgr, [hull_expanded.astype(np.int32)], (0, 0, 0))
 
         processed_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
-        processed_path = f"hand_removed_images/processed_{ts}.jpg"
-        cv2.imwrite(processed_path, cv2.cvtColor(processed_rgb, cv2.COLOR_RGB2BGR))
 
         buffer = io.BytesIO()
         Image.fromarray(processed_rgb).save(buffer, format="JPEG", quality=100)
@@ -165,11 +173,13 @@ def process_image(image_bytes: bytes) -> tuple[bytes, str]:
             logger.error("处理后的图片损坏，使用原始图替代")
             processed_bytes = image_bytes
 
-        return processed_bytes, processed_path
+        processed_path = image_store.put("hand_removed_images", processed_bytes)
+        # 去手后的 ndarray 一并返回，同进程估算体积时无需再解码
+        return processed_bytes, processed_path, img_bgr
 
     except Exception as e:
         logger.error(f"图片处理失败: {e}，使用原始图")
-        return image_bytes, f"error_{ts}.jpg"
+        return image_bytes, f"error_{ts}.jpg", None
 
 
 def estimate_density(dish_name: str, dish_type: str) -> float:
@@ -188,13 +198,12 @@ def estimate_kcal(dish_name: str, db: Session) -> float:
     return 100.0
 
 
-def call_volume_service(img_bytes: bytes, hand_length_cm: float) -> float:
+async def call_volume_service(img_bytes: bytes, hand_length_cm: float, img_bgr: np.ndarray = None) -> float:
     try:
-        files = {"file": ("dish.jpg", img_bytes, "image/jpeg")}
-        data = {"hand_length_cm": str(hand_length_cm)}
-        resp = requests.post("http://127.0.0.1:8000/predict", files=files, data=data, timeout=60)
-        resp.raise_for_status()
-        return float(resp.json()["volume_cm3"])
+        js = await estimate_volume(hand_length_cm, img_bgr=img_bgr, img_bytes=img_bytes)
+        return float(js["volume_cm3"])
+    except VolumeInputError as e:
+        raise HTTPException(status_code=400, detail=f"体积估算失败: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=503, detail=f"体积服务调用失败: {str(e)}")
 
@@ -241,7 +250,7 @@ async def calorie_predict(
             })
 
         # 2. 图片处理
-        processed_img_bytes, processed_path = process_image(img_bytes)
+        processed_img_bytes, processed_path, processed_bgr = process_image(img_bytes)
 
         # 3. 检查食物是否存在
         nutrition_data = get_nutrition_data(dish_name, db)
@@ -254,7 +263,7 @@ async def calorie_predict(
             })
 
         # 4. 计算卡路里
-        volume_cm3 = call_volume_service(processed_img_bytes, hand_length_cm)
+        volume_cm3 = await call_volume_service(processed_img_bytes, hand_length_cm, processed_bgr)
         density = estimate_density(dish_name, dish_type)
         kcal_per100g = nutrition_data.kcal_per100g
 
@@ -334,6 +343,58 @@ async def query_dish(
         })
 
 
+# ------------------ 批量查询接口：一次解析整餐菜名 ------------------
+@app.post("/api/query_dish_batch")
+async def query_dish_batch(
+        dish_names: List[str] = Body(..., embed=True, description="食物名称列表"),
+        db: Session = Depends(get_db)
+):
+    try:
+        if not dish_names:
+            return JSONResponse({
+                "success": False,
+                "code": 400,
+                "message": "参数错误：食物名称列表不能为空",
+                "data": None
+            })
+        if len(dish_names) > QUERY_BATCH_MAX:
+            return JSONResponse({
+                "success": False,
+                "code": 400,
+                "message": f"参数错误：单次最多查询 {QUERY_BATCH_MAX} 个食物名称",
+                "data": None
+            })
+
+        dish_index.ensure_loaded(load_dish_rows_own_session)
+        with stage("fuzzy_match"):
+            matches = dish_index.lookup_batch(dish_names)
+
+        items = []
+        for query, (entry, score) in zip(dish_names, matches):
+            items.append({
+                "query": query,
+                "matched": entry is not None,
+                "dish_name": entry.dish_name if entry else None,
+                "score": score,
+                "kcal_per100g": entry.kcal_per100g if entry else None
+            })
+        matched = sum(1 for item in items if item["matched"])
+
+        return JSONResponse({
+            "success": True,
+            "code": 200,
+            "message": f"共查询 {len(items)} 个，匹配 {matched} 个",
+            "data": {"items": items}
+        })
+    except Exception as e:
+        logger.error(f"批量查询接口异常: {e}")
+        return JSONResponse({
+            "success": False,
+            "code": 500,
+            "message": f"批量查询失败：{str(e)}"
+        })
+
+
 # ------------------ 新增接口：添加食物信息 ------------------
 @app.post("/api/add_dish")
 async def add_dish(
@@ -358,12 +419,9 @@ async def add_dish(
                 "data": None
             })
 
-        all_dishes = db.query(FoodNutrition).all()
-        existing = None
-        for dish in all_dishes:
-            if normalize_dish_name(dish.dish_name) == normalized_name:
-                existing = dish
-                break
+        existing = (db.query(FoodNutrition)
+                    .filter(FoodNutrition.dish_name_norm == normalized_name)
+                    .first())
 
         if existing:
             return JSONResponse({
@@ -375,11 +433,13 @@ async def add_dish(
 
         new_dish = FoodNutrition(
             dish_name=dish_name.strip(),
+            dish_name_norm=normalized_name,
             kcal_per100g=round(kcal_per100g, 1)
         )
         db.add(new_dish)
         db.commit()
         db.refresh(new_dish)
+        dish_index.add(new_dish.id, new_dish.dish_name, new_dish.kcal_per100g)
 
         return JSONResponse({
             "success": True,
@@ -399,12 +459,55 @@ async def add_dish(
         })
 
 
+# ------------------ 归一化名称列：补齐结构并与 normalize_dish_name 同步 ------------------
+def sync_dish_name_norm():
+    table = FoodNutrition.__table__
+    inspector = inspect(engine)
+    columns = {col["name"] for col in inspector.get_columns(table.name)}
+    indexes = {ix["name"] for ix in inspector.get_indexes(table.name)}
+    with engine.begin() as conn:
+        if "dish_name_norm" not in columns:
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN dish_name_norm VARCHAR(255) NULL"))
+        for ix in table.indexes:
+            if ix.name not in indexes and "dish_name_norm" in ix.columns:
+                ix.create(bind=conn)
+
+    # 归一化规则变更后，按当前规则重算不一致的行（仅启动时扫描一次）
+    db = SessionLocal()
+    try:
+        rows = db.query(FoodNutrition.id, FoodNutrition.dish_name, FoodNutrition.dish_name_norm).all()
+        updates = []
+        for dish_id, dish_name, stored_norm in rows:
+            norm = normalize_dish_name(dish_name)
+            if norm != stored_norm:
+                updates.append({"id": dish_id, "dish_name_norm": norm})
+        if updates:
+            db.bulk_update_mappings(FoodNutrition, updates)
+            db.commit()
+        logger.info(f"归一化名称已同步：更新 {len(updates)} 条")
+    finally:
+        db.close()
+
+
 # ------------------ 启动事件：仅初始化表结构（不删除已有表） ------------------
 @app.on_event("startup")
 def startup_event():
     # 仅创建不存在的表，不删除已有表和数据
     Base.metadata.create_all(bind=engine)
     logger.info("数据库表结构已初始化（保留已有数据）")
+    sync_dish_name_norm()
+    db = SessionLocal()
+    try:
+        dish_index.load(load_dish_rows(db))
+        logger.info(f"菜名索引已加载：{len(dish_index)} 条")
+    finally:
+        db.close()
+
+
+# ------------------ 关闭事件：释放体积服务连接池 ------------------
+@app.on_event("shutdown")
+async def shutdown_event():
+    await volume_client.aclose()
 
 
 # ------------------ 启动服务 ------------------
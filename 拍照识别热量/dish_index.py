@@ -0,0 +1,208 @@
+"""菜名模糊检索索引
+
+进程内常驻：启动（或过期）时从 dish_calorie_simple 一次性加载全部菜名，
+预先完成归一化与 jieba 分词，并建立字符 n-gram 倒排表。查询时先走归一化
+名称的精确匹配，否则只对 n-gram 重叠度最高的少量候选做 token_set_ratio 打分。
+批量查询则用 rapidfuzz 一次性计算（查询数 × 菜品数）得分矩阵。
+
+过期后的重建在后台线程中进行（同一时刻只有一个），期间继续用旧索引应答；
+重建期间 add() 的菜品会在新索引替换旧索引前补入，不会因读库早于提交而丢失。
+"""
+import logging
+import threading
+import time
+from collections import Counter, defaultdict, namedtuple
+
+import numpy as np
+from fuzzywuzzy import fuzz
+from rapidfuzz import fuzz as rf_fuzz, process as rf_process, utils as rf_utils
+
+logger = logging.getLogger("dish-index")
+
+DishEntry = namedtuple("DishEntry", ["id", "dish_name", "kcal_per100g"])
+
+
+def char_ngrams(text: str, n: int) -> set:
+    if len(text) <= n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class _IndexState:
+    """一次完整加载得到的索引数据，重建时整体替换"""
+
+    def __init__(self):
+        self.entries = []        # DishEntry，按 id 顺序
+        self.norms = []          # 归一化名称
+        self.segs = []           # 归一化后分词结果（空格连接）
+        self.exact = {}          # 归一化名称 -> 第一条记录下标
+        self.bigrams = defaultdict(list)   # n-gram -> 记录下标列表
+        self.unigrams = defaultdict(list)  # 单字 -> 记录下标列表（短查询兜底）
+
+
+class DishNameIndex:
+    def __init__(self, normalize, segment, ngram: int = 2, max_candidates: int = 200,
+                 min_score: int = 70, ttl_seconds: float = 600.0):
+        self.normalize = normalize
+        self.segment = segment
+        self.ngram = ngram
+        self.max_candidates = max_candidates
+        self.min_score = min_score
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()  # 重建互斥：同一时刻只有一个重建
+        self._state = _IndexState()
+        self._loaded_at = None
+        self._pending = None  # 重建期间 add() 的记录，重建完成时补入新索引
+
+    # ---------- 构建 ----------
+    def _append(self, state: _IndexState, dish_id, dish_name: str, kcal_per100g: float):
+        norm = self.normalize(dish_name)
+        idx = len(state.entries)
+        state.entries.append(DishEntry(dish_id, dish_name, kcal_per100g))
+        state.norms.append(norm)
+        state.segs.append(self.segment(norm))
+        state.exact.setdefault(norm, idx)
+        for gram in char_ngrams(norm, self.ngram):
+            state.bigrams[gram].append(idx)
+        for ch in set(norm):
+            state.unigrams[ch].append(idx)
+
+    def _rebuild(self, loader):
+        """调用方持有 _reload_lock。loader() 读库开始之后 add() 的菜品可能不在读到的行里，
+        替换前按 id 补入"""
+        with self._lock:
+            self._pending = []
+        try:
+            state = _IndexState()
+            for dish_id, dish_name, kcal in loader():
+                self._append(state, dish_id, dish_name, kcal)
+        except BaseException:
+            with self._lock:
+                self._pending = None
+            raise
+        loaded_ids = {entry.id for entry in state.entries}
+        with self._lock:
+            for dish_id, dish_name, kcal in self._pending:
+                if dish_id not in loaded_ids:
+                    self._append(state, dish_id, dish_name, kcal)
+            self._pending = None
+            self._state = state
+            self._loaded_at = time.monotonic()
+
+    def load(self, rows):
+        """rows: 可迭代的 (id, dish_name, kcal_per100g)，按 id 升序；同步构建"""
+        with self._reload_lock:
+            self._rebuild(lambda: rows)
+
+    def _refresh_in_background(self, loader):
+        try:
+            self._rebuild(loader)
+            logger.info(f"菜名索引已刷新：{len(self)} 条")
+        except Exception as e:
+            # 保留旧索引，ttl 之后再试
+            self._loaded_at = time.monotonic()
+            logger.error(f"菜名索引刷新失败：{e}")
+        finally:
+            self._reload_lock.release()
+
+    def ensure_loaded(self, loader):
+        """首次使用时同步加载；超过 ttl 后在后台线程调用 loader() 重建（兼顾其他进程写入的新菜品），
+        本次及重建期间的查询继续使用旧索引。loader 在后台线程中运行，须自行获取数据库会话"""
+        if self._loaded_at is None:
+            with self._reload_lock:
+                if self._loaded_at is None:
+                    self._rebuild(loader)
+            return
+        if time.monotonic() - self._loaded_at < self.ttl_seconds:
+            return
+        if not self._reload_lock.acquire(blocking=False):
+            return  # 已有重建在进行
+        try:
+            threading.Thread(target=self._refresh_in_background, args=(loader,),
+                             name="dish-index-refresh", daemon=True).start()
+        except BaseException:
+            self._reload_lock.release()
+            raise
+
+    def add(self, dish_id, dish_name: str, kcal_per100g: float):
+        """新增菜品后原地更新索引，无需整体重建"""
+        with self._lock:
+            self._append(self._state, dish_id, dish_name, kcal_per100g)
+            if self._pending is not None:
+                self._pending.append((dish_id, dish_name, kcal_per100g))
+
+    def __len__(self):
+        return len(self._state.entries)
+
+    # ---------- 查询 ----------
+    def _candidates(self, state: _IndexState, norm: str) -> list:
+        counts = Counter()
+        for gram in char_ngrams(norm, self.ngram):
+            counts.update(state.bigrams.get(gram, ()))
+        if not counts:
+            for ch in set(norm):
+                counts.update(state.unigrams.get(ch, ()))
+        # 保持目录顺序，使同分时与全表扫描选中同一条记录
+        return sorted(idx for idx, _ in counts.most_common(self.max_candidates))
+
+    def lookup(self, dish_name: str):
+        state = self._state
+        norm_input = self.normalize(dish_name)
+
+        idx = state.exact.get(norm_input)
+        if idx is not None:
+            return state.entries[idx]
+
+        input_seg = self.segment(norm_input)
+        best_idx = None
+        highest_score = 0
+        for idx in self._candidates(state, norm_input):
+            score = fuzz.token_set_ratio(input_seg, state.segs[idx])
+            if score > highest_score:
+                highest_score = score
+                best_idx = idx
+
+        if best_idx is not None and highest_score >= self.min_score:
+            return state.entries[best_idx]
+        return None
+
+    def lookup_batch(self, dish_names: list) -> list:
+        """批量查询，返回与输入等长的 [(DishEntry 或 None, 得分)]
+
+        精确匹配直接命中；其余名称与整个目录在一次向量化调用中打分，
+        逐行取最高分（同分取目录中靠前者），低于 min_score 视为未命中。
+        """
+        state = self._state
+        results = [(None, 0)] * len(dish_names)
+        pending_rows, pending_segs = [], []
+        for row, dish_name in enumerate(dish_names):
+            norm_input = self.normalize(dish_name)
+            idx = state.exact.get(norm_input)
+            if idx is not None:
+                results[row] = (state.entries[idx], 100)
+            elif norm_input:
+                pending_rows.append(row)
+                pending_segs.append(self.segment(norm_input))
+
+        # 只取当前已完整写入的前缀，避免与并发的 add() 错位
+        catalog_segs = state.segs[:len(state.segs)]
+        if not pending_rows or not catalog_segs:
+            return results
+
+        scores = rf_process.cdist(
+            pending_segs, catalog_segs,
+            scorer=rf_fuzz.token_set_ratio,
+            processor=rf_utils.default_process,
+            dtype=np.uint8,
+            workers=-1,
+        )
+        best = scores.argmax(axis=1)
+        for i, row in enumerate(pending_rows):
+            idx = int(best[i])
+            score = int(scores[i, idx])
+            if score >= self.min_score:
+                results[row] = (state.entries[idx], score)
+            else:
+                results[row] = (None, score)
+        return results
@@ -2,18 +2,26 @@ from fastapi import FastAPI, File, UploadFile, Form, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, FileResponse
 import uvicorn
-import requests
+import asyncio
 import logging
 import io
 import cv2
 import numpy as np
-import re
 import os
-import base64
+import sys
 from datetime import datetime
 from PIL import Image
 import mediapipe as mp
 from aip import AipImageClassify
+from image_store import IMAGE_KINDS, store_from_env
+from mask_codec import mask_to_png
+from recognition_cache import cache_from_env
+from recognizers import recognizer_from_env
+import volume_client
+from volume_client import VOLUME_IN_PROCESS, VolumeInputError, VolumeServiceError, estimate_volume
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from service_metrics import instrument_fastapi, stage
 
 # ------------------ 配置 ------------------
 logging.basicConfig(
@@ -23,14 +31,14 @@ logging.basicConfig(
 logger = logging.getLogger("calorie_api")
 
 # 创建图片保存目录
-os.makedirs("hand_removed_images", exist_ok=True)
-os.makedirs("original_images", exist_ok=True)
 os.makedirs("baidu_api_input", exist_ok=True)
-os.makedirs("food_masks", exist_ok=True)
-os.makedirs("volume_overlays", exist_ok=True)
+
+# 上传图、去手图、掩膜统一进入内容寻址存储（去重、分片目录、按大小/时间淘汰）
+image_store = store_from_env()
 
 # ------------------ FastAPI 初始化 ------------------
 app = FastAPI(title="Calorie API")
+instrument_fastapi(app, "dish_weight_calorie")
 
 app.add_middleware(
     CORSMiddleware,
@@ -47,8 +55,13 @@ SECRET_KEY = "5SckesBtVaCJfSdNOmxvYe9fkiYFUQcd"
 BAIDU = AipImageClassify(APP_ID, API_KEY, SECRET_KEY)
 BAIDU_PARAMS = {"top_num": 5, "filter_threshold": 0.5}
 
-# ------------------ 体积服务地址 ------------------
-VOLUME_URL = "http://127.0.0.1:8000/predict"
+# ------------------ 菜品识别 ------------------
+# RECOGNIZER=baidu/local/stub 选择主识别器，RECOGNIZER_FALLBACK 选择失败时的备用识别器
+# （local 为本地 MobileNetV3 模型，stub 为离线测试桩）
+recognizer = recognizer_from_env(BAIDU, BAIDU_PARAMS, dump_path="baidu_api_input/latest_api_input.jpg")
+
+# 以去手图的感知哈希缓存识别结果，重复/近似重复的照片不再调用远程识别
+recognition_cache = cache_from_env()
 
 # ------------------ Mediapipe 手部检测 ------------------
 mp_hands = mp.solutions.hands
@@ -61,19 +74,19 @@ hands = mp_hands.Hands(
 
 
 # ------------------ 图片处理函数 ------------------
-def process_images(image_bytes: bytes) -> tuple[bytes, bytes, str]:
+def process_images(image_bytes: bytes) -> tuple[bytes, bytes, str, np.ndarray]:
     try:
-        original_ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-        original_save_path = f"original_images/{original_ts}.jpg"
-        with open(original_save_path, "wb") as f:
-            f.write(image_bytes)
+        image_store.put("original_images", image_bytes)
 
         image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
         img_np = np.array(image)
         img_bgr = cv2.cvtColor(img_np, cv2.COLOR_RGB2BGR)
         h, w = img_bgr.shape[:2]
+        # 进程内估算体积时直接使用解码后的原图（去手前）
+        volume_bgr = img_bgr.copy() if VOLUME_IN_PROCESS else None
 
-        results = hands.process(cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB))
+        with stage("hand_detection"):
+            results = hands.process(cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB))
         if results.multi_hand_landmarks:
             for hand_landmarks in results.multi_hand_landmarks:
                 key_pts = [(int(lm.x * w), int(lm.y * h)) for i, lm in enumerate(hand_landmarks.landmark) if i in [0,5,9,13,17]]
@@ -86,17 +99,16 @@ def process_images(image_bytes: bytes) -> tuple[bytes, bytes, str]:
                     cv2.fillPoly(img_bgr, [hull_expanded.astype(np.int32)], (0,0,0))
 
         processed_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
-        baidu_save_path = f"hand_removed_images/baidu_{original_ts}.jpg"
-        cv2.imwrite(baidu_save_path, cv2.cvtColor(processed_rgb, cv2.COLOR_RGB2BGR))
 
         buffer = io.BytesIO()
         Image.fromarray(processed_rgb).save(buffer, format="JPEG", quality=100)
         baidu_img_bytes = buffer.getvalue()
 
         Image.open(io.BytesIO(baidu_img_bytes)).verify()
-        return baidu_img_bytes, image_bytes, baidu_save_path
+        baidu_save_path = image_store.put("hand_removed_images", baidu_img_bytes)
+        return baidu_img_bytes, image_bytes, baidu_save_path, volume_bgr
     except:
-        return image_bytes, image_bytes, f"error_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
+        return image_bytes, image_bytes, f"error_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg", None
 
 
 # ------------------ 工具函数 ------------------
@@ -119,61 +131,26 @@ def estimate_density(name: str) -> float:
     return 0.85
 
 
-def safe_float_convert(s: str) -> float or None:
-    if not s:
-        return None
-    match = re.search(r'[-+]?\d*\.\d+|\d+', s)
-    return float(match.group()) if match else None
-
-
-def baidu_dishname_calorie(img_bytes: bytes):
-    try:
-        with open("baidu_api_input/latest_api_input.jpg", "wb") as f:
-            f.write(img_bytes)
-        res = BAIDU.dishDetect(img_bytes, BAIDU_PARAMS)
-        if not res or not res.get("result"):
-            return None, None
-        for item in res["result"]:
-            dish_name = item.get("name", "")
-            kcal_100g = safe_float_convert(str(item.get("calorie", "")))
-            if kcal_100g and dish_name:
-                return dish_name, kcal_100g
-        return None, None
-    except:
-        return None, None
-
-
-def call_volume_service(img_bytes: bytes, hand_length_cm: float) -> tuple:
+async def call_volume_service(img_bytes: bytes, hand_length_cm: float, img_bgr: np.ndarray = None) -> tuple:
     try:
-        files = {"file": ("dish_original.jpg", img_bytes, "image/jpeg")}
-        data = {"hand_length_cm": str(hand_length_cm)}
-        resp = requests.post(VOLUME_URL, files=files, data=data, timeout=60)
-        resp.raise_for_status()
-        js = resp.json()
+        js = await estimate_volume(hand_length_cm, img_bgr=img_bgr, img_bytes=img_bytes, return_mask=True)
         volume_cm3 = float(js["volume_cm3"])
 
+        # 食物掩膜本地保存（HTTP 模式下由 RLE 解码而来）
         food_mask_path = None
-        if "food_mask_base64" in js:
+        if js["food_mask"] is not None:
             try:
-                mask_data = base64.b64decode(js["food_mask_base64"])
-                food_mask_path = f"food_masks/{datetime.now().strftime('%Y%m%d_%H%M%S')}_mask.png"
-                with open(food_mask_path, "wb") as f:
-                    f.write(mask_data)
+                food_mask_path = image_store.put("food_masks", mask_to_png(js["food_mask"]), ".png")
             except:
-                pass
+                food_mask_path = None
 
-        volume_overlay_path = None
-        if "overlay_base64" in js:
-            try:
-                overlay_data = base64.b64decode(js["overlay_base64"])
-                volume_overlay_path = f"volume_overlays/{datetime.now().strftime('%Y%m%d_%H%M%S')}_overlay.jpg"
-                with open(volume_overlay_path, "wb") as f:
-                    f.write(overlay_data)
-            except:
-                pass
+        # 叠加图由体积服务按需渲染（进程内估算时没有）
+        volume_overlay_url = js.get("overlay_url")
 
-        return volume_cm3, food_mask_path, volume_overlay_path
-    except requests.exceptions.RequestException:
+        return volume_cm3, food_mask_path, volume_overlay_url
+    except VolumeInputError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except VolumeServiceError:
         raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="体积服务调用失败")
     except:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="处理体积服务响应失败")
@@ -199,9 +176,9 @@ def call_volume_service(img_bytes: bytes, hand_length_cm: float) -> tuple:
                                 "weight_g": 350.0,
                                 "kcal_per100g": 200.0,
                                 "total_kcal": 700.0,
-                                "hand_removed_image_path": "hand_removed_images/baidu_20240520_123456.jpg",
-                                "food_mask_path": "food_masks/20240520_123456_mask.png",
-                                "volume_overlay_path": "volume_overlays/20240520_123456_overlay.jpg"
+                                "hand_removed_image_path": "hand_removed_images/9b1f0c6e2d4a8b3c7e5f1a2d6c8b4e0f3a7d9c1b5e2f8a4d6c0b3e7f1a9d5c2b.jpg",
+                                "food_mask_path": "food_masks/4e8a1c3f5b7d9e0a2c4f6b8d1e3a5c7f9b0d2e4a6c8f1b3d5e7a9c0f2b4d6e8a.png",
+                                "volume_overlay_url": "http://127.0.0.1:8000/diagnostics/3f2a9c0e8b7d4e1f9a6b5c4d3e2f1a0b/overlay.jpg"
                             }
                         ]
                     }
@@ -222,15 +199,18 @@ async def calorie_predict(
         raise HTTPException(status_code=400, detail="手掌长度必须在15-25cm之间")
 
     # 处理图片
-    baidu_img, volume_img, black_hand_path = process_images(img_bytes)
+    baidu_img, volume_img, black_hand_path, volume_bgr = process_images(img_bytes)
 
-    # 识别菜品
-    dish_name, kcal_100g = baidu_dishname_calorie(baidu_img)
-    if not dish_name or kcal_100g is None:
-        raise HTTPException(status_code=404, detail="未识别到有效菜品")
-
-    # 计算体积
-    volume_cm3, food_mask_path, volume_overlay_path = call_volume_service(volume_img, hand_length_cm)
+    # 识别菜品与计算体积互不依赖，并发执行；识别失败时取消尚未完成的体积调用
+    volume_task = asyncio.create_task(call_volume_service(volume_img, hand_length_cm, volume_bgr))
+    volume_task.add_done_callback(lambda t: t.cancelled() or t.exception())  # 提前返回时也取走异常，避免告警
+    try:
+        dish_name, kcal_100g = await recognition_cache.aget_or_recognize(baidu_img, recognizer.arecognize)
+        if not dish_name or kcal_100g is None:
+            raise HTTPException(status_code=404, detail="未识别到有效菜品")
+        volume_cm3, food_mask_path, volume_overlay_url = await volume_task
+    finally:
+        volume_task.cancel()  # 已完成时无影响
 
     # 计算结果
     density = estimate_density(dish_name)
@@ -256,7 +236,7 @@ async def calorie_predict(
                         "total_kcal": total_kcal,
                         "hand_removed_image_path": black_hand_path,
                         **({"food_mask_path": food_mask_path} if food_mask_path else {}),
-                        **({"volume_overlay_path": volume_overlay_path} if volume_overlay_path else {})
+                        **({"volume_overlay_url": volume_overlay_url} if volume_overlay_url else {})
                     }
                 ]
             }
@@ -267,17 +247,28 @@ async def calorie_predict(
 # ------------------ 图片访问接口（200成功响应） ------------------
 @app.get("/images/{image_type}/{filename}")
 async def get_image(image_type: str, filename: str):
-    valid_types = ["original_images", "hand_removed_images", "food_masks", "volume_overlays"]
-    if image_type not in valid_types:
-        raise HTTPException(status_code=400, detail=f"无效图片类型，支持：{valid_types}")
+    if image_type not in IMAGE_KINDS:
+        raise HTTPException(status_code=400, detail=f"无效图片类型，支持：{list(IMAGE_KINDS)}")
 
-    image_path = f"{image_type}/{filename}"
-    if not os.path.exists(image_path):
+    image_path = image_store.resolve(image_type, filename)
+    if image_path is None:
         raise HTTPException(status_code=404, detail="图片不存在")
 
 
     return FileResponse(image_path)
 
 
+# ------------------ 识别缓存统计 ------------------
+@app.get("/stats/recognition_cache")
+async def recognition_cache_stats():
+    return JSONResponse(recognition_cache.stats())
+
+
+# ------------------ 关闭事件：释放体积服务连接池 ------------------
+@app.on_event("shutdown")
+async def shutdown_event():
+    await volume_client.aclose()
+
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8001, log_level="info")
\ No newline at end of file
@@ -0,0 +1,352 @@
+"""把 DPT-large 蒸馏为 MidasSmall（EfficientNet-Lite3）
+
+三个步骤：
+1. cache：教师模型对每张食物照片只推理一次，把学生输入（与 MidasSmallBackend.preprocess 相同，整图缩放为
+   size×size）与教师相对逆深度（缩放到 target_size）写入内存映射数组，训练期间不再运行教师；
+2. train：学生以尺度-平移不变损失（按中位数 / 平均绝对偏差归一化后的 L1 + 多尺度梯度匹配）拟合教师深度，
+   验证损失最低的权重写入 MIDAS_SMALL_WEIGHTS（checkpoints/midas_small.pth），体积服务以 DEPTH_BACKEND=midas-small 加载；
+3. eval：在带手掌的真实照片上，手掌检测与食物分割只做一次，分别用教师与学生深度走完整的 measure_volume，
+   对比 thickness_cm / volume_cm3 误差，以及前向延迟与参数量。
+
+    python distill_midas.py cache --images food_photos/ --out distill_cache/
+    python distill_midas.py train --cache distill_cache/ --epochs 30
+    python distill_midas.py eval --images hand_photos/ --report distill_report.json
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import statistics
+import time
+
+import cv2
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from calibrate_quantization import list_images, summarize_ms, timed
+from depth_backends import DEVICE, MIDAS_SMALL_WEIGHTS, MidasSmallBackend
+
+logger = logging.getLogger("distill-midas")
+
+INPUT_SIZE = MidasSmallBackend.INPUT_SIZE
+TARGET_SIZE = 128
+
+
+# ---------- 1. 教师深度缓存 ----------
+def iter_sources(images: str = None, memmap: str = None):
+    """产出 RGB 图片：--images 为任意照片目录；--memmap 复用 prepare_dataset.py 的训练集缓存"""
+    if memmap:
+        from memmap_dataset import MemmapFoodDataset
+
+        dataset = MemmapFoodDataset(memmap, "train")
+        for i in dataset.indices:
+            yield dataset.images[i]
+        return
+    for path in list_images(images, 0):
+        bgr = cv2.imread(path, cv2.IMREAD_COLOR)
+        if bgr is not None:
+            yield cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+
+
+def count_sources(images: str = None, memmap: str = None) -> int:
+    if memmap:
+        return len(np.load(os.path.join(memmap, "split.npz"))["train"])
+    return len(list_images(images, 0))
+
+
+@torch.no_grad()
+def build_cache(out_dir: str, teacher_name: str, images: str = None, memmap: str = None, size: int = INPUT_SIZE,
+                target_size: int = TARGET_SIZE, batch_size: int = 8, val_ratio: float = 0.1, seed: int = 42) -> dict:
+    from depth_backends import get_backend
+
+    teacher = get_backend(teacher_name)
+    n = count_sources(images, memmap)
+    if not n:
+        raise SystemExit("未找到训练图片")
+    os.makedirs(out_dir, exist_ok=True)
+    inputs = np.lib.format.open_memmap(os.path.join(out_dir, "images.npy"), mode="w+",
+                                       dtype=np.uint8, shape=(n, size, size, 3))
+    targets = np.lib.format.open_memmap(os.path.join(out_dir, "teacher.npy"), mode="w+",
+                                        dtype=np.float16, shape=(n, target_size, target_size))
+
+    def flush(batch, start):
+        depth = teacher.forward(teacher.preprocess(batch)).float()
+        depth = F.interpolate(depth[:, None], size=(target_size, target_size), mode="area")[:, 0]
+        targets[start:start + len(batch)] = depth.cpu().numpy().astype(np.float16)
+
+    count, batch, t0 = 0, [], time.time()
+    for rgb in iter_sources(images, memmap):
+        inputs[count] = cv2.resize(rgb, (size, size), interpolation=cv2.INTER_AREA)
+        batch.append(rgb)
+        count += 1
+        if len(batch) == batch_size:
+            flush(batch, count - len(batch))
+            batch = []
+        if count % 500 == 0:
+            logger.info(f"教师推理 {count}/{n}（{count / (time.time() - t0):.1f} 张/秒）")
+    if batch:
+        flush(batch, count - len(batch))
+    inputs.flush()
+    targets.flush()
+
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(count)
+    n_val = max(1, int(round(count * val_ratio)))
+    np.savez(os.path.join(out_dir, "split.npz"), train=np.sort(order[n_val:]), val=np.sort(order[:n_val]))
+    meta = {"teacher": teacher.name, "count": count, "size": size, "target_size": target_size,
+            "val_ratio": val_ratio, "seed": seed, "source": os.path.abspath(memmap or images),
+            "created": time.strftime("%Y-%m-%d %H:%M:%S")}
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return meta
+
+
+class DistillDataset(torch.utils.data.Dataset):
+    """按批读取：__getitem__ 接收一批下标，返回 (B, S, S, 3) uint8 输入与 (B, T, T) 教师深度"""
+
+    def __init__(self, root: str, split: str):
+        with open(os.path.join(root, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.root = root
+        self.indices = np.load(os.path.join(root, "split.npz"))[split]
+        self._arrays = None  # 每个 worker 进程各自打开；spawn 时 pickle 已切片的 memmap 会复制整份数据
+
+    @property
+    def arrays(self):
+        if self._arrays is None:
+            count = self.meta["count"]
+            self._arrays = (np.load(os.path.join(self.root, "images.npy"), mmap_mode="r")[:count],
+                            np.load(os.path.join(self.root, "teacher.npy"), mmap_mode="r")[:count])
+        return self._arrays
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_arrays"] = None
+        return state
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, positions):
+        idx = np.sort(self.indices[np.asarray(positions)])
+        inputs, targets = self.arrays
+        return (torch.from_numpy(np.ascontiguousarray(inputs[idx])),
+                torch.from_numpy(targets[idx].astype(np.float32)))
+
+
+# ---------- 2. 蒸馏训练 ----------
+def normalize_ssi(depth: torch.Tensor) -> torch.Tensor:
+    """(B, H, W) 按样本减中位数、除以平均绝对偏差：消除正尺度与平移，保留远近方向
+    （下游 normalize_depth 是 min-max 归一化，方向反了厚度会完全错误，所以不用最小二乘对齐）"""
+    flat = depth.flatten(1)
+    median = flat.median(dim=1, keepdim=True).values
+    scale = (flat - median).abs().mean(dim=1, keepdim=True).clamp(min=1e-6)
+    return ((flat - median) / scale).view_as(depth)
+
+
+def gradient_loss(diff: torch.Tensor, scales: int = 4) -> torch.Tensor:
+    """多尺度梯度匹配（MiDaS）：约束边缘位置与锐度"""
+    loss = 0.0
+    for k in range(scales):
+        d = diff[:, ::2 ** k, ::2 ** k]
+        loss = loss + (d[:, :, 1:] - d[:, :, :-1]).abs().mean() + (d[:, 1:, :] - d[:, :-1, :]).abs().mean()
+    return loss / scales
+
+
+def distill_loss(pred: torch.Tensor, target: torch.Tensor, alpha: float = 0.5) -> torch.Tensor:
+    """pred 为学生输出 (B, h, w)，插值到教师分辨率后比较"""
+    pred = F.interpolate(pred[:, None], size=target.shape[-2:], mode="bilinear", align_corners=False)[:, 0]
+    diff = normalize_ssi(pred) - normalize_ssi(target)
+    return diff.abs().mean() + alpha * gradient_loss(diff)
+
+
+def prepare_batch(images: torch.Tensor, targets: torch.Tensor, train: bool):
+    """uint8 (B, S, S, 3) → 与 MidasSmallBackend.preprocess 相同的归一化输入；训练时随机水平翻转与亮度 / 对比度扰动"""
+    x = images.to(DEVICE, non_blocking=True).permute(0, 3, 1, 2).float() / 255.0
+    y = targets.to(DEVICE, non_blocking=True)
+    if train:
+        b = x.shape[0]
+        flip = torch.rand(b, device=x.device) < 0.5
+        x = torch.where(flip.view(b, 1, 1, 1), x.flip(-1), x)
+        y = torch.where(flip.view(b, 1, 1), y.flip(-1), y)
+        brightness = torch.empty(b, 1, 1, 1, device=x.device).uniform_(0.8, 1.2)
+        contrast = torch.empty(b, 1, 1, 1, device=x.device).uniform_(0.8, 1.2)
+        x = x * brightness
+        mean = x.mean(dim=(1, 2, 3), keepdim=True)
+        x = ((x - mean) * contrast + mean).clamp(0, 1)
+    x = (x - MidasSmallBackend.MEAN.to(x.device)) / MidasSmallBackend.STD.to(x.device)
+    return x, y
+
+
+def make_loader(dataset: DistillDataset, batch_size: int, shuffle: bool, workers: int):
+    from torch.utils.data import BatchSampler, DataLoader, RandomSampler, SequentialSampler
+
+    sampler = RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+    drop_last = shuffle and len(dataset) > batch_size
+    return DataLoader(dataset, sampler=BatchSampler(sampler, batch_size, drop_last), batch_size=None,
+                      num_workers=workers, pin_memory=DEVICE == "cuda", persistent_workers=workers > 0)
+
+
+def train(cache_dir: str, out_path: str, epochs: int = 30, batch_size: int = 16, lr: float = 3e-4,
+          workers: int = 2, pretrained: bool = True) -> dict:
+    from midas_model import MidasSmall
+
+    train_set, val_set = DistillDataset(cache_dir, "train"), DistillDataset(cache_dir, "val")
+    train_loader = make_loader(train_set, batch_size, True, workers)
+    val_loader = make_loader(val_set, batch_size, False, workers)
+    logger.info(f"教师 {train_set.meta['teacher']}：训练 {len(train_set)} 张 / 验证 {len(val_set)} 张，设备 {DEVICE}")
+
+    model = MidasSmall(pretrained=pretrained).to(DEVICE)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=lr, weight_decay=1e-4)
+    scheduler = torch.optim.lr_scheduler.OneCycleLR(optimizer, max_lr=lr, epochs=epochs,
+                                                    steps_per_epoch=max(1, len(train_loader)))
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+
+    best, history = math.inf, []
+    for epoch in range(epochs):
+        model.train()
+        train_losses = []
+        for images, targets in train_loader:
+            x, y = prepare_batch(images, targets, train=True)
+            loss = distill_loss(model(x).squeeze(1), y)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            scheduler.step()
+            train_losses.append(loss.item())
+
+        model.eval()
+        val_losses = []
+        with torch.no_grad():
+            for images, targets in val_loader:
+                x, y = prepare_batch(images, targets, train=False)
+                val_losses.append(distill_loss(model(x).squeeze(1), y).item())
+
+        train_loss, val_loss = statistics.mean(train_losses), statistics.mean(val_losses)
+        history.append({"epoch": epoch + 1, "train_loss": round(train_loss, 4), "val_loss": round(val_loss, 4)})
+        if val_loss < best:
+            best = val_loss
+            # 与 MidasSmallBackend 的加载方式一致：state.get("model", state)
+            torch.save({"model": model.state_dict(), "teacher": train_set.meta["teacher"],
+                        "input_size": train_set.meta["size"], "epoch": epoch + 1, "val_loss": val_loss}, out_path)
+        logger.info(f"Epoch {epoch + 1}/{epochs} | 训练损失 {train_loss:.4f} | 验证损失 {val_loss:.4f}"
+                    f"{' | 已保存' if val_loss == best else ''}")
+    return {"best_val_loss": round(best, 4), "weights": out_path, "history": history}
+
+
+# ---------- 3. 下游评估 ----------
+def param_count_m(model: torch.nn.Module) -> float:
+    return round(sum(p.numel() for p in model.parameters()) / 1e6, 2)
+
+
+def relative_errors(pairs: list) -> dict:
+    abs_err = [abs(s - t) for t, s in pairs]
+    rel_err = [abs(s - t) / t * 100 for t, s in pairs if t > 0]
+    return {
+        "mean_abs": round(statistics.mean(abs_err), 2),
+        "max_abs": round(max(abs_err), 2),
+        "mean_rel_pct": round(statistics.mean(rel_err), 2) if rel_err else None,
+        "max_rel_pct": round(max(rel_err), 2) if rel_err else None,
+    }
+
+
+@torch.no_grad()
+def evaluate(images: list, teacher_name: str, weights: str, hand_length_cm: float) -> dict:
+    from depth_backends import get_backend
+    from volume_engine import VolumeEstimationError, analyze_image, measure_volume
+
+    teacher = get_backend(teacher_name)
+    student = MidasSmallBackend("midas-small", weights)
+
+    teacher_ms, student_ms, rows, skipped = [], [], [], 0
+    for path in images:
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is None:
+            skipped += 1
+            continue
+        try:
+            rgb, palm_px, food_only, hand_mask = analyze_image(img)
+        except VolumeEstimationError as e:
+            logger.info(f"跳过 {path}：{e}")
+            skipped += 1
+            continue
+
+        depth_t, t_t = timed(teacher.predict, rgb)
+        depth_s, t_s = timed(student.predict, rgb)
+        teacher_ms.append(t_t)
+        student_ms.append(t_s)
+        r_t = measure_volume(rgb, depth_t, food_only, hand_mask, palm_px, hand_length_cm, 0.55, "bowl")
+        r_s = measure_volume(rgb, depth_s, food_only, hand_mask, palm_px, hand_length_cm, 0.55, "bowl")
+        rows.append({"image": path,
+                     "teacher": {k: r_t[k] for k in ("thickness_cm", "volume_cm3")},
+                     "student": {k: r_s[k] for k in ("thickness_cm", "volume_cm3")}})
+
+    report = {
+        "teacher": {"backend": teacher.name, "params_m": param_count_m(teacher.model), **summarize_ms(teacher_ms)},
+        "student": {"backend": student.name, "weights": weights, "params_m": param_count_m(student.model),
+                    **summarize_ms(student_ms)},
+        "images": len(rows),
+        "skipped": skipped,
+    }
+    if teacher_ms and student_ms:
+        report["speedup"] = round(statistics.median(teacher_ms) / statistics.median(student_ms), 1)
+    for key in ("thickness_cm", "volume_cm3"):
+        if rows:
+            report[f"{key}_error"] = relative_errors([(r["teacher"][key], r["student"][key]) for r in rows])
+    report["per_image"] = rows
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="DPT → MidasSmall 深度蒸馏")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_cache = sub.add_parser("cache", help="教师推理一次并缓存深度")
+    src = p_cache.add_mutually_exclusive_group(required=True)
+    src.add_argument("--images", help="食物照片目录")
+    src.add_argument("--memmap", help="prepare_dataset.py 生成的缓存目录（使用其训练集）")
+    p_cache.add_argument("--out", default="distill_cache")
+    p_cache.add_argument("--teacher", default="dpt-large")
+    p_cache.add_argument("--size", type=int, default=INPUT_SIZE, help="学生输入边长")
+    p_cache.add_argument("--target-size", type=int, default=TARGET_SIZE, help="缓存的教师深度边长")
+    p_cache.add_argument("--batch-size", type=int, default=8)
+    p_cache.add_argument("--val-ratio", type=float, default=0.1)
+    p_cache.add_argument("--seed", type=int, default=42)
+
+    p_train = sub.add_parser("train", help="训练学生模型")
+    p_train.add_argument("--cache", default="distill_cache")
+    p_train.add_argument("--out", default=MIDAS_SMALL_WEIGHTS)
+    p_train.add_argument("--epochs", type=int, default=30)
+    p_train.add_argument("--batch-size", type=int, default=16)
+    p_train.add_argument("--lr", type=float, default=3e-4)
+    p_train.add_argument("--workers", type=int, default=2)
+    p_train.add_argument("--no-pretrained", action="store_true", help="编码器不加载 ImageNet 预训练权重")
+
+    p_eval = sub.add_parser("eval", help="对比教师与学生的厚度与体积")
+    p_eval.add_argument("--images", required=True, help="带手掌的食物照片目录或单张图片")
+    p_eval.add_argument("--max-images", type=int, default=0, help="最多使用的图片数（0 为不限）")
+    p_eval.add_argument("--teacher", default="dpt-large")
+    p_eval.add_argument("--weights", default=MIDAS_SMALL_WEIGHTS)
+    p_eval.add_argument("--hand-length-cm", type=float, default=18.0)
+    p_eval.add_argument("--report", default="distill_report.json")
+    args = parser.parse_args()
+
+    if args.command == "cache":
+        print(json.dumps(build_cache(args.out, args.teacher, args.images, args.memmap, args.size, args.target_size,
+                                     args.batch_size, args.val_ratio, args.seed), ensure_ascii=False, indent=2))
+    elif args.command == "train":
+        result = train(args.cache, args.out, args.epochs, args.batch_size, args.lr, args.workers,
+                       pretrained=not args.no_pretrained)
+        print(f"最佳验证损失 {result['best_val_loss']}，权重已写入 {result['weights']}")
+    else:
+        images = list_images(args.images, args.max_images)
+        if not images:
+            raise SystemExit(f"未找到样本图片：{args.images}")
+        report = evaluate(images, args.teacher, args.weights, args.hand_length_cm)
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(json.dumps({k: v for k, v in report.items() if k != "per_image"}, ensure_ascii=False, indent=2))
+        print(f"报告已写入 {args.report}")
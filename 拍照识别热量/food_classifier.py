@@ -0,0 +1,199 @@
+"""本地菜品识别引擎（MobileNetV3-Large / Food-101）
+
+加载 train_model.py 训练得到的 checkpoints/mobilenetv3_food101_best.pth：
+- 首次使用时导出为 TorchScript（权重更新后自动重新导出），之后直接加载脚本模型，服务端不依赖 torchvision；
+- 并发请求经 MicroBatcher 合批前向；
+- 类别下标与 ImageFolder 一致（Food-101 目录名按字母序），通过 food101_labels.json 映射为中文菜名与每100g千卡；
+  配置 DISH_QUERY_URL（dish_calorie_name 的 /api/query_dish_batch）时，加载时一次性把菜名对齐到 dish_calorie_simple；
+- CLASSIFIER_QUANTIZED=1 时加载静态 INT8 量化模型（由 calibrate_quantization.py 校准生成）。
+
+命令行：
+    python food_classifier.py --export              # 只导出 TorchScript
+    python food_classifier.py a.jpg b.jpg --topk 5  # 打印 top-k 结果
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+import torch
+from PIL import Image
+from starlette.concurrency import run_in_threadpool
+
+from inference_batcher import MicroBatcher
+
+logger = logging.getLogger("food-classifier")
+
+CLASSIFIER_WEIGHTS = os.getenv("CLASSIFIER_WEIGHTS", "checkpoints/mobilenetv3_food101_best.pth")
+CLASSIFIER_TORCHSCRIPT = os.getenv("CLASSIFIER_TORCHSCRIPT", "checkpoints/mobilenetv3_food101.ts")
+CLASSIFIER_INT8_TORCHSCRIPT = os.getenv("CLASSIFIER_INT8_TORCHSCRIPT", "checkpoints/mobilenetv3_food101_int8.ts")
+CLASSIFIER_QUANTIZED = os.getenv("CLASSIFIER_QUANTIZED", "0") == "1"
+CLASSIFIER_LABELS = os.getenv("CLASSIFIER_LABELS", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                "food101_labels.json"))
+CLASSIFIER_TOPK = int(os.getenv("CLASSIFIER_TOPK", "5"))
+CLASSIFIER_MIN_PROB = float(os.getenv("CLASSIFIER_MIN_PROB", "0.3"))
+CLASSIFIER_BATCH_MAX_SIZE = int(os.getenv("CLASSIFIER_BATCH_MAX_SIZE", "16"))
+CLASSIFIER_BATCH_MAX_WAIT_MS = float(os.getenv("CLASSIFIER_BATCH_MAX_WAIT_MS", "5"))
+DISH_QUERY_URL = os.getenv("DISH_QUERY_URL")  # 如 http://127.0.0.1:8002/api/query_dish_batch
+
+# 与 train_model.py 的 val_transform 一致：短边缩放到 256，中心裁剪 224，ImageNet 归一化
+RESIZE_SIZE = 256
+CROP_SIZE = 224
+MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+
+# ---------- 模型导出 ----------
+def build_model(num_classes: int) -> torch.nn.Module:
+    from torchvision import models
+
+    model = models.mobilenet_v3_large(weights=None)
+    model.classifier[3] = torch.nn.Linear(model.classifier[3].in_features, num_classes)
+    return model
+
+
+def export_torchscript(weights_path: str = CLASSIFIER_WEIGHTS, out_path: str = CLASSIFIER_TORCHSCRIPT,
+                       num_classes: int = 101) -> str:
+    model = build_model(num_classes)
+    state = torch.load(weights_path, map_location="cpu")
+    model.load_state_dict(state.get("model", state))
+    model.eval()
+    with torch.no_grad():
+        scripted = torch.jit.trace(model, torch.zeros(1, 3, CROP_SIZE, CROP_SIZE))
+    scripted = torch.jit.freeze(scripted)
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    scripted.save(out_path)
+    logger.info(f"TorchScript 已导出：{out_path}")
+    return out_path
+
+
+def load_labels(path: str = CLASSIFIER_LABELS) -> list:
+    """返回按类别下标排列的 [(label, dish_name, kcal_per100g)]"""
+    with open(path, encoding="utf-8") as f:
+        mapping = json.load(f)
+    return [(label, mapping[label]["dish_name"], float(mapping[label]["kcal_per100g"]))
+            for label in sorted(mapping)]
+
+
+def align_labels(labels: list, query_url: str) -> list:
+    """用菜品库的批量查询把中文名对齐到 dish_calorie_simple；查询失败时保留映射表中的值"""
+    import httpx
+
+    try:
+        resp = httpx.post(query_url, json={"dish_names": [name for _, name, _ in labels]}, timeout=10)
+        items = resp.json()["data"]["items"]
+    except Exception as e:
+        logger.warning(f"菜品库对齐失败，使用映射表中的菜名与热量：{e}")
+        return labels
+    aligned = [(label, item["dish_name"], float(item["kcal_per100g"])) if item["matched"] else (label, name, kcal)
+               for (label, name, kcal), item in zip(labels, items)]
+    logger.info(f"菜品库对齐：{sum(item['matched'] for item in items)}/{len(labels)} 个类别")
+    return aligned
+
+
+# ---------- 识别引擎 ----------
+class FoodClassifier:
+    def __init__(self, weights_path: str = CLASSIFIER_WEIGHTS, torchscript_path: str = CLASSIFIER_TORCHSCRIPT,
+                 labels_path: str = CLASSIFIER_LABELS, query_url: str = DISH_QUERY_URL,
+                 quantized: bool = CLASSIFIER_QUANTIZED):
+        self.labels = load_labels(labels_path)
+        if query_url:
+            self.labels = align_labels(self.labels, query_url)
+
+        self.quantized = quantized
+        if quantized:
+            from quantization import select_engine
+
+            select_engine()
+            torchscript_path = CLASSIFIER_INT8_TORCHSCRIPT
+            if not os.path.exists(torchscript_path):
+                raise FileNotFoundError(f"INT8 分类模型不存在：{torchscript_path}，请先运行 calibrate_quantization.py")
+        stale = not quantized and os.path.exists(weights_path) and (
+            not os.path.exists(torchscript_path)
+            or os.path.getmtime(torchscript_path) < os.path.getmtime(weights_path))
+        if stale:
+            export_torchscript(weights_path, torchscript_path, len(self.labels))
+        if not os.path.exists(torchscript_path):
+            raise FileNotFoundError(f"分类模型不存在：{weights_path} / {torchscript_path}")
+        self.model = torch.jit.load(torchscript_path, map_location="cpu").eval()
+        self.batcher = MicroBatcher(self.forward, CLASSIFIER_BATCH_MAX_SIZE, CLASSIFIER_BATCH_MAX_WAIT_MS,
+                                    name="mobilenetv3-food101-int8" if quantized else "mobilenetv3-food101")
+
+    @staticmethod
+    def preprocess(img_bytes: bytes) -> torch.Tensor:
+        image = Image.open(io.BytesIO(img_bytes))
+        image.draft("RGB", (RESIZE_SIZE, RESIZE_SIZE))  # JPEG 按 DCT 缩放解码，短边仍不小于 256
+        image = image.convert("RGB")
+        w, h = image.size
+        scale = RESIZE_SIZE / min(w, h)
+        image = image.resize((max(RESIZE_SIZE, int(w * scale)), max(RESIZE_SIZE, int(h * scale))),
+                             Image.BILINEAR)
+        w, h = image.size
+        left, top = (w - CROP_SIZE) // 2, (h - CROP_SIZE) // 2
+        x = np.asarray(image.crop((left, top, left + CROP_SIZE, top + CROP_SIZE)), dtype=np.float32) / 255.0
+        x = (x - MEAN) / STD
+        return torch.from_numpy(x.transpose(2, 0, 1).copy())[None]
+
+    @torch.no_grad()
+    def forward(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        return torch.softmax(self.model(pixel_values), dim=1)
+
+    def topk(self, probs: torch.Tensor, k: int) -> list:
+        values, indices = probs.topk(min(k, len(self.labels)))
+        return [{"label": self.labels[i][0], "dish_name": self.labels[i][1],
+                 "kcal_per100g": self.labels[i][2], "prob": round(float(p), 4)}
+                for p, i in zip(values.tolist(), indices.tolist())]
+
+    async def classify(self, img_bytes: bytes, k: int = CLASSIFIER_TOPK) -> list:
+        x = await run_in_threadpool(self.preprocess, img_bytes)
+        return self.topk(await self.batcher.submit(x), k)
+
+    def classify_sync(self, img_bytes: bytes, k: int = CLASSIFIER_TOPK) -> list:
+        return self.topk(self.forward(self.preprocess(img_bytes))[0], k)
+
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def get_classifier() -> FoodClassifier:
+    """首次使用时加载并缓存"""
+    global _classifier
+    if _classifier is None:
+        with _classifier_lock:
+            if _classifier is None:
+                _classifier = FoodClassifier()
+    return _classifier
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="本地菜品识别（MobileNetV3 / Food-101）")
+    parser.add_argument("images", nargs="*", help="待识别图片")
+    parser.add_argument("--export", action="store_true", help="导出 TorchScript 后退出")
+    parser.add_argument("--topk", type=int, default=CLASSIFIER_TOPK)
+    args = parser.parse_args()
+
+    if args.export:
+        export_torchscript(num_classes=len(load_labels()))
+    else:
+        classifier = get_classifier()
+
+        async def main():
+            # 并发提交，演示合批
+            results = await asyncio.gather(*[classify_file(path) for path in args.images])
+            for path, result in zip(args.images, results):
+                print(path)
+                for item in result:
+                    print(f"  {item['prob']:.3f}  {item['dish_name']}（{item['label']}） {item['kcal_per100g']} kcal/100g")
+            print(classifier.batcher.stats())
+
+        async def classify_file(path):
+            with open(path, "rb") as f:
+                return await classifier.classify(f.read(), args.topk)
+
+        asyncio.run(main())
@@ -0,0 +1,131 @@
+"""内容寻址图片存储
+
+上传图、去手图、掩膜等统一按内容 sha256 命名，存放在 <root>/<kind>/<h[:2]>/<h[2:4]>/<h>.<ext>：
+- 相同内容只存一份（重复写入只刷新 mtime），并发请求不会互相覆盖；
+- 两级分片目录避免单目录文件过多；
+- 超过存活时间或总大小上限时按 mtime 从旧到新淘汰。
+对外返回的引用形如 "<kind>/<h>.<ext>"，与 /images/{image_type}/{filename} 路由一一对应。
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger("image-store")
+
+IMAGE_KINDS = ("original_images", "hand_removed_images", "food_masks", "volume_overlays")
+_NAME_RE = re.compile(r"^[0-9a-f]{64}\.(jpg|png)$")
+
+
+class ImageStore:
+    def __init__(self, root: str = ".", kinds=IMAGE_KINDS, max_bytes: int = 2 * 1024 ** 3,
+                 max_age_seconds: float = 7 * 24 * 3600, evict_every: int = 200):
+        self.root = root
+        self.kinds = tuple(kinds)
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.evict_every = evict_every
+        self._lock = threading.Lock()
+        self._evicting = threading.Lock()
+        self._puts = 0
+        self._bytes = None  # 首次淘汰扫描后才有准确值
+        self.evicted_files = 0
+
+    def _path(self, kind: str, name: str) -> str:
+        return os.path.join(self.root, kind, name[:2], name[2:4], name)
+
+    # ---------- 写入 ----------
+    def put(self, kind: str, data: bytes, ext: str = ".jpg") -> str:
+        if kind not in self.kinds:
+            raise ValueError(f"未知图片类型：{kind}")
+        name = hashlib.sha256(data).hexdigest() + ext
+        path = self._path(kind, name)
+        if os.path.exists(path):
+            os.utime(path)  # 去重命中：刷新 mtime，推迟淘汰
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+            with self._lock:
+                if self._bytes is not None:
+                    self._bytes += len(data)
+
+        with self._lock:
+            self._puts += 1
+            due = self._puts % self.evict_every == 0 or (
+                self._bytes is not None and self._bytes > self.max_bytes)
+        if due:
+            self.evict_async()
+        return f"{kind}/{name}"
+
+    # ---------- 读取 ----------
+    def resolve(self, kind: str, filename: str):
+        """返回文件路径；兼容改造前直接存放在 <kind>/ 下的旧文件"""
+        if kind not in self.kinds or os.path.basename(filename) != filename:
+            return None
+        if _NAME_RE.match(filename):
+            path = self._path(kind, filename)
+        else:
+            path = os.path.join(self.root, kind, filename)
+        return path if os.path.isfile(path) else None
+
+    # ---------- 淘汰 ----------
+    def evict_async(self):
+        if not self._evicting.locked():
+            threading.Thread(target=self.evict, name="image-store-evict", daemon=True).start()
+
+    def evict(self):
+        if not self._evicting.acquire(blocking=False):
+            return
+        try:
+            now = time.time()
+            files, total = [], 0
+            for kind in self.kinds:
+                for dirpath, _, names in os.walk(os.path.join(self.root, kind)):
+                    for name in names:
+                        path = os.path.join(dirpath, name)
+                        try:
+                            st = os.stat(path)
+                        except FileNotFoundError:
+                            continue
+                        files.append((st.st_mtime, st.st_size, path))
+                        total += st.st_size
+
+            files.sort()
+            low_watermark = self.max_bytes * 0.9
+            removed = 0
+            for mtime, size, path in files:
+                if now - mtime <= self.max_age_seconds and total <= low_watermark:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed += 1
+
+            with self._lock:
+                self._bytes = total
+            self.evicted_files += removed
+            if removed:
+                logger.info(f"图片存储淘汰 {removed} 个文件，当前占用 {total / 1024 ** 2:.1f} MB")
+        finally:
+            self._evicting.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"bytes": self._bytes, "puts": self._puts, "evicted_files": self.evicted_files}
+
+
+def store_from_env() -> ImageStore:
+    store = ImageStore(
+        root=os.getenv("IMAGE_STORE_ROOT", "."),
+        max_bytes=int(float(os.getenv("IMAGE_STORE_MAX_MB", "2048")) * 1024 ** 2),
+        max_age_seconds=float(os.getenv("IMAGE_STORE_MAX_AGE_HOURS", "168")) * 3600,
+    )
+    store.evict_async()  # 启动时扫描一次，得到当前占用并清理过期文件
+    return store
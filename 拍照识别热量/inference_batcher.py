@@ -0,0 +1,141 @@
+"""推理微批调度
+
+把一个时间窗口内（max_wait_ms）到达的单样本请求合并为一次批量前向（最多 max_batch_size 个），
+结果按顺序拆回给各自的调用方。前向函数是阻塞的，放到线程池执行，不占用事件循环。
+"""
+import asyncio
+import time
+from collections import Counter
+
+import torch
+
+
+class MicroBatcher:
+    def __init__(self, run_batch, max_batch_size: int = 8, max_wait_ms: float = 10.0, name: str = "batcher"):
+        """run_batch: (B, ...) 输入张量 -> (B, ...) 输出张量 的阻塞函数"""
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.name = name
+        self._queue = None
+        self._loop = None
+        self._worker = None
+        self._inflight = []  # 工作协程已取出、尚未给出结果的请求
+
+        # ---------- 统计 ----------
+        self.requests = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.batch_size_hist = Counter()
+        self.queue_delay_sum = 0.0
+        self.queue_delay_max = 0.0
+        self.inference_sum = 0.0
+
+    def _ensure_worker(self):
+        """工作协程结束（如被取消）后只重启协程，队列中已排队的请求由新协程继续处理；
+        只有换了事件循环（旧队列不可再用）时才新建队列，旧队列中的请求以异常结束"""
+        if self._worker is not None and not self._worker.done():
+            return
+        loop = asyncio.get_running_loop()
+        if self._queue is None or self._loop is not loop:
+            if self._queue is not None:
+                self._fail_pending(RuntimeError(f"{self.name}: 事件循环已更换，请求被丢弃"))
+            self._queue = asyncio.Queue()
+            self._loop = loop
+        self._worker = loop.create_task(self._run())
+
+    def _fail_pending(self, error: Exception):
+        while not self._queue.empty():
+            _, fut, _ = self._queue.get_nowait()
+            if not fut.done():
+                fut.set_exception(error)
+
+    async def submit(self, x: torch.Tensor) -> torch.Tensor:
+        """x 为单样本 (1, ...) 张量，返回对应的单样本输出（去掉批维度）"""
+        self._ensure_worker()
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((x, fut, time.perf_counter()))
+        return await fut
+
+    async def _collect(self) -> list:
+        first = await self._queue.get()
+        batch = self._inflight = [first]  # 边取边登记，取到一半被取消也能结束它们
+        deadline = first[2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                # 窗口已过，但已经在排队的请求仍一并带上
+                while len(batch) < self.max_batch_size and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        try:
+            await self._serve()
+        except asyncio.CancelledError:
+            # 已取出的请求不会再回到队列，直接结束它们，避免调用方永远等待
+            for _, fut, _ in self._inflight:
+                if not fut.done():
+                    fut.cancel()
+            self._inflight = []
+            raise
+
+    async def _serve(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._inflight = []
+            batch = [item for item in await self._collect() if not item[1].done()]
+            if not batch:
+                continue
+
+            # 输入尺寸不同的请求无法拼接，按形状分组执行
+            groups = {}
+            for item in batch:
+                groups.setdefault(tuple(item[0].shape[1:]), []).append(item)
+
+            for items in groups.values():
+                started = time.perf_counter()
+                for _, _, enqueued in items:
+                    delay = started - enqueued
+                    self.queue_delay_sum += delay
+                    self.queue_delay_max = max(self.queue_delay_max, delay)
+                self.requests += len(items)
+                self.batches += 1
+                self.batch_size_hist[len(items)] += 1
+
+                try:
+                    inputs = torch.cat([x for x, _, _ in items], dim=0)
+                    outputs = await loop.run_in_executor(None, self.run_batch, inputs)
+                except Exception as e:
+                    self.failed_batches += 1
+                    for _, fut, _ in items:
+                        if not fut.done():
+                            fut.set_exception(e)
+                    continue
+                finally:
+                    self.inference_sum += time.perf_counter() - started
+
+                for i, (_, fut, _) in enumerate(items):
+                    if not fut.done():
+                        fut.set_result(outputs[i])
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "requests": self.requests,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "avg_batch_size": round(self.requests / self.batches, 3) if self.batches else 0.0,
+            "batch_size_hist": {str(k): v for k, v in sorted(self.batch_size_hist.items())},
+            "avg_queue_delay_ms": round(self.queue_delay_sum / self.requests * 1000, 3) if self.requests else 0.0,
+            "max_queue_delay_ms": round(self.queue_delay_max * 1000, 3),
+            "avg_batch_inference_ms": round(self.inference_sum / self.batches * 1000, 3) if self.batches else 0.0,
+        }
@@ -0,0 +1,34 @@
+"""二值掩膜的紧凑编码
+
+行优先游程编码（RLE）：counts 依次为 背景、前景、背景…… 的连续像素数，首段为背景（可为 0）。
+食物/手掌掩膜通常是少数几个连通块，编码后只有几千个整数，远小于 base64 PNG。
+"""
+import cv2
+import numpy as np
+
+
+def encode_mask(mask: np.ndarray) -> dict:
+    h, w = mask.shape[:2]
+    flat = (mask > 0).ravel()
+    if flat.size == 0:
+        return {"size": [h, w], "counts": []}
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    counts = np.diff(np.concatenate(([0], changes, [flat.size])))
+    if flat[0]:
+        counts = np.concatenate(([0], counts))
+    return {"size": [h, w], "counts": counts.tolist()}
+
+
+def decode_mask(rle: dict) -> np.ndarray:
+    """返回 0/1 的 uint8 掩膜"""
+    h, w = rle["size"]
+    counts = np.asarray(rle["counts"], dtype=np.int64)
+    values = (np.arange(len(counts)) % 2).astype(np.uint8)
+    return np.repeat(values, counts).reshape(h, w)
+
+
+def mask_to_png(mask: np.ndarray) -> bytes:
+    ok, buf = cv2.imencode(".png", (mask > 0).astype(np.uint8) * 255)
+    if not ok:
+        raise ValueError("掩膜 PNG 编码失败")
+    return buf.tobytes()
@@ -0,0 +1,143 @@
+"""内存映射训练集与张量增强
+
+配合 prepare_dataset.py 生成的缓存目录使用：
+- MemmapFoodDataset：按批读取，__getitem__ 接收一批下标，对 images.npy 做一次排序后的花式索引，
+  返回 (B, S, S, 3) uint8 与标签；DataLoader 的 worker 只做内存拷贝，不再解码；
+- make_loader：用 BatchSampler 包装任意采样器（RandomSampler / DistributedSampler 等）；
+- TrainAugment / ValTransform：在（GPU 上的）整批张量上做随机缩放裁剪、水平翻转、颜色抖动与归一化，
+  与原 torchvision transforms 对应。
+"""
+import json
+import math
+import os
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import BatchSampler, DataLoader, Dataset, RandomSampler, SequentialSampler
+
+MEAN = (0.485, 0.456, 0.406)
+STD = (0.229, 0.224, 0.225)
+
+
+class MemmapFoodDataset(Dataset):
+    def __init__(self, root: str, split: str = "train"):
+        with open(os.path.join(root, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.root = root
+        self.classes = self.meta["classes"]
+        self.indices = np.load(os.path.join(root, "split.npz"))[split]
+        self.labels = np.load(os.path.join(root, "labels.npy")).astype(np.int64)
+        self._images = None  # 每个 worker 进程各自打开，避免把映射句柄跨进程传递
+
+    @property
+    def images(self) -> np.ndarray:
+        if self._images is None:
+            self._images = np.load(os.path.join(self.root, "images.npy"), mmap_mode="r")
+        return self._images
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_images"] = None
+        return state
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, positions):
+        # 排序后按文件顺序读取，批内样本本就是随机集合，顺序无关
+        idx = np.sort(self.indices[np.asarray(positions)])
+        return torch.from_numpy(np.ascontiguousarray(self.images[idx])), torch.from_numpy(self.labels[idx])
+
+
+def make_loader(dataset: MemmapFoodDataset, batch_size: int, shuffle: bool = False, sampler=None,
+                num_workers: int = 2, pin_memory: bool = False, drop_last: bool = False) -> DataLoader:
+    if sampler is None:
+        sampler = RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+    return DataLoader(
+        dataset,
+        sampler=BatchSampler(sampler, batch_size, drop_last),
+        batch_size=None,  # 采样器产出整批下标，由数据集一次读出
+        num_workers=num_workers,
+        pin_memory=pin_memory,
+        persistent_workers=num_workers > 0,
+    )
+
+
+# ---------- 张量增强（输入 (B, H, W, 3) uint8，输出归一化后的 (B, 3, size, size) float） ----------
+def _to_float(images: torch.Tensor) -> torch.Tensor:
+    return images.permute(0, 3, 1, 2).float().div_(255)
+
+
+def _normalize(x: torch.Tensor) -> torch.Tensor:
+    mean = torch.tensor(MEAN, device=x.device).view(1, 3, 1, 1)
+    std = torch.tensor(STD, device=x.device).view(1, 3, 1, 1)
+    return (x - mean) / std
+
+
+def _grayscale(x: torch.Tensor) -> torch.Tensor:
+    return (0.299 * x[:, 0] + 0.587 * x[:, 1] + 0.114 * x[:, 2]).unsqueeze(1)
+
+
+class TrainAugment(torch.nn.Module):
+    """RandomResizedCrop + RandomHorizontalFlip + ColorJitter + Normalize，整批在同一设备上完成"""
+
+    def __init__(self, size: int = 224, scale=(0.08, 1.0), ratio=(3 / 4, 4 / 3), jitter: float = 0.2):
+        super().__init__()
+        self.size = size
+        self.scale = scale
+        self.log_ratio = (math.log(ratio[0]), math.log(ratio[1]))
+        self.jitter = jitter
+
+    def _uniform(self, n: int, low: float, high: float, device) -> torch.Tensor:
+        return torch.empty(n, device=device).uniform_(low, high)
+
+    @torch.no_grad()
+    def forward(self, images: torch.Tensor) -> torch.Tensor:
+        x = _to_float(images)
+        b, device = x.shape[0], x.device
+
+        # 随机缩放裁剪 + 水平翻转：每个样本一个仿射变换，grid_sample 一次完成裁剪与缩放
+        area = self._uniform(b, *self.scale, device)
+        aspect = torch.exp(self._uniform(b, *self.log_ratio, device))
+        w = torch.sqrt(area * aspect).clamp(max=1.0)
+        h = torch.sqrt(area / aspect).clamp(max=1.0)
+        cx = (torch.rand(b, device=device) * 2 - 1) * (1 - w)
+        cy = (torch.rand(b, device=device) * 2 - 1) * (1 - h)
+        flip = torch.where(torch.rand(b, device=device) < 0.5, -1.0, 1.0)
+        theta = torch.zeros(b, 2, 3, device=device)
+        theta[:, 0, 0] = w * flip
+        theta[:, 0, 2] = cx
+        theta[:, 1, 1] = h
+        theta[:, 1, 2] = cy
+        grid = F.affine_grid(theta, (b, 3, self.size, self.size), align_corners=False)
+        x = F.grid_sample(x, grid, mode="bilinear", padding_mode="border", align_corners=False)
+
+        # 颜色抖动：亮度、对比度、饱和度
+        if self.jitter > 0:
+            lo, hi = max(0.0, 1 - self.jitter), 1 + self.jitter
+            brightness = self._uniform(b, lo, hi, device).view(b, 1, 1, 1)
+            contrast = self._uniform(b, lo, hi, device).view(b, 1, 1, 1)
+            saturation = self._uniform(b, lo, hi, device).view(b, 1, 1, 1)
+            x = (x * brightness).clamp_(0, 1)
+            mean = _grayscale(x).mean(dim=(1, 2, 3), keepdim=True)
+            x = ((x - mean) * contrast + mean).clamp_(0, 1)
+            gray = _grayscale(x)
+            x = ((x - gray) * saturation + gray).clamp_(0, 1)
+
+        return _normalize(x)
+
+
+class ValTransform(torch.nn.Module):
+    """CenterCrop + Normalize；缓存图片已是短边 256 的中心正方形，等价于 Resize(256) + CenterCrop(224)"""
+
+    def __init__(self, size: int = 224):
+        super().__init__()
+        self.size = size
+
+    @torch.no_grad()
+    def forward(self, images: torch.Tensor) -> torch.Tensor:
+        x = _to_float(images)
+        top = (x.shape[2] - self.size) // 2
+        left = (x.shape[3] - self.size) // 2
+        return _normalize(x[:, :, top:top + self.size, left:left + self.size])
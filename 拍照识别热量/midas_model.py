@@ -14,14 +14,17 @@ class Resize(nn.Module):
         return F.interpolate(x, size=self.size, mode=self.interpolation, align_corners=False)
 
 class MidasSmall(nn.Module):
-    def __init__(self):
+    def __init__(self, pretrained: bool = False):
         super().__init__()
-        self.backbone = timm.create_model("tf_efficientnet_lite3", features_only=True, pretrained=False)
+        # 取 stride 4/8/16/32 四层特征，通道数以 timm 实际输出为准；蒸馏训练时用 ImageNet 预训练编码器初始化
+        self.backbone = timm.create_model("tf_efficientnet_lite3", features_only=True, pretrained=pretrained,
+                                          out_indices=(1, 2, 3, 4))
+        c1, c2, c3, c4 = self.backbone.feature_info.channels()
         self.scratch = nn.Module()
-        self.scratch.layer1_rn = nn.Conv2d(40, 32, kernel_size=3, padding=1)
-        self.scratch.layer2_rn = nn.Conv2d(48, 32, kernel_size=3, padding=1)
-        self.scratch.layer3_rn = nn.Conv2d(136, 32, kernel_size=3, padding=1)
-        self.scratch.layer4_rn = nn.Conv2d(232, 32, kernel_size=3, padding=1)
+        self.scratch.layer1_rn = nn.Conv2d(c1, 32, kernel_size=3, padding=1)
+        self.scratch.layer2_rn = nn.Conv2d(c2, 32, kernel_size=3, padding=1)
+        self.scratch.layer3_rn = nn.Conv2d(c3, 32, kernel_size=3, padding=1)
+        self.scratch.layer4_rn = nn.Conv2d(c4, 32, kernel_size=3, padding=1)
         self.output = nn.Conv2d(32, 1, kernel_size=1)
 
     def forward(self, x):
@@ -0,0 +1,133 @@
+"""训练集预处理：Food-101 图片一次性解码为内存映射数组
+
+ImageFolder 每个 epoch 都要重新扫描目录并解码约 10 万张 JPEG，训练时 CPU 大部分时间花在解码上。
+本脚本只运行一次：把每张图片短边缩放到 --size 后中心裁剪为正方形，以 uint8 写入 images.npy（内存映射），
+训练时 memmap_dataset.MemmapFoodDataset 直接按批读取，随机增强在张量上完成。
+
+输出目录：
+    images.npy   (N, size, size, 3) uint8，RGB
+    labels.npy   (N,) int16，类别下标与 ImageFolder 一致（目录名按字母序）；解码失败的图片记为 -1
+    split.npz    train / val 下标（按类别分层、固定随机种子，解码失败的图片不进入划分）
+    meta.json    类别名、尺寸、随机种子、验证集比例、源目录与失败列表
+
+    python prepare_dataset.py --data-dir food-101/images --out-dir food-101/memmap_256
+"""
+import argparse
+import json
+import os
+import time
+from multiprocessing import Pool
+
+import numpy as np
+from PIL import Image
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png")
+STORE_SIZE = 256  # 与 val_transform 的 Resize(256) 一致，训练时再随机裁剪 / 中心裁剪到 224
+
+
+def scan_image_folder(data_dir: str):
+    """与 torchvision ImageFolder 相同的类别顺序：子目录名排序，类内文件名排序"""
+    classes = sorted(d.name for d in os.scandir(data_dir) if d.is_dir())
+    samples = []
+    for label, name in enumerate(classes):
+        class_dir = os.path.join(data_dir, name)
+        for fname in sorted(os.listdir(class_dir)):
+            if fname.lower().endswith(IMAGE_EXTS):
+                samples.append((os.path.join(class_dir, fname), label))
+    return classes, samples
+
+
+def load_square(path: str, size: int = STORE_SIZE) -> np.ndarray:
+    """短边缩放到 size 后中心裁剪，返回 (size, size, 3) uint8；解码失败返回 None"""
+    try:
+        with Image.open(path) as im:
+            im.draft("RGB", (size, size))  # JPEG 在 DCT 阶段直接降采样，大图解码更快
+            im = im.convert("RGB")
+            w, h = im.size
+            scale = size / min(w, h)
+            nw, nh = max(size, round(w * scale)), max(size, round(h * scale))
+            im = im.resize((nw, nh), Image.BILINEAR)
+            left, top = (nw - size) // 2, (nh - size) // 2
+            return np.asarray(im.crop((left, top, left + size, top + size)), dtype=np.uint8)
+    except Exception:
+        return None
+
+
+def _load_worker(args):
+    index, path, size = args
+    return index, load_square(path, size)
+
+
+def stratified_split(labels: np.ndarray, val_ratio: float, seed: int):
+    rng = np.random.default_rng(seed)
+    train, val = [], []
+    for label in np.unique(labels[labels >= 0]):
+        idx = np.flatnonzero(labels == label)
+        rng.shuffle(idx)
+        n_val = int(round(len(idx) * val_ratio))
+        val.append(idx[:n_val])
+        train.append(idx[n_val:])
+    return np.sort(np.concatenate(train)), np.sort(np.concatenate(val))
+
+
+def prepare(data_dir: str, out_dir: str, size: int = STORE_SIZE, val_ratio: float = 0.2, seed: int = 42,
+            workers: int = None) -> dict:
+    classes, samples = scan_image_folder(data_dir)
+    if not samples:
+        raise SystemExit(f"未找到图片：{data_dir}")
+    os.makedirs(out_dir, exist_ok=True)
+
+    n = len(samples)
+    images = np.lib.format.open_memmap(os.path.join(out_dir, "images.npy"), mode="w+",
+                                       dtype=np.uint8, shape=(n, size, size, 3))
+    labels = np.array([label for _, label in samples], dtype=np.int16)
+    failed = []
+
+    t0 = time.time()
+    tasks = ((i, path, size) for i, (path, _) in enumerate(samples))
+    with Pool(workers) as pool:
+        for done, (i, arr) in enumerate(pool.imap_unordered(_load_worker, tasks, chunksize=64), 1):
+            if arr is None:
+                labels[i] = -1
+                failed.append(os.path.relpath(samples[i][0], data_dir))
+            else:
+                images[i] = arr
+            if done % 5000 == 0 or done == n:
+                print(f"已处理 {done}/{n}（{done / (time.time() - t0):.0f} 张/秒）", flush=True)
+    images.flush()
+    del images
+
+    train_idx, val_idx = stratified_split(labels, val_ratio, seed)
+    np.save(os.path.join(out_dir, "labels.npy"), labels)
+    np.savez(os.path.join(out_dir, "split.npz"), train=train_idx, val=val_idx)
+
+    meta = {
+        "classes": classes,
+        "size": size,
+        "count": n,
+        "train": int(len(train_idx)),
+        "val": int(len(val_idx)),
+        "val_ratio": val_ratio,
+        "seed": seed,
+        "source": os.path.abspath(data_dir),
+        "failed": failed,
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return meta
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Food-101 预处理为内存映射数组")
+    parser.add_argument("--data-dir", required=True, help="ImageFolder 格式的图片根目录")
+    parser.add_argument("--out-dir", required=True, help="输出目录")
+    parser.add_argument("--size", type=int, default=STORE_SIZE, help="存储边长")
+    parser.add_argument("--val-ratio", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=42, help="训练/验证划分的随机种子")
+    parser.add_argument("--workers", type=int, default=None, help="解码进程数（默认 CPU 核数）")
+    args = parser.parse_args()
+
+    meta = prepare(args.data_dir, args.out_dir, args.size, args.val_ratio, args.seed, args.workers)
+    print(f"完成：{meta['count']} 张，{len(meta['classes'])} 类，训练 {meta['train']} / 验证 {meta['val']}，"
+          f"解码失败 {len(meta['failed'])} 张 → {args.out_dir}")
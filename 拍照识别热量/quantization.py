@@ -0,0 +1,62 @@
+"""CPU 上的 INT8 量化工具
+
+- 动态量化：只量化 nn.Linear 的权重，激活在运行时按批量化，无需校准；DPT（ViT）的计算量主要在 Linear 上；
+- 静态量化（FX 图模式）：卷积与激活都量化为 INT8，需用样本图片校准；用于 MobileNetV3 分类模型。
+量化模型只能在 CPU 上运行。
+"""
+import io
+import os
+import sys
+
+import torch
+
+
+def select_engine() -> str:
+    """按平台选择量化内核：x86 上用 x86/fbgemm，ARM 上用 qnnpack"""
+    supported = torch.backends.quantized.supported_engines
+    for engine in ("x86", "fbgemm", "qnnpack"):
+        if engine in supported:
+            torch.backends.quantized.engine = engine
+            return engine
+    raise RuntimeError(f"当前 PyTorch 不支持 INT8 量化内核：{supported}")
+
+
+def quantize_dynamic_linear(model: torch.nn.Module) -> torch.nn.Module:
+    select_engine()
+    return torch.ao.quantization.quantize_dynamic(model.cpu().eval(), {torch.nn.Linear}, dtype=torch.qint8)
+
+
+@torch.no_grad()
+def quantize_static_fx(model: torch.nn.Module, calib_batches, example_inputs: tuple) -> torch.nn.Module:
+    """calib_batches: 可迭代的输入张量，用于统计激活范围"""
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    engine = select_engine()
+    prepared = prepare_fx(model.cpu().eval(), get_default_qconfig_mapping(engine), example_inputs)
+    for x in calib_batches:
+        prepared(x)
+    return convert_fx(prepared)
+
+
+# ---------- 体积与内存 ----------
+def model_size_mb(model: torch.nn.Module) -> float:
+    """序列化后的权重大小"""
+    buf = io.BytesIO()
+    torch.save(model.state_dict(), buf)
+    return round(buf.tell() / 1024 ** 2, 2)
+
+
+def current_rss_mb():
+    """当前常驻内存（MB）；非 Linux 平台退化为峰值常驻内存，Windows 上返回 None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2, 1)
+    except (OSError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024, 1)
@@ -0,0 +1,133 @@
+"""菜品识别结果缓存
+
+以去手后图片的感知哈希（pHash，64 位）为键缓存 (菜名, 每100g千卡)：
+- 同一盘菜重复或近似重复上传时（汉明距离 <= max_distance）直接返回缓存结果，不再调用远程识别；
+- 条目超过 ttl_seconds 过期，超过 capacity 按最近最少使用淘汰；
+- 只缓存识别成功的结果，失败可能是临时错误，下次仍会重新识别。
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+HASH_SIZE = 8
+DCT_SIZE = 32
+
+
+def phash(img_bytes: bytes):
+    """返回 64 位感知哈希；图片无法解码时返回 None"""
+    # 按 1/8 分辨率解码灰度图，哈希只用到 32x32 的低频信息
+    gray = cv2.imdecode(np.frombuffer(img_bytes, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if gray is None:
+        return None
+    small = cv2.resize(gray, (DCT_SIZE, DCT_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:HASH_SIZE, :HASH_SIZE].ravel()
+    bits = low > np.median(low[1:])  # 中值不计直流分量，对整体亮度变化不敏感
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class RecognitionCache:
+    def __init__(self, capacity: int = 1024, ttl_seconds: float = 24 * 3600, max_distance: int = 6):
+        self.capacity = capacity
+        self.ttl_seconds = ttl_seconds
+        self.max_distance = max_distance
+        self._entries = OrderedDict()  # hash -> (created, result)
+        self._lock = threading.Lock()
+
+        # ---------- 统计 ----------
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def get(self, key: int):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            near = False
+            if entry is None and self.max_distance > 0:
+                # 近似匹配：线性扫描（容量在千级，开销远小于一次远程调用）
+                best = None
+                for k, e in self._entries.items():
+                    d = hamming(k, key)
+                    if d <= self.max_distance and (best is None or d < best[0]):
+                        best = (d, k, e)
+                if best is not None:
+                    _, key, entry = best
+                    near = True
+            if entry is not None and now - entry[0] > self.ttl_seconds:
+                del self._entries[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if near:
+                self.near_hits += 1
+            else:
+                self.hits += 1
+            return entry[1]
+
+    def put(self, key: int, result):
+        with self._lock:
+            self._entries[key] = (time.time(), result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_recognize(self, img_bytes: bytes, recognize):
+        """recognize: img_bytes -> (菜名, 每100g千卡)；哈希失败时直接调用不缓存"""
+        key = phash(img_bytes)
+        if key is None:
+            return recognize(img_bytes)
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        dish_name, kcal_100g = recognize(img_bytes)
+        if dish_name and kcal_100g is not None:
+            self.put(key, (dish_name, kcal_100g))
+        return dish_name, kcal_100g
+
+    async def aget_or_recognize(self, img_bytes: bytes, arecognize):
+        """协程版本：哈希与查表在线程池执行，未命中时 await arecognize(img_bytes)"""
+        key = await asyncio.to_thread(phash, img_bytes)
+        cached = self.get(key) if key is not None else None
+        if cached is not None:
+            return cached
+        dish_name, kcal_100g = await arecognize(img_bytes)
+        if key is not None and dish_name and kcal_100g is not None:
+            self.put(key, (dish_name, kcal_100g))
+        return dish_name, kcal_100g
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.near_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "hit_rate": round((self.hits + self.near_hits) / lookups, 4) if lookups else 0.0,
+            }
+
+
+def cache_from_env() -> RecognitionCache:
+    return RecognitionCache(
+        capacity=int(os.getenv("RECOGNITION_CACHE_SIZE", "1024")),
+        ttl_seconds=float(os.getenv("RECOGNITION_CACHE_TTL_HOURS", "24")) * 3600,
+        max_distance=int(os.getenv("RECOGNITION_CACHE_MAX_DISTANCE", "6")),
+    )
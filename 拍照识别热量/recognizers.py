@@ -0,0 +1,159 @@
+"""菜品识别客户端
+
+recognize(img_bytes) -> (菜名, 每100g千卡)，识别失败返回 (None, None)；arecognize 为协程版本，
+默认把阻塞的 recognize 放到线程池执行。
+- BaiduRecognizer：百度菜品识别（dishDetect）；
+- LocalRecognizer：本地 MobileNetV3 分类模型（food_classifier），无需网络，并发请求合批推理；
+- StubRecognizer：本地固定结果，可配置延迟，用于离线联调与并发测试；
+- FallbackRecognizer：主识别器失败时改用备用识别器。
+通过 RECOGNIZER（baidu / local / stub）选择主识别器，RECOGNIZER_FALLBACK 选择备用识别器（可为空）。
+"""
+import logging
+import os
+import re
+import sys
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from service_metrics import stage
+
+logger = logging.getLogger("recognizers")
+
+RECOGNIZER = os.getenv("RECOGNIZER", "baidu")
+RECOGNIZER_FALLBACK = os.getenv("RECOGNIZER_FALLBACK", "")
+
+
+def safe_float_convert(s: str) -> float or None:
+    if not s:
+        return None
+    match = re.search(r'[-+]?\d*\.\d+|\d+', s)
+    return float(match.group()) if match else None
+
+
+class DishRecognizer:
+    name = "base"
+
+    def recognize(self, img_bytes: bytes):
+        raise NotImplementedError
+
+    async def arecognize(self, img_bytes: bytes):
+        return await run_in_threadpool(self.recognize, img_bytes)
+
+
+class BaiduRecognizer(DishRecognizer):
+    name = "baidu"
+
+    def __init__(self, client, params: dict, dump_path: str = None):
+        """client 为 AipImageClassify 实例；dump_path 非空时保存最近一次送检图片便于排查"""
+        self.client = client
+        self.params = params
+        self.dump_path = dump_path
+
+    def recognize(self, img_bytes: bytes):
+        try:
+            if self.dump_path:
+                with open(self.dump_path, "wb") as f:
+                    f.write(img_bytes)
+            with stage("remote_recognition"):
+                res = self.client.dishDetect(img_bytes, self.params)
+            if not res or not res.get("result"):
+                return None, None
+            for item in res["result"]:
+                dish_name = item.get("name", "")
+                kcal_100g = safe_float_convert(str(item.get("calorie", "")))
+                if kcal_100g and dish_name:
+                    return dish_name, kcal_100g
+            return None, None
+        except Exception as e:
+            logger.error(f"百度菜品识别失败: {e}")
+            return None, None
+
+
+class LocalRecognizer(DishRecognizer):
+    name = "local"
+
+    def __init__(self, min_prob: float = None):
+        """模型在首次识别时加载；top-1 概率低于 min_prob 视为识别失败"""
+        from food_classifier import CLASSIFIER_MIN_PROB
+
+        self.min_prob = CLASSIFIER_MIN_PROB if min_prob is None else min_prob
+
+    def _top1(self, result: list):
+        if not result or result[0]["prob"] < self.min_prob:
+            return None, None
+        return result[0]["dish_name"], result[0]["kcal_per100g"]
+
+    def recognize(self, img_bytes: bytes):
+        from food_classifier import get_classifier
+
+        try:
+            classifier = get_classifier()
+            with stage("local_recognition"):
+                return self._top1(classifier.classify_sync(img_bytes, 1))
+        except Exception as e:
+            logger.error(f"本地菜品识别失败: {e}")
+            return None, None
+
+    async def arecognize(self, img_bytes: bytes):
+        from food_classifier import get_classifier
+
+        try:
+            classifier = await run_in_threadpool(get_classifier)
+            with stage("local_recognition"):
+                return self._top1(await classifier.classify(img_bytes, 1))
+        except Exception as e:
+            logger.error(f"本地菜品识别失败: {e}")
+            return None, None
+
+
+class StubRecognizer(DishRecognizer):
+    name = "stub"
+
+    def __init__(self, dish_name: str = None, kcal_100g: float = None, delay_ms: float = None):
+        """未指定的参数取环境变量 STUB_DISH_NAME / STUB_KCAL_PER100G / STUB_DELAY_MS；菜名为空时模拟识别失败"""
+        self.dish_name = dish_name if dish_name is not None else os.getenv("STUB_DISH_NAME", "宫保鸡丁")
+        self.kcal_100g = kcal_100g if kcal_100g is not None else float(os.getenv("STUB_KCAL_PER100G", "200"))
+        self.delay_ms = delay_ms if delay_ms is not None else float(os.getenv("STUB_DELAY_MS", "300"))
+
+    def recognize(self, img_bytes: bytes):
+        time.sleep(self.delay_ms / 1000.0)
+        if not self.dish_name:
+            return None, None
+        return self.dish_name, self.kcal_100g
+
+
+class FallbackRecognizer(DishRecognizer):
+    def __init__(self, primary: DishRecognizer, fallback: DishRecognizer):
+        self.primary = primary
+        self.fallback = fallback
+        self.name = f"{primary.name}+{fallback.name}"
+
+    def recognize(self, img_bytes: bytes):
+        dish_name, kcal_100g = self.primary.recognize(img_bytes)
+        if dish_name and kcal_100g is not None:
+            return dish_name, kcal_100g
+        return self.fallback.recognize(img_bytes)
+
+    async def arecognize(self, img_bytes: bytes):
+        dish_name, kcal_100g = await self.primary.arecognize(img_bytes)
+        if dish_name and kcal_100g is not None:
+            return dish_name, kcal_100g
+        return await self.fallback.arecognize(img_bytes)
+
+
+def recognizer_from_env(baidu_client=None, baidu_params: dict = None, dump_path: str = None) -> DishRecognizer:
+    def build(name: str) -> DishRecognizer:
+        if name == "stub":
+            return StubRecognizer()
+        if name == "local":
+            return LocalRecognizer()
+        if name == "baidu":
+            return BaiduRecognizer(baidu_client, baidu_params, dump_path=dump_path)
+        raise ValueError(f"未知识别器 '{name}'，可选：baidu / local / stub")
+
+    recognizer = build(RECOGNIZER)
+    if RECOGNIZER_FALLBACK and RECOGNIZER_FALLBACK != RECOGNIZER:
+        recognizer = FallbackRecognizer(recognizer, build(RECOGNIZER_FALLBACK))
+    return recognizer
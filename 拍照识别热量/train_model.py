@@ -1,44 +1,63 @@
+"""MobileNetV3 / Food-101 训练
+
+数据来自 prepare_dataset.py 生成的预解码缓存（--data-dir）。支持 torch DDP（gloo 后端）的 CPU 数据并行：
+    # 单进程
+    python train_model.py --data-dir food-101/memmap_256
+    # 单机 8 进程（每个进程分到 CPU 核数 / 8 个计算线程）
+    python train_model.py --data-dir food-101/memmap_256 --world-size 8
+    # 两台机器各 8 进程：每台机器分别执行，--node-rank 为 0 / 1，--master-addr 指向 node 0
+    python train_model.py --data-dir ... --world-size 16 --nproc-per-node 8 --node-rank 0 --master-addr 10.0.0.1
+也可以用 torchrun 启动（检测到 RANK / WORLD_SIZE 环境变量时不再自行创建进程）。
+--batch-size 为每个进程的批大小，全局批大小 = batch_size × world_size。
+只有 rank 0 写检查点：checkpoints/last.pth 含模型、优化器、学习率调度器与 epoch，--resume 从中恢复；
+best 检查点仍只保存模型权重，供 food_classifier.py 加载。
+"""
+import argparse
+import os
+
 import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
 import torch.nn as nn
 import torch.optim as optim
-from torchvision import datasets, transforms, models
-from torch.utils.data import DataLoader, random_split
-import os
+from torch.nn.parallel import DistributedDataParallel as DDP
+from torch.utils.data import DistributedSampler
+from torchvision import models
+
+from memmap_dataset import MemmapFoodDataset, TrainAugment, ValTransform, make_loader
 
 # 只定义变量和函数，不执行实际训练逻辑
-DATA_DIR = r'C:\Users\86151\Downloads\food-101\food-101\images'
 BATCH_SIZE = 32
 NUM_EPOCHS = 20
 NUM_CLASSES = 101
-LR = 1e-43
+LR = 1e-3
+CHECKPOINT_DIR = 'checkpoints'
+
+# 数据增强和预处理（在整批 uint8 张量上执行，搬到设备后再做）
+train_transform = TrainAugment(224, jitter=0.2)
+val_transform = ValTransform(224)
 
-DEVICE = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
-# 数据增强和预处理
-train_transform = transforms.Compose([
-    transforms.RandomResizedCrop(224),
-    transforms.RandomHorizontalFlip(),
-    transforms.ColorJitter(0.2, 0.2, 0.2),
-    transforms.ToTensor(),
-    transforms.Normalize([0.485, 0.456, 0.406],
-                         [0.229, 0.224, 0.225])
-])
+def is_main_process() -> bool:
+    return not dist.is_initialized() or dist.get_rank() == 0
 
-val_transform = transforms.Compose([
-    transforms.Resize(256),
-    transforms.CenterCrop(224),
-    transforms.ToTensor(),
-    transforms.Normalize([0.485, 0.456, 0.406],
-                         [0.229, 0.224, 0.225])
-])
+
+def reduce_sums(values: list, device) -> list:
+    """跨进程求和（未初始化进程组时原样返回）"""
+    if not dist.is_initialized():
+        return values
+    t = torch.tensor(values, dtype=torch.float64, device=device)
+    dist.all_reduce(t, op=dist.ReduceOp.SUM)
+    return t.tolist()
 
 
 # 训练和验证函数
-def train_epoch(model, train_loader, criterion, optimizer, device):
+def train_epoch(model, train_loader, criterion, optimizer, device, transform=train_transform):
     model.train()
     running_loss, correct, total = 0.0, 0, 0
     for images, labels in train_loader:
-        images, labels = images.to(device), labels.to(device)
+        images = transform(images.to(device, non_blocking=True))
+        labels = labels.to(device, non_blocking=True)
 
         outputs = model(images)
         loss = criterion(outputs, labels)
@@ -52,15 +71,17 @@ def train_epoch(model, train_loader, criterion, optimizer, device):
         correct += (preds == labels).sum().item()
         total += labels.size(0)
 
+    running_loss, correct, total = reduce_sums([running_loss, correct, total], device)
     return running_loss / total, 100. * correct / total
 
 
-def validate(model, val_loader, criterion, device):
+def validate(model, val_loader, criterion, device, transform=val_transform):
     model.eval()
     running_loss, correct, total = 0.0, 0, 0
     with torch.no_grad():
         for images, labels in val_loader:
-            images, labels = images.to(device), labels.to(device)
+            images = transform(images.to(device, non_blocking=True))
+            labels = labels.to(device, non_blocking=True)
             outputs = model(images)
             loss = criterion(outputs, labels)
 
@@ -69,83 +90,173 @@ def validate(model, val_loader, criterion, device):
             correct += (preds == labels).sum().item()
             total += labels.size(0)
 
+    running_loss, correct, total = reduce_sums([running_loss, correct, total], device)
     return running_loss / total, 100. * correct / total
 
 
-# 主程序入口（关键修改）
-if __name__ == '__main__':
-    # 在 Windows 上使用多进程时需要的冻结支持
-    import multiprocessing
+# ---------- 检查点 ----------
+def save_checkpoint(path, model, optimizer, scheduler, epoch, best_val_acc):
+    """只在 rank 0 调用；先写临时文件再替换，避免中断时留下半个检查点"""
+    state = {
+        'model': model.state_dict(),
+        'optimizer': optimizer.state_dict(),
+        'scheduler': scheduler.state_dict(),
+        'epoch': epoch,
+        'best_val_acc': best_val_acc,
+    }
+    tmp = path + '.tmp'
+    torch.save(state, tmp)
+    os.replace(tmp, path)
 
-    multiprocessing.freeze_support()
 
-    # 加载完整数据集
-    full_dataset = datasets.ImageFolder(DATA_DIR, transform=train_transform)
-
-    # 分割训练集和验证集
-    train_size = int(0.8 * len(full_dataset))
-    val_size = len(full_dataset) - train_size
-    train_dataset, val_dataset = random_split(full_dataset, [train_size, val_size])
-
-    # 为验证集设置单独的 transform
-    val_dataset.dataset.transform = val_transform
-
-    # 创建数据加载器（Windows 上 num_workers 不宜过大）
-    train_loader = DataLoader(
-        train_dataset,
-        batch_size=BATCH_SIZE,
-        shuffle=True,
-        num_workers=2,  # 减少 workers 数量，避免 Windows 资源问题
-        pin_memory=DEVICE.type == 'cuda'  # 只有 GPU 时才启用 pin_memory
-    )
-    val_loader = DataLoader(
-        val_dataset,
-        batch_size=BATCH_SIZE,
-        shuffle=False,
-        num_workers=2,
-        pin_memory=DEVICE.type == 'cuda'
-    )
-
-    # 打印数据集信息
-    print(f"数据集总样本数: {len(full_dataset)}")
-    print(f"训练集样本数: {len(train_dataset)}")
-    print(f"验证集样本数: {len(val_dataset)}")
-    print(f"类别数: {len(full_dataset.classes)}")
-    print(f"使用设备: {DEVICE}")
-
-    # MobileNetV3 模型
-    model = models.mobilenet_v3_large(weights=models.MobileNet_V3_Large_Weights.IMAGENET1K_V1)  # 修正 weights 参数
-    model.classifier[3] = nn.Linear(model.classifier[3].in_features, NUM_CLASSES)
-    model = model.to(DEVICE)
+def load_checkpoint(path, model, optimizer, scheduler):
+    """返回 (下一个 epoch, best_val_acc)"""
+    state = torch.load(path, map_location='cpu')
+    model.load_state_dict(state['model'])
+    optimizer.load_state_dict(state['optimizer'])
+    scheduler.load_state_dict(state['scheduler'])
+    return state['epoch'] + 1, state.get('best_val_acc', 0.0)
+
+
+# ---------- 单个训练进程 ----------
+def run(local_rank: int, args):
+    distributed = args.world_size > 1
+    if distributed:
+        rank = args.node_rank * args.nproc_per_node + local_rank
+        # torchrun 已按环境变量建好 rendezvous，自行启动时用 tcp:// 连接 master
+        init_method = 'env://' if args.local_rank is not None else f'tcp://{args.master_addr}:{args.master_port}'
+        dist.init_process_group('gloo', init_method=init_method, rank=rank, world_size=args.world_size)
+        # 每个进程平分本机 CPU 核，避免线程数超订
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // args.nproc_per_node))
+        device = torch.device('cpu')
+    else:
+        rank = 0
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+    train_dataset = MemmapFoodDataset(args.data_dir, 'train')
+    val_dataset = MemmapFoodDataset(args.data_dir, 'val')
+
+    # 训练集按 epoch 重新打乱并切分到各进程；验证集按 rank 跨步切分（不补齐重复样本，指标精确）
+    train_sampler = DistributedSampler(train_dataset, shuffle=True, seed=args.seed) if distributed else None
+    val_sampler = range(rank, len(val_dataset), args.world_size) if distributed else None
+    pin_memory = device.type == 'cuda'
+    train_loader = make_loader(train_dataset, args.batch_size, shuffle=True, sampler=train_sampler,
+                               num_workers=args.workers, pin_memory=pin_memory, drop_last=distributed)
+    val_loader = make_loader(val_dataset, args.batch_size, sampler=val_sampler,
+                             num_workers=args.workers, pin_memory=pin_memory)
+
+    if is_main_process():
+        print(f"数据集总样本数: {train_dataset.meta['count']}")
+        print(f"训练集样本数: {len(train_dataset)}")
+        print(f"验证集样本数: {len(val_dataset)}")
+        print(f"类别数: {len(train_dataset.classes)}")
+        print(f"使用设备: {device} | 进程数: {args.world_size} | 全局批大小: {args.batch_size * args.world_size}")
+
+    # MobileNetV3 模型（各进程以相同权重开始，DDP 构造时再从 rank 0 广播一次）
+    model = models.mobilenet_v3_large(weights=models.MobileNet_V3_Large_Weights.IMAGENET1K_V1)
+    model.classifier[3] = nn.Linear(model.classifier[3].in_features, len(train_dataset.classes))
+    model = model.to(device)
 
     # 定义损失函数和优化器
     criterion = nn.CrossEntropyLoss(label_smoothing=0.1)
-    optimizer = optim.AdamW(model.parameters(), lr=LR, weight_decay=1e-4)
-    scheduler = optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=NUM_EPOCHS)
+    optimizer = optim.AdamW(model.parameters(), lr=args.lr, weight_decay=1e-4)
+    scheduler = optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=args.epochs)
 
-    # 创建保存模型的目录
-    os.makedirs('checkpoints', exist_ok=True)
+    # 恢复训练：所有进程都加载同一份检查点，保证优化器状态一致
+    os.makedirs(args.checkpoint_dir, exist_ok=True)
+    last_path = os.path.join(args.checkpoint_dir, 'last.pth')
+    best_path = os.path.join(args.checkpoint_dir, 'mobilenetv3_food101_best.pth')
+    start_epoch, best_val_acc = 0, 0.0
+    resume = last_path if args.resume == 'auto' else args.resume
+    if resume and os.path.exists(resume):
+        start_epoch, best_val_acc = load_checkpoint(resume, model, optimizer, scheduler)
+        if is_main_process():
+            print(f"从 {resume} 恢复，继续第 {start_epoch + 1} 个 epoch")
+
+    net = DDP(model) if distributed else model
 
     # 训练循环
-    best_val_acc = 0.0
-    for epoch in range(NUM_EPOCHS):
-        train_loss, train_acc = train_epoch(model, train_loader, criterion, optimizer, DEVICE)
-        val_loss, val_acc = validate(model, val_loader, criterion, DEVICE)
+    for epoch in range(start_epoch, args.epochs):
+        if train_sampler is not None:
+            train_sampler.set_epoch(epoch)
+        train_loss, train_acc = train_epoch(net, train_loader, criterion, optimizer, device)
+        # 验证不需要梯度同步，直接用未包装的模型（各进程分到的验证批数可能不同）
+        val_loss, val_acc = validate(model, val_loader, criterion, device)
 
         scheduler.step()
 
-        # 保存最佳模型
-        if val_acc > best_val_acc:
-            best_val_acc = val_acc
-            torch.save(model.state_dict(), 'checkpoints/mobilenetv3_food101_best.pth')
-            print(f"💾 最佳模型已保存，验证准确率: {val_acc:.2f}%")
+        if is_main_process():
+            # 保存最佳模型
+            if val_acc > best_val_acc:
+                best_val_acc = val_acc
+                torch.save(model.state_dict(), best_path)
+                print(f"💾 最佳模型已保存，验证准确率: {val_acc:.2f}%")
+            save_checkpoint(last_path, model, optimizer, scheduler, epoch, best_val_acc)
 
-        print(f"📦 Epoch {epoch + 1}/{NUM_EPOCHS} | "
-              f"训练损失: {train_loss:.4f} | 训练准确率: {train_acc:.2f}% | "
-              f"验证损失: {val_loss:.4f} | 验证准确率: {val_acc:.2f}% | "
-              f"学习率: {optimizer.param_groups[0]['lr']:.6f}")
+            print(f"📦 Epoch {epoch + 1}/{args.epochs} | "
+                  f"训练损失: {train_loss:.4f} | 训练准确率: {train_acc:.2f}% | "
+                  f"验证损失: {val_loss:.4f} | 验证准确率: {val_acc:.2f}% | "
+                  f"学习率: {optimizer.param_groups[0]['lr']:.6f}")
+        if distributed:
+            dist.barrier()  # 等 rank 0 写完检查点，中断后各进程从同一 epoch 恢复
 
     # 保存最终模型
-    torch.save(model.state_dict(), 'checkpoints/mobilenetv3_food101_final.pth')
-    print("✅ 最终模型已保存：checkpoints/mobilenetv3_food101_final.pth")
-    print(f"🥇 最佳验证准确率: {best_val_acc:.2f}%")
\ No newline at end of file
+    if is_main_process():
+        final_path = os.path.join(args.checkpoint_dir, 'mobilenetv3_food101_final.pth')
+        torch.save(model.state_dict(), final_path)
+        print(f"✅ 最终模型已保存：{final_path}")
+        print(f"🥇 最佳验证准确率: {best_val_acc:.2f}%")
+    if distributed:
+        dist.destroy_process_group()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="MobileNetV3 / Food-101 训练（支持 DDP gloo 多进程）")
+    parser.add_argument('--data-dir', required=True, help='prepare_dataset.py 生成的缓存目录')
+    parser.add_argument('--world-size', type=int, default=1, help='总进程数（所有机器之和）')
+    parser.add_argument('--nproc-per-node', type=int, default=None, help='本机进程数（默认等于 world-size，即单机）')
+    parser.add_argument('--node-rank', type=int, default=0, help='本机序号（多机时）')
+    parser.add_argument('--master-addr', default='127.0.0.1')
+    parser.add_argument('--master-port', type=int, default=29500)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='每个进程的批大小')
+    parser.add_argument('--epochs', type=int, default=NUM_EPOCHS)
+    parser.add_argument('--lr', type=float, default=LR)
+    parser.add_argument('--workers', type=int, default=2, help='每个进程的 DataLoader worker 数')
+    parser.add_argument('--seed', type=int, default=0, help='训练集打乱的随机种子')
+    parser.add_argument('--checkpoint-dir', default=CHECKPOINT_DIR)
+    parser.add_argument('--resume', default='auto', help="检查点路径；auto 为 checkpoint-dir/last.pth（存在时），空字符串不恢复")
+    args = parser.parse_args(argv)
+
+    # torchrun 启动时以环境变量为准
+    if 'RANK' in os.environ and 'WORLD_SIZE' in os.environ:
+        args.world_size = int(os.environ['WORLD_SIZE'])
+        args.nproc_per_node = int(os.environ.get('LOCAL_WORLD_SIZE', args.world_size))
+        args.node_rank = int(os.environ['RANK']) // args.nproc_per_node
+        args.master_addr = os.environ.get('MASTER_ADDR', args.master_addr)
+        args.master_port = int(os.environ.get('MASTER_PORT', args.master_port))
+        args.local_rank = int(os.environ.get('LOCAL_RANK', 0))
+    else:
+        args.local_rank = None
+    if args.nproc_per_node is None:
+        args.nproc_per_node = args.world_size
+    if args.resume not in ('auto', '') and not os.path.exists(args.resume):
+        parser.error(f"检查点不存在：{args.resume}")
+    if not os.path.exists(os.path.join(args.data_dir, 'meta.json')):
+        parser.error(f"未找到数据缓存 {args.data_dir}，请先运行 prepare_dataset.py")
+    return args
+
+
+# 主程序入口
+if __name__ == '__main__':
+    # 在 Windows 上使用多进程时需要的冻结支持
+    import multiprocessing
+
+    multiprocessing.freeze_support()
+
+    args = parse_args()
+    if args.local_rank is not None:
+        run(args.local_rank, args)
+    elif args.world_size > 1:
+        mp.spawn(run, args=(args,), nprocs=args.nproc_per_node)
+    else:
+        run(0, args)
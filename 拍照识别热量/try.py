@@ -2,22 +2,29 @@ from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, FileResponse
 import uvicorn
-import requests
 import logging
 import io
 import cv2
 import numpy as np
 import re
 import os
-import base64
+import sys
 from datetime import datetime
 from PIL import Image
 import mediapipe as mp
 from aip import AipImageClassify
+from image_store import IMAGE_KINDS, store_from_env
+from mask_codec import mask_to_png
+from recognition_cache import cache_from_env
+import volume_client
+from volume_client import VOLUME_IN_PROCESS, VolumeInputError, VolumeServiceError, estimate_volume
 from sqlalchemy import create_engine, Column, Integer, String, Float
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from service_metrics import instrument_fastapi, register_pool, sqlalchemy_pool_stats, stage
+
 # ------------------ 配置 ------------------
 logging.basicConfig(
     level=logging.INFO,
@@ -26,11 +33,10 @@ logging.basicConfig(
 logger = logging.getLogger("calorie_api")
 
 # 创建图片保存目录
-os.makedirs("hand_removed_images", exist_ok=True)
-os.makedirs("original_images", exist_ok=True)
 os.makedirs("baidu_api_input", exist_ok=True)
-os.makedirs("food_masks", exist_ok=True)
-os.makedirs("volume_overlays", exist_ok=True)
+
+# 上传图、去手图、掩膜统一进入内容寻址存储（去重、分片目录、按大小/时间淘汰）
+image_store = store_from_env()
 
 # ------------------ 数据库配置（适配现有数据库） ------------------
 # 请替换为您的实际数据库连接地址
@@ -43,6 +49,7 @@ engine = create_engine(
     connect_args={"check_same_thread": False} if "sqlite" in SQLALCHEMY_DATABASE_URL else {}
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+register_pool("try", lambda: sqlalchemy_pool_stats(engine))
 Base = declarative_base()
 
 
@@ -67,6 +74,7 @@ def get_db():
 
 # ------------------ FastAPI 初始化 ------------------
 app = FastAPI(title="Calorie API with Existing Database")
+instrument_fastapi(app, "try")
 
 app.add_middleware(
     CORSMiddleware,
@@ -83,8 +91,8 @@ SECRET_KEY = "5SckesBtVaCJfSdNOmxvYe9fkiYFUQcd"
 BAIDU = AipImageClassify(APP_ID, API_KEY, SECRET_KEY)
 BAIDU_PARAMS = {"top_num": 5, "filter_threshold": 0.5}
 
-# ------------------ 体积服务地址（修正报错URL） ------------------
-VOLUME_URL = "http://127.0.0.1:8000/predict"  # 若体积服务端口不同，请修改
+# 以去手图的感知哈希缓存识别结果，重复/近似重复的照片不再调用百度API
+recognition_cache = cache_from_env()
 
 # ------------------ Mediapipe 手部检测 ------------------
 mp_hands = mp.solutions.hands
@@ -110,23 +118,23 @@ async def http_exception_handler(request, exc):
 
 
 # ------------------ 图片处理函数 ------------------
-def process_images(image_bytes: bytes) -> tuple[bytes, bytes, str]:
+def process_images(image_bytes: bytes) -> tuple[bytes, bytes, str, np.ndarray]:
     """处理图片：去除手部并保存"""
     try:
         # 保存原始图片
-        original_ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-        original_save_path = f"original_images/{original_ts}.jpg"
-        with open(original_save_path, "wb") as f:
-            f.write(image_bytes)
+        image_store.put("original_images", image_bytes)
 
         # 转换图片格式
         image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
         img_np = np.array(image)
         img_bgr = cv2.cvtColor(img_np, cv2.COLOR_RGB2BGR)
         h, w = img_bgr.shape[:2]
+        # 进程内估算体积时直接使用解码后的原图（去手前）
+        volume_bgr = img_bgr.copy() if VOLUME_IN_PROCESS else None
 
         # 手部检测与涂黑
-        results = hands.process(cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB))
+        with stage("hand_detection"):
+            results = hands.process(cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB))
         if results.multi_hand_landmarks:
             for hand_landmarks in results.multi_hand_landmarks:
                 key_pts = [
@@ -144,9 +152,6 @@ def process_images(image_bytes: bytes) -> tuple[bytes, bytes, str]:
 
         # 保存处理后的图片
         processed_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
-        baidu_save_path = f"hand_removed_images/baidu_{original_ts}.jpg"
-        cv2.imwrite(baidu_save_path, cv2.cvtColor(processed_rgb, cv2.COLOR_RGB2BGR))
-        logger.info(f"百度API输入图已保存：{baidu_save_path}")
 
         # 转换为字节流
         buffer = io.BytesIO()
@@ -160,11 +165,14 @@ def process_images(image_bytes: bytes) -> tuple[bytes, bytes, str]:
             logger.error("处理后的图片损坏，使用原始图替代")
             baidu_img_bytes = image_bytes
 
-        return baidu_img_bytes, image_bytes, baidu_save_path
+        baidu_save_path = image_store.put("hand_removed_images", baidu_img_bytes)
+        logger.info(f"百度API输入图已保存：{baidu_save_path}")
+
+        return baidu_img_bytes, image_bytes, baidu_save_path, volume_bgr
 
     except Exception as e:
         logger.error(f"图片处理失败: {e}，使用原始图")
-        return image_bytes, image_bytes, f"error_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
+        return image_bytes, image_bytes, f"error_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg", None
 
 
 # ------------------ 工具函数 ------------------
@@ -201,7 +209,8 @@ def baidu_dishname_calorie(img_bytes: bytes):
     try:
         with open("baidu_api_input/latest_api_input.jpg", "wb") as f:
             f.write(img_bytes)
-        res = BAIDU.dishDetect(img_bytes, BAIDU_PARAMS)
+        with stage("remote_recognition"):
+            res = BAIDU.dishDetect(img_bytes, BAIDU_PARAMS)
         logger.info(f"百度API响应：{res}")
 
         if not res or not res.get("result"):
@@ -221,42 +230,30 @@ def baidu_dishname_calorie(img_bytes: bytes):
 
 
 # ------------------ 体积服务调用 ------------------
-def call_volume_service(img_bytes: bytes, hand_length_cm: float) -> tuple:
-    """调用体积服务获取体积数据"""
+async def call_volume_service(img_bytes: bytes, hand_length_cm: float, img_bgr: np.ndarray = None) -> tuple:
+    """获取体积数据：同进程部署时直接调用体积引擎，否则请求体积服务"""
     try:
-        files = {"file": ("dish_original.jpg", img_bytes, "image/jpeg")}
-        data = {"hand_length_cm": str(hand_length_cm)}
-        resp = requests.post(VOLUME_URL, files=files, data=data, timeout=60)
-        resp.raise_for_status()
-        js = resp.json()
+        js = await estimate_volume(hand_length_cm, img_bgr=img_bgr, img_bytes=img_bytes, return_mask=True)
 
         volume_cm3 = float(js["volume_cm3"])
         food_mask_path = None
-        volume_overlay_path = None
 
-        # 处理食物mask
-        if "food_mask_base64" in js:
+        # 保存食物mask（HTTP 模式下由 RLE 解码而来）
+        if js["food_mask"] is not None:
             try:
-                mask_data = base64.b64decode(js["food_mask_base64"])
-                food_mask_path = f"food_masks/{datetime.now().strftime('%Y%m%d_%H%M%S')}_mask.png"
-                with open(food_mask_path, "wb") as f:
-                    f.write(mask_data)
+                food_mask_path = image_store.put("food_masks", mask_to_png(js["food_mask"]), ".png")
             except Exception as e:
+                food_mask_path = None
                 logger.error(f"保存mask失败: {e}")
 
-        # 处理体积覆盖图
-        if "overlay_base64" in js:
-            try:
-                overlay_data = base64.b64decode(js["overlay_base64"])
-                volume_overlay_path = f"volume_overlays/{datetime.now().strftime('%Y%m%d_%H%M%S')}_overlay.jpg"
-                with open(volume_overlay_path, "wb") as f:
-                    f.write(overlay_data)
-            except Exception as e:
-                logger.error(f"保存覆盖图失败: {e}")
+        # 体积覆盖图由体积服务按需渲染（进程内估算时没有）
+        volume_overlay_url = js.get("overlay_url")
 
-        return volume_cm3, food_mask_path, volume_overlay_path
+        return volume_cm3, food_mask_path, volume_overlay_url
 
-    except requests.exceptions.RequestException as e:
+    except VolumeInputError as e:
+        raise HTTPException(status_code=400, detail=f"体积计算失败: {str(e)}")
+    except VolumeServiceError as e:
         logger.error(f"体积服务调用失败: {e}")
         raise HTTPException(status_code=500, detail=f"体积服务错误: {str(e)}")
     except Exception as e:
@@ -279,30 +276,32 @@ async def calorie_predict(
             raise HTTPException(status_code=400, detail="文件为空")
 
         # 1. 图片处理
-        baidu_img, volume_img, black_hand_path = process_images(img_bytes)
+        baidu_img, volume_img, black_hand_path, volume_bgr = process_images(img_bytes)
 
         # 2. 识别逻辑：优先使用手动输入，否则调用百度API
         if manual_food_name:
             dish_name = manual_food_name
             # 从数据库查询热量
-            db_data = db.query(FoodNutrition).filter(FoodNutrition.food_name == dish_name).first()
+            with stage("db_lookup"):
+                db_data = db.query(FoodNutrition).filter(FoodNutrition.food_name == dish_name).first()
             if not db_data:
                 raise HTTPException(status_code=404, detail=f"数据库中未找到「{dish_name}」的营养数据")
             kcal_100g = db_data.kcal_per100g
             recognition_status = "使用手动输入的食品名称"
         else:
             # 自动识别
-            dish_name, kcal_100g = baidu_dishname_calorie(baidu_img)
+            dish_name, kcal_100g = recognition_cache.get_or_recognize(baidu_img, baidu_dishname_calorie)
             if not dish_name or kcal_100g is None:
                 raise HTTPException(status_code=400,
                                     detail=f"菜品识别失败，请检查图片或手动指定食品名称：{black_hand_path}")
             recognition_status = "自动识别成功"
 
         # 3. 体积计算
-        volume_cm3, food_mask_path, volume_overlay_path = call_volume_service(volume_img, hand_length_cm)
+        volume_cm3, food_mask_path, volume_overlay_url = await call_volume_service(volume_img, hand_length_cm, volume_bgr)
 
         # 4. 密度获取：优先用数据库，否则估算
-        db_data = db.query(FoodNutrition).filter(FoodNutrition.food_name == dish_name).first()
+        with stage("db_lookup"):
+            db_data = db.query(FoodNutrition).filter(FoodNutrition.food_name == dish_name).first()
         density = db_data.density if db_data else estimate_density(dish_name)
 
         # 5. 计算结果
@@ -327,7 +326,7 @@ async def calorie_predict(
                         "hand_removed_image_path": black_hand_path,
                         "recognition_status": recognition_status,
                         "food_mask_path": food_mask_path,
-                        "volume_overlay_path": volume_overlay_path
+                        "volume_overlay_url": volume_overlay_url
                     }
                 ]
             }
@@ -354,17 +353,28 @@ async def calorie_predict(
 @app.get("/images/{image_type}/{filename}")
 async def get_image(image_type: str, filename: str):
     """访问保存的图片（如去除手部后的图片、mask等）"""
-    valid_types = ["original_images", "hand_removed_images", "food_masks", "volume_overlays"]
-    if image_type not in valid_types:
+    if image_type not in IMAGE_KINDS:
         raise HTTPException(status_code=400, detail="无效的图片类型")
 
-    image_path = f"{image_type}/{filename}"
-    if not os.path.exists(image_path):
+    image_path = image_store.resolve(image_type, filename)
+    if image_path is None:
         raise HTTPException(status_code=404, detail="图片不存在")
 
     return FileResponse(image_path)
 
 
+# ------------------ 识别缓存统计 ------------------
+@app.get("/stats/recognition_cache")
+async def recognition_cache_stats():
+    return JSONResponse(recognition_cache.stats())
+
+
+# ------------------ 关闭事件：释放体积服务连接池 ------------------
+@app.on_event("shutdown")
+async def shutdown_event():
+    await volume_client.aclose()
+
+
 # ------------------ 启动服务 ------------------
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8001, log_level="info")
\ No newline at end of file
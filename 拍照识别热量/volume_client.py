@@ -0,0 +1,131 @@
+"""体积估算调用
+
+卡路里接口统一通过 estimate_volume 获取体积：
+- VOLUME_IN_PROCESS=1 且 volume_engine 可导入时，直接在本进程内对已解码的 ndarray 估算，
+  不再经过 JPEG 重编码、multipart 上传与回环 HTTP；
+- 否则（或引擎加载失败时）回退到 VOLUME_BASE_URL 上的体积服务：
+  共享一个 httpx.AsyncClient（keep-alive 连接池），每次调用有总时限，并发数受信号量限制，
+  慢请求只占用自己的协程，不会阻塞事件循环。
+两种方式返回相同结构：体积服务的结果字典，食物掩膜以 "food_mask"（0/1 ndarray 或 None）给出。
+"""
+import asyncio
+import logging
+import os
+import threading
+
+import cv2
+import httpx
+import numpy as np
+
+from mask_codec import decode_mask
+
+logger = logging.getLogger("volume-client")
+
+VOLUME_BASE_URL = os.getenv("VOLUME_BASE_URL", "http://127.0.0.1:8000")
+VOLUME_IN_PROCESS = os.getenv("VOLUME_IN_PROCESS", "0") == "1"
+VOLUME_TIMEOUT = float(os.getenv("VOLUME_TIMEOUT", "60"))  # 单次调用总时限（含排队等待），秒
+VOLUME_CONNECT_TIMEOUT = float(os.getenv("VOLUME_CONNECT_TIMEOUT", "3"))
+VOLUME_MAX_CONCURRENCY = int(os.getenv("VOLUME_MAX_CONCURRENCY", "16"))
+VOLUME_MAX_KEEPALIVE = int(os.getenv("VOLUME_MAX_KEEPALIVE", "8"))
+
+
+class VolumeServiceError(RuntimeError):
+    """体积服务不可达或返回错误"""
+
+
+class VolumeInputError(ValueError):
+    """图片无法估算体积（未检测到手掌等）"""
+
+
+_engine = None
+_engine_failed = False
+_engine_lock = threading.Lock()
+
+_client = None
+_semaphore = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """在事件循环内首次使用时创建共享客户端与并发信号量"""
+    global _client, _semaphore
+    if _client is None:
+        _client = httpx.AsyncClient(
+            base_url=VOLUME_BASE_URL,
+            timeout=httpx.Timeout(VOLUME_TIMEOUT, connect=VOLUME_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=VOLUME_MAX_CONCURRENCY,
+                                max_keepalive_connections=VOLUME_MAX_KEEPALIVE),
+        )
+        _semaphore = asyncio.Semaphore(VOLUME_MAX_CONCURRENCY)
+    return _client
+
+
+async def aclose():
+    """服务关闭时释放连接池"""
+    global _client, _semaphore
+    if _client is not None:
+        await _client.aclose()
+        _client, _semaphore = None, None
+
+
+def get_engine():
+    """按需导入体积引擎并加载默认深度后端；失败后不再重试，一律走 HTTP"""
+    global _engine, _engine_failed
+    if not VOLUME_IN_PROCESS or _engine_failed:
+        return None
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None and not _engine_failed:
+                try:
+                    import volume_engine
+                    volume_engine.warm_up()
+                    _engine = volume_engine
+                except Exception as e:
+                    _engine_failed = True
+                    logger.warning(f"体积引擎加载失败，改用 HTTP 体积服务：{e}")
+    return _engine
+
+
+async def estimate_volume(hand_length_cm: float, img_bgr: np.ndarray = None, img_bytes: bytes = None,
+                          return_mask: bool = False) -> dict:
+    """img_bgr 为已解码图片（进程内估算时使用，调用后不得再修改），img_bytes 为 HTTP 回退时上传的原始字节"""
+    engine = get_engine() if img_bgr is not None else None
+    if engine is not None:
+        try:
+            result, food_only, _ = await engine.estimate_volume(img_bgr, hand_length_cm)
+        except engine.VolumeEstimationError as e:
+            raise VolumeInputError(str(e))
+        except engine.DepthBackendUnavailable as e:
+            raise VolumeServiceError(str(e))
+        result["food_mask"] = (food_only > 0).astype(np.uint8) if return_mask else None
+        return result
+
+    if img_bytes is None:
+        ok, buf = cv2.imencode(".jpg", img_bgr, [cv2.IMWRITE_JPEG_QUALITY, 95])
+        img_bytes = buf.tobytes()
+    try:
+        return await asyncio.wait_for(_post_volume(img_bytes, hand_length_cm, return_mask), VOLUME_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise VolumeServiceError(f"体积服务超时（{VOLUME_TIMEOUT:.0f}s）")
+
+
+async def _post_volume(img_bytes: bytes, hand_length_cm: float, return_mask: bool) -> dict:
+    client = get_client()
+    files = {"file": ("dish.jpg", img_bytes, "image/jpeg")}
+    data = {"hand_length_cm": str(hand_length_cm), "return_mask": "true" if return_mask else "false"}
+    try:
+        async with _semaphore:
+            resp = await client.post("/predict", files=files, data=data)
+    except httpx.HTTPError as e:
+        raise VolumeServiceError(f"体积服务调用失败：{e!r}")
+    if resp.status_code == 400:
+        raise VolumeInputError(resp.json().get("detail", "体积估算失败"))
+    if resp.status_code != 200:
+        raise VolumeServiceError(f"体积服务返回 {resp.status_code}")
+
+    js = resp.json()
+    rle = js.pop("food_mask_rle", None)
+    js["food_mask"] = await asyncio.to_thread(decode_mask, rle) if rle is not None else None
+    # 叠加图由体积服务按需渲染，补全为绝对地址
+    if "overlay_url" in js:
+        js["overlay_url"] = f"{VOLUME_BASE_URL}{js['overlay_url']}"
+    return js
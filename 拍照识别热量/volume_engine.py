@@ -0,0 +1,384 @@
+"""食物体积估算引擎
+
+把 volume.py 的体积估算流程封装为可直接导入的模块：输入已解码的 BGR ndarray，
+依次完成手掌检测、GrabCut 食物分割、深度推理（微批）与体积计算。
+- volume.py 在此之上提供 HTTP 接口；
+- 与体积服务部署在同一进程时，卡路里接口可直接调用 estimate_volume，
+  省去 JPEG 重编码、multipart 上传与服务端再次解码。
+"""
+import os
+import sys
+import threading
+import time
+import warnings
+
+import cv2
+import mediapipe as mp
+import numpy as np
+import torch
+from starlette.concurrency import run_in_threadpool
+
+from depth_backends import BACKENDS, DEFAULT_BACKEND, get_backend
+from inference_batcher import MicroBatcher
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from service_metrics import stage
+
+warnings.filterwarnings("ignore", category=UserWarning)
+
+
+class VolumeEstimationError(ValueError):
+    """输入图片无法估算体积（无法解码、未检测到手掌等），HTTP 层映射为 400"""
+
+
+class DepthBackendUnavailable(RuntimeError):
+    """深度后端加载失败，HTTP 层映射为 503"""
+
+
+# ---------- MediaPipe ----------
+mp_hands = mp.solutions.hands.Hands(static_image_mode=True, max_num_hands=1)
+mp_lock = threading.Lock()  # MediaPipe 图不支持并发 process，线程池中串行调用
+
+# ---------- 深度推理微批（每个后端一个队列） ----------
+DEPTH_BATCH_MAX_SIZE = int(os.getenv("DEPTH_BATCH_MAX_SIZE", "8"))
+DEPTH_BATCH_MAX_WAIT_MS = float(os.getenv("DEPTH_BATCH_MAX_WAIT_MS", "10"))
+depth_batchers = {}
+
+# ---------- 深度模式 ----------
+# full：整图推理并插值回原图分辨率（默认）
+# roi ：只对手掌凸包与食物掩膜的并集外接框推理，统计在不超过 DEPTH_ROI_MAX_SIDE 的分辨率上进行
+DEPTH_MODES = ("full", "roi")
+DEPTH_MODE = os.getenv("DEPTH_MODE", "full")
+DEPTH_ROI_MAX_SIDE = int(os.getenv("DEPTH_ROI_MAX_SIDE", "512"))
+DEPTH_ROI_INPUT_SIZE = int(os.getenv("DEPTH_ROI_INPUT_SIZE", "256"))
+DEPTH_ROI_PAD = 0.05
+
+
+def get_depth_batcher(backend) -> MicroBatcher:
+    batcher = depth_batchers.get(backend.name)
+    if batcher is None:
+        batcher = MicroBatcher(backend.forward, DEPTH_BATCH_MAX_SIZE, DEPTH_BATCH_MAX_WAIT_MS,
+                               name=backend.name)
+        depth_batchers[backend.name] = batcher
+    return batcher
+
+
+# ---------- 尺寸工具 ----------
+def bounded_size(w: int, h: int, max_side: int) -> tuple:
+    scale = min(1.0, max_side / max(w, h))
+    return max(1, int(round(w * scale))), max(1, int(round(h * scale)))
+
+
+# ---------- GrabCut ----------
+# 金字塔模式：GRABCUT_MAX_SIDE > 0 时先在缩小图上分割再放大掩膜，
+# GRABCUT_REFINE_BAND > 0 时再在原图分辨率上只细化掩膜边界带
+GRABCUT_ITERATIONS = int(os.getenv("GRABCUT_ITERATIONS", "5"))
+GRABCUT_MAX_SIDE = int(os.getenv("GRABCUT_MAX_SIDE", "0"))  # 0 表示直接在原图分辨率上分割
+GRABCUT_REFINE_BAND = int(os.getenv("GRABCUT_REFINE_BAND", "0"))  # 边界带半宽（原图像素）
+GRABCUT_REFINE_ITERATIONS = int(os.getenv("GRABCUT_REFINE_ITERATIONS", "2"))
+
+
+def refine_mask_boundary(rgb: np.ndarray, fg: np.ndarray, band: int, iterations: int) -> np.ndarray:
+    """只在放大后掩膜的边界带内重新运行 GrabCut，带外像素作为确定前景/背景"""
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * band + 1, 2 * band + 1))
+    inner = cv2.erode(fg, kernel)
+    band_mask = (cv2.dilate(fg, kernel) > 0) & (inner == 0)
+    if not band_mask.any():
+        return fg
+
+    gc_mask = np.where(inner > 0, cv2.GC_FGD, cv2.GC_BGD).astype(np.uint8)
+    gc_mask[band_mask & (fg > 0)] = cv2.GC_PR_FGD
+    gc_mask[band_mask & (fg == 0)] = cv2.GC_PR_BGD
+
+    # 只处理边界带外接框（外扩一个带宽，保证框内有确定的前景/背景样本）
+    ys, xs = np.nonzero(band_mask)
+    h, w = fg.shape[:2]
+    y0, y1 = max(0, ys.min() - band), min(h, ys.max() + band + 1)
+    x0, x1 = max(0, xs.min() - band), min(w, xs.max() + band + 1)
+    crop = gc_mask[y0:y1, x0:x1]
+    bgd = np.zeros((1, 65), np.float64)
+    fgd = np.zeros((1, 65), np.float64)
+    try:
+        cv2.grabCut(np.ascontiguousarray(rgb[y0:y1, x0:x1]), crop, None, bgd, fgd,
+                    iterations, cv2.GC_INIT_WITH_MASK)
+    except cv2.error:
+        # 框内缺少前景或背景样本时无法建模，保留放大结果
+        return fg
+
+    refined = fg.copy()
+    refined[y0:y1, x0:x1] = ((crop == cv2.GC_FGD) | (crop == cv2.GC_PR_FGD)).astype(np.uint8)
+    return refined
+
+
+def segment_food_grabcut(img: np.ndarray, iterations: int = None, max_side: int = None,
+                         refine_band: int = None) -> np.ndarray:
+    iterations = GRABCUT_ITERATIONS if iterations is None else iterations
+    max_side = GRABCUT_MAX_SIDE if max_side is None else max_side
+    refine_band = GRABCUT_REFINE_BAND if refine_band is None else refine_band
+
+    rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    h, w = rgb.shape[:2]
+    margin_x, margin_y = int(w * 0.1), int(h * 0.1)
+
+    # 工作分辨率
+    scale = min(1.0, max_side / max(h, w)) if max_side > 0 else 1.0
+    if scale < 1.0:
+        work = cv2.resize(rgb, bounded_size(w, h, max_side), interpolation=cv2.INTER_AREA)
+    else:
+        work = rgb
+    wh, ww = work.shape[:2]
+    wmx, wmy = int(ww * 0.1), int(wh * 0.1)
+    rect = (wmx, wmy, ww - 2 * wmx, wh - 2 * wmy)
+
+    mask = np.zeros((wh, ww), np.uint8)
+    bgd = np.zeros((1, 65), np.float64)
+    fgd = np.zeros((1, 65), np.float64)
+    cv2.grabCut(work, mask, rect, bgd, fgd, iterations, cv2.GC_INIT_WITH_RECT)
+    mask2 = np.where((mask == 2) | (mask == 0), 0, 1).astype("uint8")
+
+    if scale < 1.0:
+        mask2 = cv2.resize(mask2, (w, h), interpolation=cv2.INTER_NEAREST)
+        # 与原图分辨率下的矩形保持一致：框外一律为背景
+        outside = np.ones((h, w), bool)
+        outside[margin_y:h - margin_y, margin_x:w - margin_x] = False
+        mask2[outside] = 0
+        if refine_band > 0:
+            mask2 = refine_mask_boundary(rgb, mask2, refine_band, GRABCUT_REFINE_ITERATIONS)
+    return mask2 * 255
+
+
+# ---------- 手掌像素长度 ----------
+def palm_pixel_length(rgb: np.ndarray) -> float:
+    with mp_lock:
+        res = mp_hands.process(rgb)
+    if not res.multi_hand_landmarks:
+        return 0.0
+    lm = res.multi_hand_landmarks[0].landmark
+    wrist = np.array([lm[0].x * rgb.shape[1], lm[0].y * rgb.shape[0]])
+    mid_tip = np.array([lm[12].x * rgb.shape[1], lm[12].y * rgb.shape[0]])
+    return float(np.linalg.norm(mid_tip - wrist))
+
+
+# ---------- 深度归一化 ----------
+def normalize_depth(depth: np.ndarray) -> np.ndarray:
+    """归一化到 0-20（值越小表示离镜头越近）"""
+    return (depth - depth.min()) / (depth.max() - depth.min()) * 20.0
+
+
+# ---------- 厚度估计 ----------
+def estimate_thickness(food_mask: np.ndarray, depth_norm: np.ndarray) -> float:
+    """使用归一化深度图估计厚度，添加距离修正"""
+    COS_45 = 0.70710678
+
+    if not food_mask.any():
+        return 1.0
+
+    # 获取食物区域的平均深度（距离）
+    food_depth_mean = float(np.mean(depth_norm[food_mask > 0]))
+
+    # 距离越近（深度值越小），厚度修正系数越小
+    # 当食物比平均场景更近时，缩小厚度估计
+    distance_factor = min(1.0, food_depth_mean / depth_norm.mean())
+
+    # 应用距离因子修正厚度
+    thickness = float(np.median(depth_norm[food_mask > 0])) * COS_45 * distance_factor
+    return max(thickness, 0.1)  # 确保厚度不为负
+
+
+# ---------- 图像分析：手掌检测、食物分割 ----------
+def decode_image(img_bytes: bytes) -> np.ndarray:
+    img = cv2.imdecode(np.frombuffer(img_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise VolumeEstimationError("图片解码失败")
+    return img
+
+
+def analyze_image(img: np.ndarray):
+    """img 为 BGR ndarray，返回 (rgb, palm_px, food_only, hand_mask)"""
+    rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+    # 检测手掌像素长度
+    with stage("hand_detection"):
+        palm_px = palm_pixel_length(rgb)
+    if palm_px == 0:
+        raise VolumeEstimationError("未检测到手掌")
+
+    # 食物分割
+    with stage("segmentation"):
+        food_mask = segment_food_grabcut(img)
+
+    # 手掌掩膜
+    hand_mask = np.zeros_like(food_mask, dtype=np.uint8)
+    with stage("hand_detection"):
+        with mp_lock:
+            res = mp_hands.process(rgb)
+    if res.multi_hand_landmarks:
+        pts = [[int(lm.x * rgb.shape[1]), int(lm.y * rgb.shape[0])]
+               for lm in res.multi_hand_landmarks[0].landmark]
+        cv2.fillPoly(hand_mask, [cv2.convexHull(np.array(pts))], 255)
+
+    # 移除手掌区域
+    food_only = food_mask & (~hand_mask.astype(bool))
+    if not np.count_nonzero(hand_mask):
+        raise VolumeEstimationError("手掌掩膜像素为 0")
+    return rgb, palm_px, food_only, hand_mask
+
+
+# ---------- ROI：手掌与食物掩膜并集的外接框 ----------
+def depth_roi(food_only: np.ndarray, hand_mask: np.ndarray, pad: float = DEPTH_ROI_PAD):
+    ys, xs = np.nonzero((food_only > 0) | (hand_mask > 0))
+    h, w = hand_mask.shape[:2]
+    x0, x1, y0, y1 = int(xs.min()), int(xs.max()) + 1, int(ys.min()), int(ys.max()) + 1
+    pad_x, pad_y = int((x1 - x0) * pad), int((y1 - y0) * pad)
+    return max(0, x0 - pad_x), max(0, y0 - pad_y), min(w, x1 + pad_x), min(h, y1 + pad_y)
+
+
+def resize_mask(mask: np.ndarray, size: tuple) -> np.ndarray:
+    """按面积缩放二值掩膜，覆盖过半的像素记为前景"""
+    binary = (mask > 0).astype(np.uint8) * 255
+    if binary.shape[1] == size[0] and binary.shape[0] == size[1]:
+        return binary
+    return (cv2.resize(binary, size, interpolation=cv2.INTER_AREA) > 127).astype(np.uint8)
+
+
+# ---------- 深度推理：预处理在线程池，前向进入微批队列 ----------
+@stage("depth")
+async def infer_depth(backend, rgb: np.ndarray, size: int = None) -> torch.Tensor:
+    pixel_values = await run_in_threadpool(backend.preprocess, [rgb], size)
+    return await get_depth_batcher(backend).submit(pixel_values)
+
+
+
+# ---------- 深度图插值到统计分辨率 ----------
+def upsample_depth(depth: torch.Tensor, size: tuple) -> np.ndarray:
+    """size 为 (h, w)"""
+    return torch.nn.functional.interpolate(
+        depth.detach()[None, None],
+        size=size,
+        mode="bicubic",
+        align_corners=False
+    ).squeeze().cpu().numpy()
+
+
+# ---------- 体积计算 ----------
+@stage("volume_measure")
+def measure_volume(rgb: np.ndarray, depth: torch.Tensor, food_only: np.ndarray,
+                   hand_mask: np.ndarray, palm_px: float, hand_length_cm: float,
+                   bowl_factor: float, dish_type: str, roi: tuple = None) -> dict:
+    # 计算比例尺 (cm/px)
+    scale_cm_per_px = hand_length_cm / palm_px
+    # 食物像素面积始终按原图分辨率统计
+    food_px = int(np.count_nonzero(food_only))
+
+    # 深度统计所用的掩膜与分辨率：full 为原图；roi 为裁剪并限制边长后的分辨率
+    if roi is None:
+        out_w, out_h = rgb.shape[1], rgb.shape[0]
+        food_stat, hand_stat = food_only, hand_mask
+    else:
+        x0, y0, x1, y1 = roi
+        out_w, out_h = bounded_size(x1 - x0, y1 - y0, DEPTH_ROI_MAX_SIDE)
+        food_stat = resize_mask(food_only[y0:y1, x0:x1], (out_w, out_h))
+        hand_stat = resize_mask(hand_mask[y0:y1, x0:x1], (out_w, out_h))
+
+    depth = upsample_depth(depth, (out_h, out_w))
+
+    # 归一化深度图（值越小表示离镜头越近），厚度估计复用同一份
+    depth_norm = normalize_depth(depth)
+
+    # 计算手掌和食物的平均深度
+    hand_depth = float(np.mean(depth_norm[hand_stat > 0]))
+    food_depth = float(np.mean(depth_norm[food_stat > 0]))
+
+    # 深度比例计算 - 添加透视修正
+    # 当食物离镜头更近（food_depth < hand_depth）时，缩小面积
+    perspective_factor = 1.0
+    if hand_depth > 0:
+        depth_ratio = food_depth / hand_depth
+        # 应用非线性修正，增强近距缩小效果
+        if food_depth < hand_depth:
+            # 食物越近，缩小因子越大
+            perspective_factor = (food_depth / hand_depth) ** 1.5
+        depth_ratio *= perspective_factor
+    else:
+        depth_ratio = 1.0
+
+    # 透视修正后的食物面积 (cm²)
+    food_px_corrected = food_px * depth_ratio
+    food_area_cm2 = food_px_corrected * (scale_cm_per_px ** 2)
+
+    # 厚度估计（传入深度图用于距离修正）
+    thickness_cm = estimate_thickness(food_stat, depth_norm)
+
+    # 体积计算 (考虑容器类型)
+    if dish_type == "bowl":
+        volume_cm3 = food_area_cm2 * thickness_cm * 2.0 / 3.0 * bowl_factor
+    else:
+        volume_cm3 = food_area_cm2 * thickness_cm * bowl_factor
+
+    return {
+        "food_area_cm2": float(round(food_area_cm2, 2)),
+        "thickness_cm": float(round(thickness_cm, 2)),
+        "volume_cm3": float(round(volume_cm3, 2)),
+        "depth_ratio": float(round(depth_ratio, 3)),
+        "perspective_factor": float(round(perspective_factor, 3)),
+        "scale_cm_per_px": float(round(scale_cm_per_px, 4)),
+        "hand_pixel_length": float(round(palm_px, 2)),
+        "dish_type": dish_type,
+        "depth_resolution": [out_h, out_w],
+    }
+
+
+# ---------- 后端与模式解析 ----------
+def resolve_backend(depth_backend: str = None, depth_mode: str = None):
+    backend_name = depth_backend or DEFAULT_BACKEND
+    if backend_name not in BACKENDS:
+        raise VolumeEstimationError(f"未知深度后端 '{backend_name}'，可选：{list(BACKENDS)}")
+    mode = depth_mode or DEPTH_MODE
+    if mode not in DEPTH_MODES:
+        raise VolumeEstimationError(f"未知深度模式 '{mode}'，可选：{list(DEPTH_MODES)}")
+    try:
+        backend = get_backend(backend_name)
+    except Exception as e:
+        raise DepthBackendUnavailable(f"深度后端 '{backend_name}' 不可用：{e}")
+    return backend, mode
+
+
+def warm_up(depth_backend: str = None):
+    """预先加载深度后端（默认后端），避免首个请求承担模型加载时间"""
+    return resolve_backend(depth_backend)[0]
+
+
+# ---------- 完整流程 ----------
+async def estimate_volume(img: np.ndarray, hand_length_cm: float, bowl_factor: float = 0.55,
+                          dish_type: str = "bowl", depth_backend: str = None, depth_mode: str = None):
+    """img 为 BGR ndarray（调用后不得再修改）
+
+    返回 (result, food_only, hand_mask)：result 为体积估算结果字典，两个掩膜供诊断与回传使用。
+    """
+    backend, mode = resolve_backend(depth_backend, depth_mode)
+
+    # CPU 密集的步骤都放到线程池，事件循环只负责调度，使并发请求能在深度队列中合批
+    rgb, palm_px, food_only, hand_mask = await run_in_threadpool(analyze_image, img)
+
+    # 深度图估计（含排队时间）；roi 模式只对裁剪区域以较小输入尺寸推理
+    roi = depth_roi(food_only, hand_mask) if mode == "roi" else None
+    t0 = time.perf_counter()
+    if roi is None:
+        depth = await infer_depth(backend, rgb)
+    else:
+        x0, y0, x1, y1 = roi
+        depth = await infer_depth(backend, rgb[y0:y1, x0:x1], DEPTH_ROI_INPUT_SIZE)
+    depth_ms = (time.perf_counter() - t0) * 1000
+
+    result = await run_in_threadpool(measure_volume, rgb, depth, food_only, hand_mask,
+                                     palm_px, hand_length_cm, bowl_factor, dish_type, roi)
+    result.update({
+        "depth_backend": backend.name,
+        "depth_mode": mode,
+        "depth_ms": float(round(depth_ms, 1)),
+    })
+    return result, food_only, hand_mask
+
+
+def batching_stats() -> dict:
+    return {name: batcher.stats() for name, batcher in depth_batchers.items()}
@@ -1,11 +1,18 @@
+import os
+import sys
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from database import ExerciseDatabase
 from recommender import ExerciseRecommender
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from db_pool import mysql_pool
+from service_metrics import instrument_flask, register_pool
 import json
 
 app = Flask(__name__)
 CORS(app)  # 允许跨域请求
+instrument_flask(app, "exercise")
 
 # 数据库配置
 DB_CONFIG = {
@@ -15,6 +22,10 @@ DB_CONFIG = {
     "password": "123456"
 }
 
+# 进程级连接池：每个请求借出一条连接，结束时归还
+db_pool = mysql_pool("exercise", DB_CONFIG)
+register_pool("exercise", db_pool.stats)
+
 @app.route('/api/recommend', methods=['POST'])
 def recommend_exercises():
     """接收用户数据，返回运动推荐结果"""
@@ -77,20 +88,21 @@ def recommend_exercises():
         }
         user_data["weeks"] = intensity_weeks_map[user_data["intensity"]]
 
-        # 初始化数据库连接
-        db = ExerciseDatabase(**DB_CONFIG)
+        # 从连接池借出数据库连接
+        db = ExerciseDatabase(**DB_CONFIG, pool=db_pool)
         if not db.connect():
             return jsonify({"error": "Database connection failed"}), 500
 
-        # 初始化推荐器
-        recommender = ExerciseRecommender(db)
-
-        # 获取推荐结果
-        recommendations = recommender.recommend_exercises(user_data)
-        formatted_result = recommender.format_recommendations(recommendations)
-
-        # 关闭数据库连接
-        db.close()
+        try:
+            # 初始化推荐器
+            recommender = ExerciseRecommender(db)
+
+            # 获取推荐结果
+            recommendations = recommender.recommend_exercises(user_data)
+            formatted_result = recommender.format_recommendations(recommendations)
+        finally:
+            # 归还数据库连接（异常时也归还，避免连接泄漏）
+            db.close()
 
         # 返回JSON结果
         return jsonify({
@@ -1,23 +1,50 @@
+import os
+import sys
 import mysql.connector
 from mysql.connector import Error
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from db_pool import PoolTimeout
+from service_metrics import stage
+
+EXERCISES_BY_TYPE = """
+            SELECT exercise_id, exercise_name, type, met, 
+                   calories_burned_per_ten_minutes, duration_type
+            FROM exercise_dict 
+            WHERE type = %s
+            """
+
 class ExerciseDatabase:
-    def __init__(self, host, database, user, password):
+    def __init__(self, host, database, user, password, pool=None):
+        """pool 为 common/db_pool.py 的连接池时，connect() 从池中借出一条连接、close() 归还，
+        查询使用该连接上缓存的预处理语句；否则每个实例单独建立连接"""
         self.host = host
         self.database = database
         self.user = user
         self.password = password
+        self.pool = pool
         self.connection = None
+        self._lease = None
         
     def connect(self):
         """建立数据库连接"""
+        if self.pool is not None:
+            try:
+                if self._lease is None:
+                    self._lease = self.pool.acquire()
+                    self.connection = self._lease.raw
+                return True
+            except (Error, PoolTimeout) as e:
+                print(f"数据库连接错误: {e}")
+                return False
         try:
-            self.connection = mysql.connector.connect(
-                host=self.host,
-                database=self.database,
-                user=self.user,
-                password=self.password
-            )
+            with stage("db_connect"):
+                self.connection = mysql.connector.connect(
+                    host=self.host,
+                    database=self.database,
+                    user=self.user,
+                    password=self.password
+                )
             return self.connection.is_connected()
         except Error as e:
             print(f"数据库连接错误: {e}")
@@ -25,20 +52,27 @@ class ExerciseDatabase:
             
     def get_exercises_by_type(self, type_id):
         """根据运动类型获取运动列表，包含duration_type字段"""
+        if self.pool is not None:
+            if not self.connect():
+                return []
+            try:
+                return self._lease.execute(EXERCISES_BY_TYPE, (type_id,))
+            except Error as e:
+                print(f"查询错误: {e}")
+                # 连接状态未知，丢弃后下次查询重新借出
+                self.pool.release(self._lease, discard=True)
+                self._lease = self.connection = None
+                return []
+
         if not self.connection or not self.connection.is_connected():
             if not self.connect():
                 return []
                 
         try:
             cursor = self.connection.cursor(dictionary=True)
-            query = """
-            SELECT exercise_id, exercise_name, type, met, 
-                   calories_burned_per_ten_minutes, duration_type
-            FROM exercise_dict 
-            WHERE type = %s
-            """
-            cursor.execute(query, (type_id,))
-            return cursor.fetchall()
+            with stage("db_lookup"):
+                cursor.execute(EXERCISES_BY_TYPE, (type_id,))
+                return cursor.fetchall()
         except Error as e:
             print(f"查询错误: {e}")
             return []
@@ -47,7 +81,12 @@ class ExerciseDatabase:
                 cursor.close()
                 
     def close(self):
-        """关闭数据库连接"""
+        """关闭数据库连接（连接池模式下归还连接）"""
+        if self.pool is not None:
+            if self._lease is not None:
+                self.pool.release(self._lease)
+                self._lease = self.connection = None
+            return
         if self.connection and self.connection.is_connected():
             self.connection.close()
     
\ No newline at end of file